@@ -8,6 +8,7 @@ requirements = [
 extras_requirements = {
     'extended': ['Jinja2', 'colorama', ],
     'secure': ['cryptography', ],
+    'mx': ['dnspython', ],
 }
 
 with open('README.md') as f:
@@ -0,0 +1,377 @@
+__all__ = ['AsyncSender', 'AsyncSMTPSession']
+
+import asyncio
+import base64
+import hmac
+import smtplib
+import socket
+import ssl
+from email.mime.base import MIMEBase
+from typing import Optional, List, Union, NoReturn, Tuple, Iterable, Dict
+
+import structlog
+
+from . import mime
+from .enums import DeliveryMode, SMTPAuthMethod
+from .errors import ConnectionFailedError, UnsupportedFeatureError
+from .message import Sender, SendResult, message_to_bytes
+from .stream import MessageStream, encode_data
+
+logger = structlog.get_logger()
+CRLF = b'\r\n'
+# order of preference, the same as in smtplib
+AUTH_METHODS_PREFERENCE = (SMTPAuthMethod.CRAM_MD5, SMTPAuthMethod.PLAIN, SMTPAuthMethod.LOGIN)
+
+
+class AsyncSMTPSession:
+    """Single SMTP session over asyncio streams.
+
+    Mimics interface and semantics of smtplib.SMTP (replies, exceptions, esmtp_features)
+    for the commands used by SMTPc."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str,
+        timeout: Optional[float] = None,
+    ) -> NoReturn:
+        self.reader = reader
+        self.writer = writer
+        self._plain_writer: Optional[asyncio.StreamWriter] = None
+        self.host = host
+        self.timeout = timeout
+        self.esmtp_features: Dict[str, str] = {}
+        self.does_esmtp = False
+
+    @classmethod
+    async def open(cls, host: str, port: int, *,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        source_address: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple['AsyncSMTPSession', int, bytes]:
+        local_addr = (source_address, 0) if source_address else None
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl_context, local_addr=local_addr,
+                server_hostname=host if ssl_context else None),
+            timeout,
+        )
+        session = cls(reader, writer, host, timeout)
+        code, message = await session.getreply()
+        if code != 220:
+            await session.close()
+            raise smtplib.SMTPConnectError(code, message)
+        return session, code, message
+
+    async def getreply(self) -> Tuple[int, bytes]:
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if not line:
+                raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+            code, sep, text = line[:3], line[3:4], line[4:].strip()
+            lines.append(text)
+            if sep != b'-':
+                break
+
+        try:
+            code = int(code)
+        except ValueError:
+            code = -1
+        return code, b'\n'.join(lines)
+
+    async def command(self, line: str, encoding: str = 'ascii') -> Tuple[int, bytes]:
+        self.writer.write(line.encode(encoding) + CRLF)
+        await self.writer.drain()
+        return await self.getreply()
+
+    async def ehlo(self, name: str) -> Tuple[int, bytes]:
+        code, message = await self.command(f'EHLO {name}')
+        if code == 250:
+            self.does_esmtp = True
+            self.esmtp_features = {}
+            for item in message.decode('latin-1').split('\n')[1:]:
+                feature, _, params = item.partition(' ')
+                self.esmtp_features[feature.lower()] = params.strip()
+        return code, message
+
+    async def helo(self, name: str) -> Tuple[int, bytes]:
+        return await self.command(f'HELO {name}')
+
+    def has_extn(self, name: str) -> bool:
+        return name.lower() in self.esmtp_features
+
+    async def starttls(self, context: ssl.SSLContext) -> NoReturn:
+        code, message = await self.command('STARTTLS')
+        if code != 220:
+            raise smtplib.SMTPResponseException(code, message)
+
+        if hasattr(self.writer, 'start_tls'):
+            await self.writer.start_tls(context, server_hostname=self.host)
+        else:
+            # before Python 3.11 streams can't be upgraded to TLS, so create new ones over the TLS transport
+            loop = asyncio.get_running_loop()
+            await self.writer.drain()
+            reader = asyncio.StreamReader(loop=loop)
+            protocol = asyncio.StreamReaderProtocol(reader, loop=loop)
+            transport = await loop.start_tls(self.writer.transport, protocol, context, server_hostname=self.host)
+            protocol.connection_made(transport)
+            # plain writer is kept, as garbage collected StreamWriter closes its transport (the one under TLS)
+            self._plain_writer = self.writer
+            self.reader, self.writer = reader, asyncio.StreamWriter(transport, protocol, reader, loop)
+
+        self.esmtp_features = {}
+        self.does_esmtp = False
+
+    async def auth(self, login: str, password: str, method: Optional[SMTPAuthMethod] = None) -> NoReturn:
+        if not self.has_extn('auth'):
+            raise smtplib.SMTPNotSupportedError('SMTP AUTH extension not supported by server.')
+
+        if method in AUTH_METHODS_PREFERENCE:
+            methods = [method]
+        else:
+            advertised = self.esmtp_features['auth'].upper().split()
+            methods = [item for item in AUTH_METHODS_PREFERENCE if item.value.upper().replace('_', '-') in advertised]
+            if not methods:
+                raise smtplib.SMTPException('No suitable authentication method found.')
+
+        code, message = None, None
+        for method in methods:
+            code, message = await self._auth(method, login, password)
+            if code in (235, 503):
+                return
+        raise smtplib.SMTPAuthenticationError(code, message)
+
+    async def _auth(self, method: SMTPAuthMethod, login: str, password: str) -> Tuple[int, bytes]:
+        if method == SMTPAuthMethod.PLAIN:
+            token = base64.b64encode(f'\0{login}\0{password}'.encode()).decode('ascii')
+            return await self.command(f'AUTH PLAIN {token}')
+
+        if method == SMTPAuthMethod.LOGIN:
+            code, message = await self.command('AUTH LOGIN')
+            if code == 334:
+                code, message = await self.command(base64.b64encode(login.encode()).decode('ascii'))
+            if code == 334:
+                code, message = await self.command(base64.b64encode(password.encode()).decode('ascii'))
+            return code, message
+
+        code, message = await self.command('AUTH CRAM-MD5')
+        if code == 334:
+            challenge = base64.b64decode(message)
+            digest = hmac.HMAC(password.encode('ascii'), challenge, 'md5').hexdigest()
+            code, message = await self.command(base64.b64encode(f'{login} {digest}'.encode()).decode('ascii'))
+        return code, message
+
+    async def sendmail(self, envelope_from: str, envelope_to: List[str], message: Union[bytes, MessageStream],
+        mail_options: Iterable[str] = (),
+    ) -> Dict[str, Tuple[int, bytes]]:
+        mail_options = list(mail_options)
+        encoding = 'ascii'
+        # internationalized addresses (RFC 6531)
+        if not all(address.isascii() for address in [envelope_from, *envelope_to]):
+            if not self.has_extn('smtputf8'):
+                raise smtplib.SMTPNotSupportedError('Server does not support SMTPUTF8, cannot use non-ASCII addresses')
+            encoding = 'utf-8'
+            if 'SMTPUTF8' not in mail_options:
+                mail_options.append('SMTPUTF8')
+
+        options = ''.join(f' {item}' for item in mail_options)
+        commands = [f'MAIL FROM:{smtplib.quoteaddr(envelope_from)}{options}']
+        commands.extend(f'RCPT TO:{smtplib.quoteaddr(address)}' for address in envelope_to)
+        if self.has_extn('pipelining'):
+            self.writer.write(b''.join(command.encode(encoding) + CRLF for command in commands))
+            await self.writer.drain()
+            replies = [await self.getreply() for _ in commands]
+        else:
+            replies = []
+            for command in commands:
+                replies.append(await self.command(command, encoding))
+                if replies[0][0] != 250:
+                    break
+
+        code, response = replies[0]
+        if code != 250:
+            await self.rset()
+            raise smtplib.SMTPSenderRefused(code, response, envelope_from)
+
+        rejects = {}
+        for address, (code, response) in zip(envelope_to, replies[1:]):
+            if code not in (250, 251):
+                rejects[address] = (code, response)
+
+        if len(rejects) == len(envelope_to):
+            await self.rset()
+            raise smtplib.SMTPRecipientsRefused(rejects)
+
+        code, response = await self.data(message)
+        if code != 250:
+            await self.rset()
+            raise smtplib.SMTPDataError(code, response)
+
+        return rejects
+
+    async def data(self, message: Union[bytes, MessageStream]) -> Tuple[int, bytes]:
+        code, response = await self.command('DATA')
+        if code != 354:
+            raise smtplib.SMTPDataError(code, response)
+
+        for chunk in encode_data(message.chunks() if isinstance(message, MessageStream) else [message]):
+            self.writer.write(chunk)
+            await self.writer.drain()
+        return await self.getreply()
+
+    async def rset(self) -> Tuple[int, bytes]:
+        return await self.command('RSET')
+
+    async def noop(self) -> Tuple[int, bytes]:
+        return await self.command('NOOP')
+
+    async def quit(self) -> NoReturn:
+        try:
+            await self.command('QUIT')
+        except (smtplib.SMTPException, OSError, asyncio.TimeoutError):
+            pass
+        await self.close()
+
+    async def close(self) -> NoReturn:
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (OSError, ssl.SSLError):
+            pass
+
+
+class AsyncSender(Sender):
+    """Asyncio version of Sender, able to handle many concurrent SMTP sessions in a single thread.
+
+    Accepts the same arguments as Sender (profile resolution is shared), but `execute`, `connect`, `send` and
+    `execute_many` are coroutines. Interactive SMTP session, SMTP debug printing and MX delivery are not supported."""
+
+    __slots__ = ()
+
+    def __init__(self, **kwargs) -> NoReturn:
+        super().__init__(**kwargs)
+        if self.delivery == DeliveryMode.MX:
+            raise UnsupportedFeatureError('MX delivery is not supported by AsyncSender, use Sender instead')
+
+    async def execute(self) -> List[str]:
+        if self.dry_run:
+            self._log_connecting(self.host, self.port)
+            return []
+
+        envelope_from, envelope_to = self.envelope()
+        await self.async_wait_for_rate_limit()
+        session = await self.connect()
+        try:
+            rejects = await self.send(session, self.message_body, envelope_from, envelope_to)
+        finally:
+            await session.quit()
+
+        return self.accepted_recipients(envelope_to, rejects)
+
+    async def execute_many(self, messages: Iterable[Tuple[Union[MIMEBase, str], str, List[str]]],
+        concurrency: int = 1,
+    ) -> List[SendResult]:
+        """Send every (message_body, envelope_from, envelope_to) item using `concurrency` parallel SMTP sessions.
+
+        Every session is opened lazily and reused for the next messages (with RSET between transactions).
+        Results are returned in the same order as messages."""
+        queue = asyncio.Queue(maxsize=concurrency * 2)
+        results: Dict[int, SendResult] = {}
+
+        async def _feed() -> NoReturn:
+            for idx, item in enumerate(messages):
+                await queue.put((idx, item))
+            for _ in range(concurrency):
+                await queue.put(None)
+
+        async def _worker() -> NoReturn:
+            session = None
+            try:
+                while True:
+                    job = await queue.get()
+                    if job is None:
+                        return
+                    idx, (message_body, envelope_from, envelope_to) = job
+                    await self.async_wait_for_rate_limit()
+
+                    try:
+                        if session is None:
+                            session = await self.connect()
+                        else:
+                            await session.rset()
+                        rejects = await self.send(session, message_body, envelope_from, envelope_to)
+                    except (smtplib.SMTPSenderRefused, smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError,
+                            smtplib.SMTPNotSupportedError) as exc:
+                        results[idx] = SendResult(envelope_to, error=exc)
+                    except (ConnectionFailedError, OSError, asyncio.TimeoutError) as exc:
+                        # SMTPException is OSError too, session is in unknown state, so just drop it
+                        if session is not None:
+                            await session.close()
+                        session = None
+                        results[idx] = SendResult(envelope_to, error=exc)
+                    else:
+                        results[idx] = SendResult(self.accepted_recipients(envelope_to, rejects), rejects=rejects)
+            finally:
+                if session is not None:
+                    await session.quit()
+
+        workers = [asyncio.ensure_future(_worker()) for _ in range(concurrency)]
+        try:
+            await asyncio.gather(_feed(), *workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+        return [results[idx] for idx in sorted(results)]
+
+    async def async_wait_for_rate_limit(self) -> NoReturn:
+        # waiting for rate limiter blocks (on file lock and sleep), so don't do it in the event loop
+        if self.rate_limiter:
+            await asyncio.get_running_loop().run_in_executor(None, self.wait_for_rate_limit)
+
+    async def connect(self, host: Optional[str] = None, port: Optional[int] = None) -> AsyncSMTPSession:
+        host = host or self.host
+        port = port or self.port
+
+        self._log_connecting(host, port)
+        # asyncio wraps sockets using SSLObject, so sessions are not resumed, but context is still shared
+        context = self.ssl_context if self.ssl or self.tls else None
+        try:
+            session, smtp_code, smtp_message = await AsyncSMTPSession.open(host, port,
+                ssl_context=context if self.ssl else None, source_address=self.source_address,
+                timeout=self.connection_timeout)
+            logger.debug('connected', host=host, port=port, source_address=self.source_address,
+                smtp_code=smtp_code, smtp_message=smtp_message.decode())
+        except Exception as exc:
+            self.log_exception('connection error', host=host, port=port, message=str(exc), exception=exc.__class__.__name__)
+            raise ConnectionFailedError(f'Cannot connect to {host}:{port}: {exc}') from exc
+
+        await self._ehlo_or_helo(session)
+
+        if self.tls:
+            logger.debug('upgrading connection to tls')
+            await session.starttls(context)
+            await self._ehlo_or_helo(session)
+
+        if self.login and self.password:
+            logger.debug('authorizing', login=self.login, auth_method=self.auth_method)
+            await session.auth(self.login, self.password, self.auth_method)
+
+        return session
+
+    async def send(self, session: AsyncSMTPSession, message_body: Union[MIMEBase, str, bytes, MessageStream],
+        envelope_from: str, envelope_to: List[str],
+    ) -> dict:
+        mail_options = self.mail_options(session, message_body, envelope_from, envelope_to)
+        if mime.has_8bit(message_body) and not session.has_extn('8bitmime'):
+            message_body = mime.downgrade_8bit(message_body)
+
+        if not isinstance(message_body, MessageStream):
+            message_body = message_to_bytes(message_body)
+        rejects = await session.sendmail(envelope_from, envelope_to, message_body, mail_options)
+        logger.debug('message sent', recipients=envelope_to, rejects=rejects or None)
+        return rejects
+
+    async def _ehlo_or_helo(self, session: AsyncSMTPSession) -> NoReturn:
+        name = self.identify_as or socket.getfqdn()
+        if self.disable_ehlo or not (200 <= (await session.ehlo(name))[0] <= 299):
+            code, resp = await session.helo(name)
+            if not (200 <= code <= 299):
+                raise smtplib.SMTPHeloError(code, resp)
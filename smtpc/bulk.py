@@ -0,0 +1,129 @@
+__all__ = ['ADDRESS_COLUMNS', 'detect_rows_format', 'read_rows', 'render_rows', 'split_row']
+
+import collections
+import concurrent.futures
+import csv
+import itertools
+import json
+import pathlib
+import sys
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from .enums import RowsFormat
+from .errors import InvalidRowError
+from .message import Builder, CompiledMessage
+from .stream import MessageStream
+
+# columns which are not only template fields, but also override recipients of the message
+ADDRESS_COLUMNS = {
+    'to': 'address_to',
+    'cc': 'address_cc',
+    'bcc': 'address_bcc',
+    'envelope_to': 'envelope_to',
+}
+ROWS_FORMAT_BY_SUFFIX = {
+    '.csv': RowsFormat.CSV,
+    '.jsonl': RowsFormat.JSONL,
+    '.ndjson': RowsFormat.JSONL,
+    '.json': RowsFormat.JSONL,
+}
+# number of rows rendered by worker process at once, and number of batches per process rendered ahead of sending
+RENDER_BATCH_SIZE = 16
+RENDER_QUEUE_SIZE = 2
+
+# message compiled in worker process of render_rows
+_worker_compiled: Optional[CompiledMessage] = None
+
+
+def detect_rows_format(path: str) -> Optional[RowsFormat]:
+    if path == '-':
+        return None
+    return ROWS_FORMAT_BY_SUFFIX.get(pathlib.Path(path).suffix.lower())
+
+
+def read_rows(path: str, rows_format: RowsFormat) -> Iterator[dict]:
+    if path == '-':
+        yield from _read_rows(sys.stdin, rows_format)
+        return
+
+    with open(path, 'r', newline='') as fh:
+        yield from _read_rows(fh, rows_format)
+
+
+def _read_rows(fh, rows_format: RowsFormat) -> Iterator[dict]:  # noqa: ANN001
+    if rows_format == RowsFormat.CSV:
+        yield from csv.DictReader(fh)
+        return
+
+    for line_no, line in enumerate(fh, 1):
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            row = json.loads(line)
+        except json.decoder.JSONDecodeError as exc:
+            raise InvalidRowError(f"Invalid json in line {line_no}: {exc}")
+
+        if not isinstance(row, dict):
+            raise InvalidRowError(f"Invalid row in line {line_no}: expected json object")
+
+        yield row
+
+
+def split_row(row: dict) -> Tuple[dict, dict]:
+    """Extract recipients overrides from row. Returns tuple of (addresses, template context).
+
+    Address columns are still available as template fields."""
+    addresses = {}
+    for column, field in ADDRESS_COLUMNS.items():
+        value = row.get(column)
+        if not value:
+            continue
+        if isinstance(value, str):
+            value = [item.strip() for item in value.split(',') if item.strip()]
+        addresses[field] = value
+
+    return addresses, dict(row)
+
+
+def render_rows(builder: Builder, rows: Iterable[dict], processes: int = 1) -> Iterator[Tuple[MessageStream, str, List[str]]]:
+    """Render message for every row, yields tuples of (message, envelope from, envelope to) in order of rows.
+
+    With `processes` > 1 templates are rendered in that many worker processes (message is compiled once in
+    every one of them), in batches of RENDER_BATCH_SIZE rows. At most RENDER_QUEUE_SIZE batches per process
+    are rendered ahead of the consumer, so when sending is slower than rendering, reading of next rows waits."""
+    if processes <= 1:
+        compiled = builder.compile()
+        for row in rows:
+            yield _render_row(compiled, row)
+        return
+
+    rows = iter(rows)
+    pending = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(processes, initializer=_init_render_worker, initargs=(builder,)) as executor:
+        try:
+            for batch in iter(lambda: list(itertools.islice(rows, RENDER_BATCH_SIZE)), []):
+                if len(pending) >= processes * RENDER_QUEUE_SIZE:
+                    yield from pending.popleft().result()
+                pending.append(executor.submit(_render_batch, batch))
+
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _render_row(compiled: CompiledMessage, row: dict) -> Tuple[MessageStream, str, List[str]]:
+    addresses, template_context = split_row(row)
+    return (compiled.render(template_context, **addresses), *compiled.envelope(**addresses))
+
+
+def _init_render_worker(builder: Builder) -> None:
+    global _worker_compiled
+    _worker_compiled = builder.compile()
+
+
+def _render_batch(rows: List[dict]) -> List[Tuple[MessageStream, str, List[str]]]:
+    return [_render_row(_worker_compiled, row) for row in rows]
@@ -0,0 +1,146 @@
+__all__ = ['LRUCache', 'DiskLRUCache']
+
+import collections
+import os
+import pathlib
+import tempfile
+import threading
+from typing import Any, Hashable, List, NoReturn, Optional, Tuple
+
+import fileperms
+import structlog
+
+logger = structlog.get_logger()
+
+
+class LRUCache:
+    """Thread safe cache limited by total size of stored values, least recently used values are evicted first.
+
+    Values larger than whole cache are not stored at all."""
+
+    def __init__(self, max_size: int) -> NoReturn:
+        self.max_size = max_size
+        self.size = 0
+
+        self._lock = threading.Lock()
+        self._items: 'collections.OrderedDict[Hashable, tuple]' = collections.OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def set(self, key: Hashable, value: Any, size: int) -> NoReturn:
+        if size > self.max_size:
+            return
+
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self) -> NoReturn:
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __str__(self) -> str:
+        return f'<LRUCache items={len(self._items)}, size={self.size}, max_size={self.max_size}>'
+
+    __repr__ = __str__
+
+
+class DiskLRUCache:
+    """Cache of bytes kept in files (named after keys) in directory, limited by total size of the files.
+    Least recently used files (by modification time, updated on every hit) are removed first.
+
+    It can be shared by many processes: files are written atomically. Errors of file system are not raised,
+    cache just doesn't work then."""
+
+    def __init__(self, directory: pathlib.Path, max_size: int) -> NoReturn:
+        self.directory = directory
+        self.max_size = max_size
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.directory / key
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def set(self, key: str, value: bytes) -> NoReturn:
+        if len(value) > self.max_size:
+            return
+
+        dir_perms = fileperms.Permissions()
+        dir_perms.owner_read = True
+        dir_perms.owner_write = True
+        dir_perms.owner_exec = True
+        try:
+            self.directory.mkdir(mode=int(dir_perms), parents=True, exist_ok=True)
+            # temporary files start with dot, so they are skipped by eviction
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(value)
+            os.replace(tmp_path, self.directory / key)
+        except OSError as exc:
+            logger.debug('cannot save cache entry', path=str(self.directory), error=str(exc))
+            return
+
+        self._evict()
+
+    def clear(self) -> NoReturn:
+        for path, _, _ in self._entries():
+            _unlink(path)
+
+    def _evict(self) -> NoReturn:
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        size = sum(entry[2] for entry in entries)
+        for path, _, entry_size in entries:
+            if size <= self.max_size:
+                break
+            _unlink(path)
+            size -= entry_size
+
+    def _entries(self) -> List[Tuple[str, int, int]]:
+        """List of (path, mtime, size) of all cached files."""
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.startswith('.') or not entry.is_file():
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((entry.path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            pass
+        return entries
+
+    def __str__(self) -> str:
+        return f'<DiskLRUCache directory={self.directory}, max_size={self.max_size}>'
+
+    __repr__ = __str__
+
+
+def _unlink(path: str) -> NoReturn:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
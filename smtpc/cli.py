@@ -1,25 +1,40 @@
 import argparse
+import email.utils
 import getpass
+import json
 import logging
 import os
+import pathlib
 import select
+import signal
 import smtplib
 import subprocess  # noqa: S404 # nosec
 import sys
 import tempfile
 import textwrap
-from typing import Optional, NoReturn
+import threading
+import time
+from email.message import Message
+from email.mime.base import MIMEBase
+from typing import Optional, NoReturn, Iterable, Iterator, List, TextIO, Tuple, Union
 
 import structlog
-import toml.decoder
 
 from . import __version__
+from . import bulk
 from . import config
 from . import message
-from .enums import ExitCodes, ContentType, SMTPAuthMethod
-from .errors import SMTPcError
+from . import mime
+from . import mx
+from . import service
+from .cache import DiskLRUCache
+from .enums import ExitCodes, ContentType, SMTPAuthMethod, RowsFormat, DeliveryMode
+from .errors import SMTPcError, ConnectionFailedError, RateLimitError
+from .pool import ConnectionPool
 from .predefined_messages import PredefinedMessages, PredefinedMessage
 from .predefined_profiles import PredefinedProfiles, PredefinedProfile
+from .spool import Spool, SpoolEntry, retry_delay
+from .stream import FileMessageStream, MessageStream
 from .utils import exitc, determine_ssl_tls_by_port, get_editor
 
 try:
@@ -35,12 +50,14 @@ PREDEFINED_MESSAGES: Optional[PredefinedMessages] = None
 
 def parse_argv(argv: list) -> argparse.Namespace:
     content_type_choices = [item.lower() for item in ContentType.__members__]
+    rows_format_choices = [item.lower() for item in RowsFormat.__members__]
     auth_method_choices = [item.lower() for item in SMTPAuthMethod.__members__]
+    delivery_choices = [item.lower() for item in DeliveryMode.__members__]
     sentinel = object()
     body_params_epilog = textwrap.dedent('''
         BODY:
             Content of email is built using few params:
-                --body (or alias: --body-plain, or data from STDIN)
+                --body (or alias: --body-plain, or data from STDIN, or --body-file)
                 --body-html "some body"
                 --body-type (one of: plain, html, alternative)
                 --raw-body
@@ -50,7 +67,8 @@ def parse_argv(argv: list) -> argparse.Namespace:
             If --raw-body is used, then only value of --body param (or STDIN data) is used (--body-html and
             --body-type are ignored), and smtpc will not build message on itself, just use the value of --body param.
             Also --header, --subject or other header/content related params are ignored, and you need to build
-            whole message body on itself.
+            whole message body on itself. Raw message from --body-file or STDIN is streamed to the server in chunks,
+            so even very large messages are not loaded into memory.
 
             --body-html is used in only one two cases:
             - when --body-type is "html", and no --body/STDIN is used
@@ -111,6 +129,9 @@ def parse_argv(argv: list) -> argparse.Namespace:
         help='Source IP address to use when connecting.')
     p_send.add_argument('--disable-ehlo', action='store_true',
         help='Don\'t use ESMTP EHLO command, only HELO.')
+    p_send.add_argument('--delivery', choices=delivery_choices,
+        help='How to deliver messages: "smarthost" sends everything through --host, "mx" connects directly to MX '
+             'hosts of recipients domains (requires "dnspython" module). Default: smarthost.')
 
     # SEND command - message related stuff
     p_send.add_argument('--subject', '-j',
@@ -118,6 +139,9 @@ def parse_argv(argv: list) -> argparse.Namespace:
     p_send.add_argument('--body', '--body-plain', '-b',
         help='Body of email. See more below about --body, --body-html, --body-plain, --body-type and '
              '--raw-body params.')
+    p_send.add_argument('--body-file', metavar='FILE',
+        help='Read body of email from FILE ("-" for STDIN) instead of --body. With --raw-body message is streamed '
+             'from FILE to the server while sending, without loading it into memory.')
     p_send.add_argument('--body-type', choices=content_type_choices,
         help='Typehint for email Content-Type. See more below about --body, --body-html, --body-plain, --body-type '
              'and --raw-body params.')
@@ -150,6 +174,9 @@ def parse_argv(argv: list) -> argparse.Namespace:
         help='How to fill Reply-To header.')
     p_send.add_argument('--header', '-H', metavar='HEADER', dest='headers', action='append',
         help='Additional headers in format: HeaderName=HeaderValue. Can be used multiple times.')
+    p_send.add_argument('--attach', '-A', metavar='PATH', dest='attachments', action='append',
+        help='Attach file to the message. Can be used multiple times. Files are read and encoded while sending, '
+             'so they are never loaded into memory as a whole.')
     p_send.add_argument('--message-interactive', action='store_true',
         help='Just after creating raw message open editor with raw message body. '
              'Allow to edit and send modified version.')
@@ -157,6 +184,37 @@ def parse_argv(argv: list) -> argparse.Namespace:
         help='Makes SMTP session interactive, allow to view and edit every SMTP command.')
     p_send.add_argument('--message-dump', action='store_true',
         help='Dump built message body on stdout.')
+    p_send.add_argument('--rows', metavar='FILE',
+        help='Send one message per row from CSV or JSONL file ("-" for STDIN), using single SMTP session. '
+             'Every row is used as template fields, and columns: to, cc, bcc, envelope_to override recipients.')
+    p_send.add_argument('--rows-format', choices=rows_format_choices,
+        help='Format of --rows file. Default: detected by file extension.')
+    p_send.add_argument('--build-cache', action='store_true',
+        help='Reuse message built earlier with the same params and template fields, only Date and Message-ID '
+             'headers are generated again. Built messages are cached in "cache/builds" directory in SMTPc config '
+             'directory. Don\'t use it with templates giving different results every time (ie. random values).')
+    p_send.add_argument('--stream-templates', action='store_true',
+        help='Render templated bodies in pieces while message is sent, without keeping whole rendered body in memory. '
+             'Use it for very large bodies. Such parts are always base64 encoded.')
+    p_send.add_argument('--render-processes', type=int, default=1,
+        help='Number of processes rendering messages for --rows (use it for heavy templates), 0 means one per CPU. '
+             'Default: 1, messages are rendered in the main process.')
+    p_send.add_argument('--session-max-messages', type=int,
+        help='Maximum number of messages sent using single SMTP session, then new session is opened. '
+             'Default: unlimited.')
+    p_send.add_argument('--concurrency', type=int, default=1,
+        help='Number of parallel SMTP sessions. With --rows messages are spread across sessions, otherwise '
+             'recipients are split into groups, every one sent in separate transaction. Default: 1.')
+    p_send.add_argument('--reconnect-attempts', type=int, default=0,
+        help='How many times reconnect and send message again when SMTP session is lost. Default: 0.')
+    p_send.add_argument('--stream', action='store_true',
+        help='Read messages from STDIN, one JSON object per line, and send them as they arrive using pooled SMTP '
+             'sessions (up to --concurrency at once). Result of every message is written to STDOUT as JSON line. '
+             'Objects have the same format as requests of "smtpc serve", message params given in command line '
+             'are used as defaults.')
+    p_send.add_argument('--daemon', metavar='SOCKET', nargs='?', const='',
+        help='Don\'t connect to SMTP server, but forward message to "smtpc serve" daemon listening on SOCKET '
+             '(default: smtpc.sock in SMTPc config directory). Connection details are taken from --profile.')
 
     # PROFILES command
     p_profiles = sub.add_parser('profiles', aliases=['p'], help="Manage connection profiles.")
@@ -199,6 +257,16 @@ def parse_argv(argv: list) -> argparse.Namespace:
         help='Source IP address to use when connecting.')
     p_profiles_add.add_argument('--auth-method', choices=auth_method_choices,
         help='Force to use selected auth method.')
+    p_profiles_add.add_argument('--delivery', choices=delivery_choices,
+        help='How to deliver messages: "smarthost" sends everything through --host, "mx" connects directly to MX '
+             'hosts of recipients domains (requires "dnspython" module). Default: smarthost.')
+    p_profiles_add.add_argument('--rate-limit', type=float,
+        help='Max number of messages sent per second using this profile, shared by all smtpc processes. '
+             'Default: no limit.')
+    p_profiles_add.add_argument('--rate-limit-burst', type=int,
+        help='Number of messages which can be sent at once before --rate-limit applies. Default: 1.')
+    p_profiles_add.add_argument('--rate-limit-daily', type=int,
+        help='Max number of messages sent per day using this profile. Default: no limit.')
 
     # MESSAGES command
     p_messages = sub.add_parser('messages', aliases=['m'], help='Manage saved messages.')
@@ -246,6 +314,51 @@ def parse_argv(argv: list) -> argparse.Namespace:
         help='How to fill Reply-To header.')
     p_messages_add.add_argument('--header', '-H', metavar='HEADER', dest='headers', action='append',
         help='Additional headers in format: HeaderName=HeaderValue. Can be used multiple times.')
+    p_messages_add.add_argument('--attach', '-A', metavar='PATH', dest='attachments', action='append',
+        help='Attach file to the message. Can be used multiple times.')
+
+    # SERVE command
+    p_serve = sub.add_parser('serve', help='Run daemon accepting messages to send on Unix socket.')
+    p_serve.add_argument('--socket', metavar='SOCKET',
+        help='Path of Unix socket to listen on. Default: smtpc.sock in SMTPc config directory.')
+    p_serve.add_argument('--max-sessions', type=int, default=4,
+        help='Maximum number of parallel SMTP sessions for every profile. Default: 4.')
+    p_serve.add_argument('--idle-timeout', type=float, default=60,
+        help='Close SMTP sessions unused for given number of seconds. Default: 60.')
+    p_serve.add_argument('--session-max-messages', type=int,
+        help='Maximum number of messages sent using single SMTP session, then new session is opened. '
+             'Default: unlimited.')
+    p_serve.add_argument('--reconnect-attempts', type=int, default=1,
+        help='How many times reconnect and send message again when SMTP session is lost. Default: 1.')
+
+    # QUEUE command
+    p_queue = sub.add_parser('queue', aliases=['q'], help='Manage queue of messages waiting for delivery.')
+    p_queue_sub = p_queue.add_subparsers(dest='subcommand')
+
+    p_queue_list = p_queue_sub.add_parser('list', help='List queued messages.')
+    p_queue_add = p_queue_sub.add_parser('add', parents=[p_send], add_help=False, epilog=body_params_epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        help='Build message (accepts the same params as "send" command) and put it in the queue.')
+    p_queue_run = p_queue_sub.add_parser('run', help='Send queued messages.')
+    p_queue_run.add_argument('--concurrency', type=int, default=1,
+        help='Number of parallel SMTP sessions. Default: 1.')
+    p_queue_run.add_argument('--reconnect-attempts', type=int, default=0,
+        help='How many times reconnect and send message again when SMTP session is lost. Default: 0.')
+    p_queue_run.add_argument('--session-max-messages', type=int,
+        help='Maximum number of messages sent using single SMTP session, then new session is opened. '
+             'Default: unlimited.')
+    p_queue_run.add_argument('--max-attempts', type=int, default=10,
+        help='Number of delivery attempts, after which message is moved to failed messages. Default: 10.')
+    p_queue_run.add_argument('--retry-delay', type=float, default=60,
+        help='Delay (in seconds) before first retry of temporarily failed message. Every next retry '
+             'waits twice as long. Default: 60.')
+    p_queue_run.add_argument('--max-retry-delay', type=float, default=3600,
+        help='Maximum delay (in seconds) between retries. Default: 3600.')
+    p_queue_run.add_argument('--interval', type=float,
+        help='Don\'t exit after processing the queue, but check it again every INTERVAL seconds.')
+    for p in (p_queue_list, p_queue_add, p_queue_run):
+        p.add_argument('--spool', metavar='DIR',
+            help='Directory with queued messages. Default: "spool" directory in SMTPc config directory.')
 
     args = parser.parse_args(argv)
 
@@ -278,15 +391,82 @@ def parse_argv(argv: list) -> argparse.Namespace:
 
         if args.auth_method:
             args.auth_method = SMTPAuthMethod(args.auth_method)
+        if args.delivery:
+            args.delivery = DeliveryMode(args.delivery)
+
+    def setup_rows_args(args: argparse.Namespace) -> NoReturn:
+        if args.render_processes < 0:
+            parser.error('--render-processes cannot be negative')
+        if not args.render_processes:
+            args.render_processes = os.cpu_count() or 1
+
+        if not args.rows:
+            if args.render_processes > 1:
+                parser.error('--render-processes can be used only together with --rows')
+            return
+        if args.render_processes > 1 and args.stream_templates:
+            parser.error('Cannot use --render-processes together with --stream-templates')
+
+        if args.message_interactive or args.smtp_interactive:
+            parser.error('Cannot use --rows together with --message-interactive or --smtp-interactive')
+        if args.raw_body:
+            parser.error('Cannot use --rows together with --raw-body')
+
+        if args.rows_format:
+            args.rows_format = RowsFormat(args.rows_format)
+        else:
+            args.rows_format = bulk.detect_rows_format(args.rows)
+            if not args.rows_format:
+                parser.error(f'Cannot detect format of rows file: {args.rows}. Use --rows-format')
+
+    def setup_concurrency_args(args: argparse.Namespace) -> NoReturn:
+        if args.concurrency < 1:
+            parser.error('--concurrency must be greater than 0')
+        if args.reconnect_attempts < 0:
+            parser.error('--reconnect-attempts cannot be negative')
+        if args.concurrency > 1 and (getattr(args, 'message_interactive', False) or getattr(args, 'smtp_interactive', False)):
+            parser.error('Cannot use --concurrency together with --message-interactive or --smtp-interactive')
+
+    def setup_daemon_args(args: argparse.Namespace) -> NoReturn:
+        if args.daemon is None:
+            return
+
+        connection_args = ['host', 'port', 'login', 'password', 'auth_method', 'tls', 'no_tls', 'ssl', 'no_ssl',
+            'connection_timeout', 'identify_as', 'source_address', 'delivery']
+        used = [name for name in connection_args if getattr(args, name)]
+        if used:
+            parser.error('Cannot use connection params together with --daemon: ' +
+                ', '.join('--' + name.replace('_', '-') for name in used) + '. Use --profile')
+        if args.rows or args.message_interactive or args.smtp_interactive or args.dry_run or args.concurrency > 1:
+            parser.error('Cannot use --daemon together with any of: --rows, --message-interactive, '
+                '--smtp-interactive, --dry-run, --concurrency')
+
+    def setup_stream_args(args: argparse.Namespace) -> NoReturn:
+        if not args.stream:
+            return
+
+        connection_args = ['host', 'port', 'login', 'password', 'auth_method', 'tls', 'no_tls', 'ssl', 'no_ssl',
+            'connection_timeout', 'identify_as', 'source_address', 'delivery']
+        used = [name for name in connection_args if getattr(args, name)]
+        if used:
+            parser.error('Cannot use connection params together with --stream: ' +
+                ', '.join('--' + name.replace('_', '-') for name in used) + '. Use --profile')
+        if args.rows or args.daemon is not None or args.message_interactive or args.smtp_interactive or args.dry_run or \
+                args.body_file or args.message_dump:
+            parser.error('Cannot use --stream together with any of: --rows, --daemon, --message-interactive, '
+                '--smtp-interactive, --dry-run, --body-file, --message-dump')
 
     def setup_message_args(args: argparse.Namespace) -> NoReturn:
-        if args.command == 'send' and not getattr(args, 'message', False) and not args.envelope_from and not args.address_from:
+        # with --stream every message is validated when it's sent
+        addresses_required = args.command in ('send', 'queue') and not getattr(args, 'message', False) and \
+            not getattr(args, 'stream', False)
+        if addresses_required and not args.envelope_from and not args.address_from:
             parser.error('Any sender (--envelope-from or --from) required' + (
                 ' if --message not specified' if not hasattr(args, 'message') else ''
             ))
 
-        if args.command == 'send' and not getattr(args, 'message', False) and not args.envelope_to and not args.address_to and \
-                not args.address_cc and not args.address_bcc:
+        if addresses_required and not getattr(args, 'rows', False) and \
+                not args.envelope_to and not args.address_to and not args.address_cc and not args.address_bcc:
             parser.error('Any receiver (--envelope-to,--to, --cc, --bcc) required' + (
                 ' if --message not specified' if not hasattr(args, 'message') else ''
             ))
@@ -300,15 +480,48 @@ def parse_argv(argv: list) -> argparse.Namespace:
             parser.error('Cannot use --raw-body together with any of: --body-html, --body-type. '
                 'Use --raw-body only with --body param')
 
+        if args.attachments:
+            if args.raw_body:
+                parser.error('Cannot use --attach together with --raw-body')
+            for path in args.attachments:
+                if not os.path.isfile(path):
+                    parser.error(f'No such file: {path}')
+            # absolute paths, because files are read later by smtpc daemon or from saved message
+            args.attachments = [os.path.abspath(path) for path in args.attachments]
+
         if args.body_type:
             args.body_type = ContentType(args.body_type)
 
     def read_stdin_body(args: argparse.Namespace) -> NoReturn:
+        if getattr(args, 'stream', False):
+            return
+
+        # raw message is sent as is, so it can be streamed to the server instead of being read into memory
+        stream_body = args.command == 'send' and args.raw_body and not args.message and args.daemon is None and \
+            not args.message_interactive and not args.message_dump
+
+        if getattr(args, 'body_file', None):
+            if args.body is not None:
+                parser.error('Cannot use --body together with --body-file')
+            if args.body_file == '-':
+                args.body = '-'
+            elif not os.path.isfile(args.body_file):
+                parser.error(f'No such file: {args.body_file}')
+            elif stream_body:
+                args.body = FileMessageStream(args.body_file)
+                return
+            else:
+                with open(args.body_file, 'r') as fh:
+                    args.body = fh.read()
+                return
+
         if args.body and args.body != '-':
             return
+        if getattr(args, 'rows', None) == '-':
+            return
 
         if select.select([sys.stdin], [], [], 0.0)[0]:
-            args.body = sys.stdin.read()
+            args.body = FileMessageStream('-') if stream_body else sys.stdin.read()
         elif args.body == '-':
             parser.error("No data in STDIN stream")
 
@@ -316,12 +529,19 @@ def parse_argv(argv: list) -> argparse.Namespace:
         args.command = 'send'
         setup_connection_args(args)
         setup_message_args(args)
+        setup_rows_args(args)
+        setup_concurrency_args(args)
+        setup_daemon_args(args)
+        setup_stream_args(args)
         read_stdin_body(args)
 
     elif args.command in ('profiles', 'p'):
         args.command = 'profiles'
         if args.subcommand == 'add':
             setup_connection_args(args)
+            for name in ('rate_limit', 'rate_limit_burst', 'rate_limit_daily'):
+                if getattr(args, name) is not None and getattr(args, name) <= 0:
+                    parser.error(f'--{name.replace("_", "-")} must be greater than 0')
             if args.encrypt_password:
                 if not encryption:
                     parser.error('No password encryption support found. Do you have "cryptography" module installed?')
@@ -331,6 +551,29 @@ def parse_argv(argv: list) -> argparse.Namespace:
         elif not args.subcommand:
             args.subcommand = 'list'
 
+    elif args.command == 'serve':
+        if args.max_sessions < 1:
+            parser.error('--max-sessions must be greater than 0')
+
+    elif args.command in ('queue', 'q'):
+        args.command = 'queue'
+        if args.subcommand == 'add':
+            if args.message_interactive or args.smtp_interactive or args.daemon is not None:
+                parser.error('Cannot queue messages with --message-interactive, --smtp-interactive or --daemon')
+            setup_connection_args(args)
+            if args.password:
+                # queued messages are stored as plain files, password is taken from the profile when they are sent
+                parser.error('Cannot queue messages with --login and --password, use --profile with stored credentials')
+            setup_message_args(args)
+            setup_rows_args(args)
+            read_stdin_body(args)
+        elif args.subcommand == 'run':
+            setup_concurrency_args(args)
+            if args.max_attempts < 1:
+                parser.error('--max-attempts must be greater than 0')
+        elif not args.subcommand:
+            args.subcommand = 'list'
+
     elif args.command in ('messages', 'm'):
         args.command = 'messages'
         if args.subcommand == 'add':
@@ -359,7 +602,29 @@ def parse_argv(argv: list) -> argparse.Namespace:
     return args
 
 
-def configure_logger(debug_mode: bool = False) -> NoReturn:
+class _LogOutput:
+    """Output for logs: STDOUT, or STDERR when STDOUT is used for results (ie. by `send --stream`).
+    Chosen on every write, because loggers are cached on the first use."""
+    __slots__ = ('use_stderr', '__weakref__')
+
+    def __init__(self) -> NoReturn:
+        self.use_stderr = False
+
+    def write(self, data: str) -> int:
+        return self._file().write(data)
+
+    def flush(self) -> NoReturn:
+        self._file().flush()
+
+    def _file(self) -> TextIO:
+        return sys.stderr if self.use_stderr else sys.stdout
+
+
+LOG_OUTPUT = _LogOutput()
+
+
+def configure_logger(debug_mode: bool = False, use_stderr: bool = False) -> NoReturn:
+    LOG_OUTPUT.use_stderr = use_stderr
     structlog.configure(
         processors=[
             structlog.processors.add_log_level,
@@ -371,7 +636,7 @@ def configure_logger(debug_mode: bool = False) -> NoReturn:
         ],
         wrapper_class=structlog.make_filtering_bound_logger(logging.DEBUG if debug_mode else logging.WARNING),
         context_class=dict,
-        logger_factory=structlog.PrintLoggerFactory(),
+        logger_factory=structlog.PrintLoggerFactory(LOG_OUTPUT),
         cache_logger_on_first_use=True,
     )
 
@@ -387,6 +652,13 @@ class AbstractCommand:
         log_method = logger.exception if self.args.debug_level > 0 else logger.error
         log_method(msg, **kwargs)
 
+    def _get_password_key(self) -> NoReturn:
+        if not encryption:
+            raise SMTPcError('No password encryption support found, but password for profile '
+                'is encrypted. Do you have "cryptography" module installed?')
+        password_key = getpass.getpass('Key for password decryption: ')
+        return password_key
+
 
 class ProfilesCommand(AbstractCommand):
     def list(self) -> NoReturn:
@@ -427,6 +699,10 @@ class ProfilesCommand(AbstractCommand):
             identify_as=self.args.identify_as,
             source_address=self.args.source_address,
             auth_method=self.args.auth_method,
+            delivery=self.args.delivery,
+            rate_limit=self.args.rate_limit,
+            rate_limit_burst=self.args.rate_limit_burst,
+            rate_limit_daily=self.args.rate_limit_daily,
         ))
         logger.info('Profile saved', profile=self.args.name[0])
 
@@ -478,6 +754,7 @@ class MessagesCommand(AbstractCommand):
             raw_body=self.args.raw_body,
             headers=self.args.headers,
             profile=self.args.profile,
+            attachments=self.args.attachments,
         ))
         # TODO: shouldn't be logger call
         logger.info('Message saved', message=self.args.name[0])
@@ -525,103 +802,484 @@ class SendCommand(AbstractCommand):
 
         return body
 
-    def _get_password_key(self) -> NoReturn:
-        if not encryption:
-            raise SMTPcError('No password encryption support found, but password for profile '
-                'is encrypted. Do you have "cryptography" module installed?')
-        password_key = getpass.getpass('Key for password decryption: ')
-        return password_key
-
     def _handle(self) -> NoReturn:
+        if self.args.daemon is not None:
+            self._handle_daemon()
+            return
+        if self.args.stream:
+            self._handle_stream()
+            return
+
+        profile, predefined_message = self._get_profile_and_message()
+
+        if self.args.rows:
+            self._handle_rows(profile, predefined_message)
+            return
+
+        message_body = self._build_message(profile, predefined_message)
+        send_message = self._create_sender(profile, predefined_message, message_body)
+        if (self.args.concurrency > 1 or send_message.delivery == DeliveryMode.MX) and not self.args.dry_run:
+            self._handle_grouped(send_message, message_body)
+            return
+
+        try:
+            receivers = send_message.execute()
+        except (smtplib.SMTPSenderRefused, smtplib.SMTPAuthenticationError) as exc:
+            logger.error(exc.smtp_error.decode(), smtp_code=exc.smtp_code)
+            raise SMTPcError(exc.smtp_error.decode()) from None
+
+        if not self.args.dry_run:
+            print('Message sent to:', ', '.join(receivers))
+
+    def _handle_daemon(self) -> NoReturn:
+        request = {name: getattr(self.args, name) for name in service.MESSAGE_FIELDS}
+        request['body_type'] = self.args.body_type.value if self.args.body_type else None
+        request['profile'] = self.args.profile
+        request['message'] = self.args.message
+
+        socket_path = pathlib.Path(self.args.daemon) if self.args.daemon else config.SOCKET_FILE
+        try:
+            response = service.send_request(socket_path, {k: v for k, v in request.items() if v is not None})
+        except OSError as exc:
+            self.log_exception('cannot connect to smtpc daemon', socket=str(socket_path), message=str(exc))
+            exitc(ExitCodes.CONNECTION_ERROR)
+
+        if not response['ok']:
+            raise SMTPcError(response['error'])
+
+        for address, (code, error) in response['rejects'].items():
+            logger.error(f"server doesn't accept message for {address}", smtp_code=code, smtp_message=error)
+        print('Message sent to:', ', '.join(response['recipients']))
+
+    def _handle_stream(self) -> NoReturn:
+        defaults = {name: getattr(self.args, name) for name in service.MESSAGE_FIELDS}
+        defaults['body_type'] = self.args.body_type.value if self.args.body_type else None
+        defaults['profile'] = self.args.profile
+        defaults['message'] = self.args.message
+
+        pool = self._create_pool()
+        send_service = service.SendService(pool=pool, password_key=self._get_password_key,
+            reconnect_attempts=self.args.reconnect_attempts)
+        try:
+            failed = service.handle_stream(send_service, iter(sys.stdin.readline, ''),
+                lambda response: print(json.dumps(response), flush=True),
+                concurrency=self.args.concurrency,
+                defaults={k: v for k, v in defaults.items() if v is not None},
+            )
+        finally:
+            pool.close()
+
+        if failed:
+            exitc(ExitCodes.OTHER)
+
+    def _get_profile_and_message(self) -> Tuple[Optional[PredefinedProfile], Optional[PredefinedMessage]]:
         profile = None
         if self.args.profile:
             profile = PREDEFINED_PROFILES[self.args.profile]
 
         predefined_message: PredefinedMessage = None if not self.args.message else PREDEFINED_MESSAGES[self.args.message]
+        if predefined_message and not profile:
+            profile = self._get_message_profile(predefined_message)
+
+        return profile, predefined_message
+
+    def _build_message(self, profile: Optional[PredefinedProfile],
+        predefined_message: Optional[PredefinedMessage],
+    ) -> Union[MIMEBase, str]:
         if not predefined_message and self.args.raw_body:
             message_body = self.args.body
         else:
-            if not profile and predefined_message and predefined_message.profile:
-                try:
-                    profile = PREDEFINED_PROFILES[predefined_message.profile]
-                except KeyError:
-                    logger.error(f"Specified with message profile \"{predefined_message.profile}\" doesn't exists")
-                    exitc(ExitCodes.OTHER)
-
-            message_builder = message.Builder(
-                predefined_message=predefined_message,
-                predefined_profile=profile,
-                subject=self.args.subject,
-                envelope_from=self.args.envelope_from,
-                address_from=self.args.address_from,
-                envelope_to=self.args.envelope_to,
-                address_to=self.args.address_to,
-                address_cc=self.args.address_cc,
-                address_bcc=self.args.address_bcc,
-                reply_to=self.args.reply_to,
-                body_type=self.args.body_type,
-                body_html=self.args.body_html,
-                body=self.args.body,
-                raw_body=self.args.raw_body,
-                template_fields=self.args.template_fields,
-                template_fields_json=self.args.template_fields_json,
-                headers=self.args.headers,
-            )
-            message_body = message_builder.execute()
+            message_builder = self._create_builder(profile, predefined_message)
+            # dry run doesn't leave anything behind
+            if self.args.build_cache and not self.args.dry_run:
+                message_body = message_builder.execute_cached(DiskLRUCache(config.BUILDS_CACHE_DIR, message.BUILDS_CACHE_MAX_SIZE))
+            else:
+                message_body = message_builder.execute()
 
         if self.args.message_interactive:
             message_body = self._message_interactive(message_body)
 
         if self.args.message_dump:
-            tmp_message_body = message_body.as_string() if hasattr(message_body, 'as_string') else message_body
+            self._message_dump(message_body)
+
+        return message_body
+
+    def _rows_messages(self, profile: Optional[PredefinedProfile],
+        predefined_message: Optional[PredefinedMessage],
+    ) -> Iterator[Tuple[MessageStream, str, List[str]]]:
+        # message is built once, every row only renders templates and recipients into it
+        messages = bulk.render_rows(self._create_builder(profile, predefined_message),
+            bulk.read_rows(self.args.rows, self.args.rows_format), self.args.render_processes)
+        for message_body, envelope_from, envelope_to in messages:
+            if self.args.message_dump:
+                self._message_dump(message_body)
+            yield message_body, envelope_from, envelope_to
+
+    def _handle_rows(self, profile: Optional[PredefinedProfile], predefined_message: Optional[PredefinedMessage]) -> NoReturn:
+        if self.args.dry_run:
+            for _ in self._rows_messages(profile, predefined_message):
+                pass
+            return
 
-            import textwrap
-            print('-------- Message body start:', file=sys.stderr)
-            print(textwrap.indent(tmp_message_body, '  '), file=sys.stderr)
-            print('-------- Message body end.', file=sys.stderr)
-            del tmp_message_body
+        send_message = self._create_sender(profile, predefined_message, None, pool=self._create_pool())
+        failed = 0
+        for result in self._execute_many(send_message, self._rows_messages(profile, predefined_message)):
+            if result.ok:
+                print('Message sent to:', ', '.join(result.recipients))
+            else:
+                failed += 1
+                self.log_exception('cannot send message', recipients=result.recipients, message=str(result.error))
+
+        if failed:
+            exitc(ExitCodes.OTHER)
+
+    def _handle_grouped(self, send_message: message.Sender, message_body: Union[MIMEBase, str]) -> NoReturn:
+        """Send the same message in separate transactions: one per recipients domain (with MX delivery),
+        or one per --concurrency group of recipients. Groups are sent in parallel if --concurrency is given."""
+        envelope_from, envelope_to = send_message.envelope()
+        if send_message.delivery == DeliveryMode.MX:
+            groups = list(mx.group_by_domain(envelope_to).values())
+        else:
+            groups = [envelope_to[i::self.args.concurrency] for i in range(self.args.concurrency)]
+
+        if isinstance(message_body, (Message, mime.MultipartStream)):
+            # the same message is sent by many threads, it can't be encoded by every one of them
+            message_body = mime.freeze(message_body)
+
+        send_message.pool = self._create_pool()
+        receivers = []
+        failed = 0
+        for result in self._execute_many(send_message, ((message_body, envelope_from, group) for group in groups if group)):
+            if result.ok:
+                receivers.extend(result.recipients)
+            else:
+                failed += 1
+                self.log_exception('cannot send message', recipients=result.recipients, message=str(result.error))
+
+        if receivers:
+            print('Message sent to:', ', '.join(receivers))
+        if failed:
+            exitc(ExitCodes.OTHER)
 
+    def _create_pool(self) -> ConnectionPool:
+        return ConnectionPool(max_size=self.args.concurrency, max_messages=self.args.session_max_messages)
+
+    def _execute_many(self, send_message: message.Sender, messages: Iterable[tuple]) -> Iterator[message.SendResult]:
+        try:
+            yield from send_message.execute_many(messages, concurrency=self.args.concurrency,
+                reconnect_attempts=self.args.reconnect_attempts)
+        except smtplib.SMTPAuthenticationError as exc:
+            logger.error(exc.smtp_error.decode(), smtp_code=exc.smtp_code)
+            raise SMTPcError(exc.smtp_error.decode()) from None
+        except ConnectionFailedError:
+            exitc(ExitCodes.CONNECTION_ERROR)
+        except smtplib.SMTPServerDisconnected as exc:
+            self.log_exception('connection lost', message=str(exc))
+            exitc(ExitCodes.CONNECTION_ERROR)
+        finally:
+            send_message.pool.close()
+
+    def _get_message_profile(self, predefined_message: PredefinedMessage) -> Optional[PredefinedProfile]:
+        if not predefined_message.profile:
+            return None
+
+        try:
+            return PREDEFINED_PROFILES[predefined_message.profile]
+        except KeyError:
+            logger.error(f"Specified with message profile \"{predefined_message.profile}\" doesn't exists")
+            exitc(ExitCodes.OTHER)
+
+    def _create_builder(self, profile: Optional[PredefinedProfile], predefined_message: Optional[PredefinedMessage],
+        template_context: Optional[dict] = None, **addresses,
+    ) -> message.Builder:
+        return message.Builder(
+            predefined_message=predefined_message,
+            predefined_profile=profile,
+            subject=self.args.subject,
+            envelope_from=self.args.envelope_from,
+            address_from=self.args.address_from,
+            envelope_to=addresses.get('envelope_to', self.args.envelope_to),
+            address_to=addresses.get('address_to', self.args.address_to),
+            address_cc=addresses.get('address_cc', self.args.address_cc),
+            address_bcc=addresses.get('address_bcc', self.args.address_bcc),
+            reply_to=self.args.reply_to,
+            body_type=self.args.body_type,
+            body_html=self.args.body_html,
+            body=self.args.body,
+            raw_body=self.args.raw_body,
+            template_fields=self.args.template_fields,
+            template_fields_json=self.args.template_fields_json,
+            template_context=template_context,
+            headers=self.args.headers,
+            attachments=self.args.attachments,
+            stream_templates=self.args.stream_templates,
+        )
+
+    def _create_sender(self, profile: Optional[PredefinedProfile], predefined_message: Optional[PredefinedMessage],
+        message_body: Optional[Union[MIMEBase, str]], pool: Optional[ConnectionPool] = None,
+    ) -> message.Sender:
         password_key = None
         if profile and self.args.password is None and profile.password and profile.password.startswith('enc:'):
             password_key = self._get_password_key()
 
+        return message.Sender(
+            predefined_profile=profile,
+            predefined_message=predefined_message,
+            connection_timeout=self.args.connection_timeout,
+            source_address=self.args.source_address,
+            debug_level=self.args.debug_level,
+            host=self.args.host,
+            port=self.args.port,
+            identify_as=self.args.identify_as,
+            tls=self.args.tls,
+            ssl=self.args.ssl,
+            login=self.args.login,
+            password=self.args.password,
+            password_key=password_key,
+            envelope_from=self.args.envelope_from,
+            address_from=self.args.address_from,
+            envelope_to=self.args.envelope_to,
+            address_to=self.args.address_to,
+            address_cc=self.args.address_cc,
+            address_bcc=self.args.address_bcc,
+            reply_to=self.args.reply_to,
+            message_body=message_body,
+            no_ssl=self.args.no_ssl,
+            no_tls=self.args.no_tls,
+            dry_run=self.args.dry_run,
+            disable_ehlo=self.args.disable_ehlo,
+            auth_method=self.args.auth_method,
+            smtp_interactive=self.args.smtp_interactive,
+            delivery=self.args.delivery,
+            pool=pool,
+        )
+
+    def _message_dump(self, message_body: Union[Message, str]) -> NoReturn:
+        if isinstance(message_body, Message):
+            # the message as it's sent, Message.as_string folds headers differently and re-encodes 8bit parts
+            tmp_message_body = message.message_to_bytes(message_body).decode('utf-8', 'replace').replace('\r\n', '\n')
+        else:
+            tmp_message_body = message_body.as_string() if hasattr(message_body, 'as_string') else message_body
+
+        print('-------- Message body start:', file=sys.stderr)
+        print(textwrap.indent(tmp_message_body, '  '), file=sys.stderr)
+        print('-------- Message body end.', file=sys.stderr)
+
+
+class ServeCommand(AbstractCommand):
+    def handle(self) -> NoReturn:
+        pool = ConnectionPool(max_size=self.args.max_sessions, idle_timeout=self.args.idle_timeout,
+            max_messages=self.args.session_max_messages)
+        send_service = service.SendService(pool=pool, password_key=self._get_password_key,
+            reconnect_attempts=self.args.reconnect_attempts)
+        send_service.reload()
+
+        socket_path = pathlib.Path(self.args.socket) if self.args.socket else config.SOCKET_FILE
         try:
-            send_message = message.Sender(
-                predefined_profile=profile,
-                predefined_message=predefined_message,
-                connection_timeout=self.args.connection_timeout,
-                source_address=self.args.source_address,
-                debug_level=self.args.debug_level,
-                host=self.args.host,
-                port=self.args.port,
-                identify_as=self.args.identify_as,
-                tls=self.args.tls,
-                ssl=self.args.ssl,
-                login=self.args.login,
-                password=self.args.password,
-                password_key=password_key,
-                envelope_from=self.args.envelope_from,
-                address_from=self.args.address_from,
-                envelope_to=self.args.envelope_to,
-                address_to=self.args.address_to,
-                address_cc=self.args.address_cc,
-                address_bcc=self.args.address_bcc,
-                reply_to=self.args.reply_to,
-                message_body=message_body,
-                no_ssl=self.args.no_ssl,
-                no_tls=self.args.no_tls,
-                dry_run=self.args.dry_run,
-                disable_ehlo=self.args.disable_ehlo,
-                auth_method=self.args.auth_method,
-                smtp_interactive=self.args.smtp_interactive,
-            )
-            receivers = send_message.execute()
-        except (smtplib.SMTPSenderRefused, smtplib.SMTPAuthenticationError) as exc:
-            logger.error(exc.smtp_error.decode(), smtp_code=exc.smtp_code)
-            raise SMTPcError(exc.smtp_error.decode()) from None
+            server = service.SendServer(socket_path, send_service)
+        except SMTPcError as exc:
+            pool.close()
+            self.log_exception('cannot start daemon', message=str(exc))
+            exitc(ExitCodes.OTHER)
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+        print('Listening on:', socket_path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            pool.close()
+
+
+class QueueCommand(SendCommand):
+    # connection related arguments of "queue add", stored with every queued message (password never is)
+    CONNECTION_ARGS = (
+        'host', 'port', 'ssl', 'tls', 'no_ssl', 'no_tls', 'login', 'auth_method',
+        'connection_timeout', 'identify_as', 'source_address', 'disable_ehlo', 'delivery',
+    )
 
-        if not self.args.dry_run:
-            print('Message sent to:', ', '.join(receivers))
+    def __init__(self, args: argparse.Namespace) -> NoReturn:
+        super().__init__(args)
+        self.failed = 0
+
+    def handle(self) -> NoReturn:
+        try:
+            if self.args.subcommand == 'add':
+                self.add()
+            elif self.args.subcommand == 'run':
+                self.run()
+            else:
+                self.list()
+        except SMTPcError as exc:
+            self.log_exception('exception found', message=str(exc))
+            exitc(ExitCodes.OTHER)
+
+    def list(self) -> NoReturn:
+        spool = Spool(self._spool_path())
+        if not len(spool):
+            print('Queue is empty')
+            return
+
+        print('Queued messages:')
+        for path in sorted(spool.new.iterdir()):
+            meta = SpoolEntry.read_meta(path)
+            next_attempt = email.utils.formatdate(meta['next_attempt_at'], localtime=True) if meta['attempts'] else 'now'
+            print(f"- {path.name} (to: \"{', '.join(meta['envelope_to'])}\", attempts: {meta['attempts']}, "
+                  f"next attempt: {next_attempt})")
+
+    def add(self) -> NoReturn:
+        profile, predefined_message = self._get_profile_and_message()
+        if self.args.rows:
+            messages = self._rows_messages(profile, predefined_message)
+        else:
+            message_body = self._build_message(profile, predefined_message)
+            envelope = self._create_builder(profile, predefined_message).envelope()
+            messages = [(message_body, *envelope)]
+
+        connection = {name: getattr(self.args, name) for name in self.CONNECTION_ARGS}
+        connection['auth_method'] = self.args.auth_method.value if self.args.auth_method else None
+        connection['delivery'] = self.args.delivery.value if self.args.delivery else None
+        connection['profile'] = profile.name if profile else None
+
+        spool = Spool(self._spool_path())
+        for message_body, envelope_from, envelope_to in messages:
+            if self.args.dry_run:
+                continue
+            entry = spool.add(SpoolEntry(None,
+                envelope_from=envelope_from,
+                envelope_to=envelope_to,
+                connection=connection,
+                message=message_body.as_string() if hasattr(message_body, 'as_string') else message_body,
+            ))
+            print('Message queued:', entry.id)
+
+    def run(self) -> NoReturn:
+        spool = Spool(self._spool_path())
+        with spool.lock():
+            spool.recover()
+            while True:
+                self._drain(spool)
+                if not self.args.interval:
+                    break
+                time.sleep(self.args.interval)
+
+        if self.failed:
+            exitc(ExitCodes.OTHER)
+
+    def _drain(self, spool: Spool) -> NoReturn:
+        groups = {}
+        for entry in spool.claim():
+            groups.setdefault(json.dumps(entry.connection, sort_keys=True), []).append(entry)
+
+        password_keys = {}
+        for entries in groups.values():
+            try:
+                send_message = self._create_queued_sender(entries[0].connection, password_keys)
+            except SMTPcError as exc:
+                self.log_exception('cannot create sender for queued messages', message=str(exc))
+                for entry in entries:
+                    self._defer(spool, entry, entry.envelope_to, str(exc))
+                continue
+
+            messages = ((entry.message, entry.envelope_from, entry.envelope_to) for entry in entries)
+            processed = 0
+            try:
+                for entry, result in zip(entries, send_message.execute_many(messages, concurrency=self.args.concurrency,
+                        reconnect_attempts=self.args.reconnect_attempts)):
+                    processed += 1
+                    self._process_result(spool, entry, result)
+            except (ConnectionFailedError, RateLimitError, smtplib.SMTPException, OSError) as exc:
+                self.log_exception('connection error, messages deferred', message=str(exc))
+                for entry in entries[processed:]:
+                    self._defer(spool, entry, entry.envelope_to, str(exc))
+            finally:
+                send_message.pool.close()
+
+    def _process_result(self, spool: Spool, entry: SpoolEntry, result: message.SendResult) -> NoReturn:
+        rejects = dict(result.rejects)
+        if not result.ok:
+            if isinstance(result.error, smtplib.SMTPRecipientsRefused):
+                rejects.update(result.error.recipients)
+            elif hasattr(result.error, 'smtp_code'):
+                rejects.update({address: (result.error.smtp_code, result.error.smtp_error) for address in entry.envelope_to})
+
+        accepted = result.recipients if result.ok else []
+        if accepted:
+            print('Message sent to:', ', '.join(accepted))
+
+        # recipients not accepted and not explicitly rejected (ie. lost connection) are retried too
+        transient, permanent = [], []
+        for address in entry.envelope_to:
+            if address in accepted:
+                continue
+            code = rejects.get(address, (None, ))[0]
+            (transient if code is None or 400 <= code < 500 else permanent).append(address)
+
+        error = str(result.error) if result.error else f'rejected: {rejects}'
+        if permanent:
+            self.log_exception('message rejected', entry=entry.id, recipients=permanent, message=error)
+            spool.fail(entry, permanent, error)
+            self.failed += 1
+            if transient:
+                self._defer(spool, spool.split(entry, transient), transient, error)
+        elif transient:
+            self._defer(spool, entry, transient, error)
+        else:
+            spool.done(entry)
+
+    def _defer(self, spool: Spool, entry: SpoolEntry, envelope_to: List[str], error: str) -> NoReturn:
+        if entry.attempts + 1 >= self.args.max_attempts:
+            self.log_exception('message not delivered, too many attempts', entry=entry.id, recipients=envelope_to, message=error)
+            spool.fail(entry, envelope_to, error)
+            self.failed += 1
+            return
+
+        delay = retry_delay(entry.attempts + 1, self.args.retry_delay, self.args.max_retry_delay)
+        logger.warning('message deferred', entry=entry.id, recipients=envelope_to, delay=delay, message=error)
+        spool.retry(entry, envelope_to, error, delay)
+
+    def _create_queued_sender(self, connection: dict, password_keys: dict) -> message.Sender:
+        profile = None
+        if connection['profile']:
+            try:
+                profile = PREDEFINED_PROFILES[connection['profile']]
+            except KeyError:
+                raise SMTPcError(f"Profile \"{connection['profile']}\" doesn't exists")
+
+        password_key = None
+        if profile and profile.password and profile.password.startswith('enc:'):
+            if profile.name not in password_keys:
+                password_keys[profile.name] = self._get_password_key()
+            password_key = password_keys[profile.name]
+
+        params = {name: connection[name] for name in self.CONNECTION_ARGS}
+        params['auth_method'] = SMTPAuthMethod(connection['auth_method']) if connection['auth_method'] else None
+        params['delivery'] = DeliveryMode(connection['delivery']) if connection['delivery'] else None
+
+        return message.Sender(
+            predefined_profile=profile,
+            predefined_message=None,
+            debug_level=self.args.debug_level,
+            password_key=password_key,
+            envelope_from=None,
+            address_from=None,
+            envelope_to=None,
+            address_to=None,
+            address_cc=None,
+            address_bcc=None,
+            reply_to=None,
+            password=None,
+            message_body=None,
+            dry_run=False,
+            smtp_interactive=False,
+            pool=self._create_pool(),
+            **params,
+        )
+
+    def _spool_path(self) -> pathlib.Path:
+        spool = getattr(self.args, 'spool', None)
+        return pathlib.Path(spool) if spool else config.SPOOL_DIR
 
 
 def main(argv: Optional[list] = None) -> NoReturn:
@@ -632,20 +1290,21 @@ def main(argv: Optional[list] = None) -> NoReturn:
     global PREDEFINED_PROFILES, PREDEFINED_MESSAGES
     try:
         PREDEFINED_PROFILES = PredefinedProfiles.read()
-    except toml.decoder.TomlDecodeError as exc:
+    except config.TOML_DECODE_ERRORS as exc:
         PREDEFINED_PROFILES = PredefinedProfiles()
         # TODO: shouldn't be logger call?
         logger.error(f"profiles configuration error: {exc}")
 
     try:
         PREDEFINED_MESSAGES = PredefinedMessages.read()
-    except toml.decoder.TomlDecodeError as exc:
+    except config.TOML_DECODE_ERRORS as exc:
         PREDEFINED_MESSAGES = PredefinedMessages()
         # TODO: shouldn't be logger call?
         logger.error(f"messages configuration error: {exc}")
 
     args = parse_argv(argv)
-    configure_logger(args.debug_level > 0)
+    # with --stream STDOUT is reserved for results
+    configure_logger(args.debug_level > 0, getattr(args, 'stream', False))
 
     handler = None
     if args.command == 'profiles':
@@ -654,6 +1313,10 @@ def main(argv: Optional[list] = None) -> NoReturn:
         handler = SendCommand(args)
     elif args.command == 'messages':
         handler = MessagesCommand(args)
+    elif args.command == 'queue':
+        handler = QueueCommand(args)
+    elif args.command == 'serve':
+        handler = ServeCommand(args)
 
     handler.handle()
 
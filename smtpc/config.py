@@ -1,3 +1,4 @@
+import json
 import os
 import pathlib
 import sys
@@ -8,7 +9,16 @@ import fileperms
 import structlog
 import toml
 
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
 logger = structlog.get_logger()
+# errors raised by load_toml_file for invalid files
+TOML_DECODE_ERRORS = (toml.TomlDecodeError, tomllib.TOMLDecodeError) if tomllib else (toml.TomlDecodeError, )
+# version of format of parsed config files cache
+_TOML_CACHE_VERSION = 2
 ENV_SMTPC_CONFIG_DIR = 'SMTPC_CONFIG_DIR'
 ENV_XDG_CONFIG_HOME = 'XDG_CONFIG_HOME'
 ENV_SMTPC_SALT = 'SMTPC_SALT'
@@ -18,14 +28,27 @@ CONFIG_DIR: Optional[pathlib.Path]
 PREDEFINED_PROFILES_FILE: Optional[pathlib.Path]
 CONFIG_FILE: Optional[pathlib.Path]
 PREDEFINED_MESSAGES_FILE: Optional[pathlib.Path]
+SPOOL_DIR: Optional[pathlib.Path]
+SOCKET_FILE: Optional[pathlib.Path]
+RATE_LIMIT_DIR: Optional[pathlib.Path]
+CACHE_DIR: Optional[pathlib.Path]
+TEMPLATES_CACHE_DIR: Optional[pathlib.Path]
+BUILDS_CACHE_DIR: Optional[pathlib.Path]
 
 
 def _generate_paths() -> NoReturn:
-    global CONFIG_DIR, PREDEFINED_PROFILES_FILE, CONFIG_FILE, PREDEFINED_MESSAGES_FILE
+    global CONFIG_DIR, PREDEFINED_PROFILES_FILE, CONFIG_FILE, PREDEFINED_MESSAGES_FILE, SPOOL_DIR, SOCKET_FILE, RATE_LIMIT_DIR
+    global CACHE_DIR, TEMPLATES_CACHE_DIR, BUILDS_CACHE_DIR
     CONFIG_DIR = get_config_dir()
     PREDEFINED_PROFILES_FILE = CONFIG_DIR / 'profiles.toml'
     CONFIG_FILE = CONFIG_DIR / 'config.toml'
     PREDEFINED_MESSAGES_FILE = CONFIG_DIR / 'messages.toml'
+    SPOOL_DIR = CONFIG_DIR / 'spool'
+    SOCKET_FILE = CONFIG_DIR / 'smtpc.sock'
+    RATE_LIMIT_DIR = CONFIG_DIR / 'ratelimit'
+    CACHE_DIR = CONFIG_DIR / 'cache'
+    TEMPLATES_CACHE_DIR = CACHE_DIR / 'templates'
+    BUILDS_CACHE_DIR = CACHE_DIR / 'builds'
 
 
 def get_config_dir() -> pathlib.Path:
@@ -65,6 +88,48 @@ def ensure_config_files() -> NoReturn:
         save_toml_file(PREDEFINED_MESSAGES_FILE, {'messages': {}})
 
 
+def load_toml_file(file: pathlib.Path) -> dict:
+    """Parse TOML file, or load its content from cache (file with ".cache" suffix next to it) if the file
+    was not modified since it was parsed last time. Cache is validated by modification time, size and inode."""
+    stat = file.stat()
+    signature = (_TOML_CACHE_VERSION, stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    cache_file = file.with_name(file.name + '.cache')
+    try:
+        with cache_file.open('rb') as fh:
+            cached_signature, data = json.load(fh)
+        if tuple(cached_signature) == signature:
+            return data
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    if tomllib:
+        with file.open('rb') as fh:
+            data = tomllib.load(fh)
+    else:
+        with file.open('r') as fh:
+            data = toml.load(fh)
+
+    _save_toml_cache(cache_file, signature, data)
+    return data
+
+
+def _save_toml_cache(cache_file: pathlib.Path, signature: tuple, data: dict) -> NoReturn:
+    try:
+        # values which can't be serialized to JSON (ie. dates) are very unlikely in SMTPc configs,
+        # such files are just not cached
+        content = json.dumps([signature, data]).encode('utf-8')
+    except (TypeError, ValueError):
+        return
+
+    try:
+        # NamedTemporaryFile is created with permissions for owner only
+        with tempfile.NamedTemporaryFile(mode='wb', dir=cache_file.parent, delete=False, prefix='tmp.', suffix='.cache') as fh:
+            fh.write(content)
+        os.replace(fh.name, cache_file)
+    except OSError as exc:
+        logger.debug('cannot save config cache', file=str(cache_file), error=str(exc))
+
+
 def save_toml_file(file: pathlib.Path, data: dict) -> NoReturn:
     file_perms = fileperms.Permissions()
     file_perms.owner_read = True
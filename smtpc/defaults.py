@@ -12,6 +12,7 @@ DEFAULTS_VALUES_MESSAGE = {
     'raw_body': None,
     'body_type': None,
     'headers': [],
+    'attachments': [],
 }
 
 DEFAULTS_VALUES_PROFILE = {
@@ -26,4 +27,5 @@ DEFAULTS_VALUES_PROFILE = {
     'identify_as': None,
     'source_address': None,
     'auth_method': None,
+    'delivery': None,
 }
@@ -18,3 +18,20 @@ class SMTPAuthMethod(enum.Enum):
     PLAIN = 'plain'
     CRAM_MD5 = 'cram_md5'
     DEFAULT = 'default'
+
+
+class RowsFormat(enum.Enum):
+    CSV = 'csv'
+    JSONL = 'jsonl'
+
+
+class DeliveryMode(enum.Enum):
+    SMARTHOST = 'smarthost'
+    MX = 'mx'
+
+
+class TransferEncoding(enum.Enum):
+    SEVEN_BIT = '7bit'
+    EIGHT_BIT = '8bit'
+    QUOTED_PRINTABLE = 'quoted-printable'
+    BASE64 = 'base64'
@@ -20,3 +20,35 @@ class InvalidJsonTemplateError(TemplateError):
 
 class InvalidPasswordKeyError(SMTPcError):
     pass
+
+
+class ConnectionFailedError(SMTPcError):
+    pass
+
+
+class InvalidRowError(SMTPcError):
+    pass
+
+
+class PoolTimeoutError(SMTPcError):
+    pass
+
+
+class MXLookupError(SMTPcError):
+    pass
+
+
+class SpoolError(SMTPcError):
+    pass
+
+
+class RateLimitError(SMTPcError):
+    pass
+
+
+class AttachmentError(SMTPcError):
+    pass
+
+
+class UnsupportedFeatureError(SMTPcError):
+    pass
@@ -1,21 +1,26 @@
-__all__ = ['Builder', 'Sender']
+__all__ = ['Builder', 'CompiledMessage', 'Sender', 'SendResult', 'message_to_bytes']
 
 import copy
 import email
+import email.policy
 import email.utils
+import functools
+import hashlib
 import importlib
 import io
 import json
 import os
+import queue
 import re
 import smtplib
 import socket
 import sys
+import threading
 import uuid
+from email.message import Message
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from typing import Optional, List, Any, Union, NoReturn, Tuple
+from typing import Optional, List, Any, Union, NoReturn, Tuple, Iterable, Iterator, Callable, Dict, FrozenSet, Collection
 
 import structlog
 
@@ -27,10 +32,19 @@ except ImportError:
 from . import __version__
 from . import config
 from .defaults import DEFAULTS_VALUES_MESSAGE, DEFAULTS_VALUES_PROFILE
-from .enums import ContentType, ExitCodes, SMTPAuthMethod
-from .errors import InvalidTemplateFieldNameError, InvalidJsonTemplateError
+from .enums import ContentType, DeliveryMode, ExitCodes, SMTPAuthMethod
+from .cache import DiskLRUCache
+from .errors import InvalidTemplateFieldNameError, InvalidJsonTemplateError, ConnectionFailedError, MXLookupError
+from . import mime
+from . import mx
+from . import tls
+from .pool import ConnectionPool, PooledConnection, PoolKey
+from .ratelimit import RateLimiter
+from .stream import MessageStream, encode_data, normalize_line_endings, split_chunks
 from .predefined_messages import PredefinedMessage
 from .predefined_profiles import PredefinedProfile
+# SimpleTemplate and Template are imported for backward compatibility
+from .templating import SimpleTemplate, Template, compile_template, is_template, static_text, template_variables  # noqa: F401
 from .utils import exitc, determine_ssl_tls_by_port
 
 try:
@@ -39,27 +53,22 @@ except ImportError:
     encryption = None
 
 logger = structlog.get_logger()
+# total size of messages cached on disk by Builder.execute_cached
+BUILDS_CACHE_MAX_SIZE = 32 * 1024 * 1024
+# pipelined BDAT chunks sent before their replies are read, so the server is never blocked on full reply buffer
+BDAT_MAX_PENDING = 8
 
 
-class SimpleTemplate:
-    def __init__(self, tpl: str) -> NoReturn:
-        self.tpl = tpl
-
-    def render(self, **fields) -> str:
-        if not fields:
-            return self.tpl
-
-        data = self.tpl
-        for name, value in fields.items():
-            data = re.sub(r'\{\{\s*' + name + r'\s*\}\}', str(value), data)
-
-        return data
-
-
-try:
-    from jinja2 import Template
-except ImportError:
-    Template = SimpleTemplate
+def message_to_bytes(message_body: Union[Message, MessageStream, str, bytes]) -> bytes:
+    """Encode message body for DATA command the same way as smtplib does: with CRLF line endings.
+    8bit parts (and non-ASCII raw bodies) are kept as they are, encoded with UTF-8."""
+    if isinstance(message_body, MessageStream):
+        return b''.join(message_body.chunks())
+    if isinstance(message_body, Message):
+        return message_body.as_bytes(policy=message_body.policy.clone(linesep='\r\n'))
+    if isinstance(message_body, str):
+        message_body = re.sub(r'(?:\r\n|\n|\r(?!\n))', '\r\n', message_body).encode('utf-8')
+    return message_body
 
 
 class SmtpDebugPrinter:
@@ -190,11 +199,28 @@ class Builder:
         'subject',
         'envelope_from', 'address_from',
         'envelope_to', 'address_to', 'address_cc', 'address_bcc', 'reply_to',
-        'body_type', 'body_html', 'body', 'raw_body',
-        'template_default_fields', 'template_fields', 'template_fields_json',
-        'headers',
+        'body_type', 'body_html', 'body', 'raw_body', 'attachments',
+        'template_fields', 'template_fields_json', 'template_context',
+        'headers', 'allow_8bit', 'stream_templates', 'predefined_profile', 'predefined_message',
+        '_parsed_template_fields', '_compiled',
     )
 
+    # `smtpc_*` template fields, computed only if template uses them
+    TEMPLATE_DEFAULT_FIELDS: Dict[str, Callable[['Builder'], Any]] = {
+        'smtpc_subject': lambda builder: builder.subject,
+        'smtpc_envelope_from': lambda builder: builder.envelope_from,
+        'smtpc_from': lambda builder: builder.address_from,
+        'smtpc_envelope_to': lambda builder: builder.envelope_to,
+        'smtpc_to': lambda builder: builder.address_to,
+        'smtpc_cc': lambda builder: builder.address_cc,
+        'smtpc_bcc': lambda builder: builder.address_bcc,
+        'smtpc_reply_to': lambda builder: builder.reply_to,
+        'smtpc_body_type': lambda builder: builder.body_type,
+        'smtpc_raw_body': lambda builder: builder.raw_body,
+        'smtpc_predefined_profile': lambda builder: Builder._predefined_profile_fields(builder.predefined_profile),
+        'smtpc_predefined_message': lambda builder: Builder._predefined_message_fields(builder.predefined_message),
+    }
+
     def __init__(self, *,
         subject: Optional[str],
         envelope_from: Optional[str],
@@ -210,12 +236,24 @@ class Builder:
         raw_body: Optional[bool] = None,
         template_fields: Optional[List[str]] = None,
         template_fields_json: Optional[List[str]] = None,
+        template_context: Optional[dict] = None,
         headers: Optional[List[str]] = None,
+        attachments: Optional[List[str]] = None,
         predefined_message: Optional[PredefinedMessage] = None,
         predefined_profile: Optional[PredefinedProfile] = None,
+        allow_8bit: bool = True,
+        stream_templates: bool = False,
     ) -> NoReturn:
+        self.allow_8bit = allow_8bit
+        # templated text parts are rendered in pieces while message is sent, see mime.GeneratedContent
+        self.stream_templates = stream_templates
+        self._parsed_template_fields: Optional[dict] = None
+        self._compiled: Optional['CompiledMessage'] = None
         self.template_fields = template_fields or []
         self.template_fields_json = template_fields_json or []
+        self.template_context = template_context or {}
+        for field in self.template_context:
+            self._template_validate_field_name(field)
 
         message_fields = {
             'subject': subject,
@@ -231,55 +269,170 @@ class Builder:
             'body': body,
             'raw_body': raw_body,
             'headers': headers,
+            'attachments': attachments,
         }
         for name in message_fields:
             self._set_property(name, message_fields[name], predefined_message, DEFAULTS_VALUES_MESSAGE)
 
-        if not predefined_profile:
-            predefined_profile = empty()
-
-        if not predefined_message:
-            predefined_message = empty()
-
-        self.template_default_fields = {
-            'smtpc_subject': self.subject,
-            'smtpc_envelope_from': self.envelope_from,
-            'smtpc_from': self.address_from,
-            'smtpc_envelope_to': self.envelope_to,
-            'smtpc_to': self.address_to,
-            'smtpc_cc': self.address_cc,
-            'smtpc_bcc': self.address_bcc,
-            'smtpc_reply_to': self.reply_to,
-            'smtpc_body_type': self.body_type,
-            'smtpc_raw_body': self.raw_body,
-            'smtpc_predefined_profile': {
-                'name': predefined_profile.name,
-                'login': predefined_profile.login,
-                'host': predefined_profile.host,
-                'port': predefined_profile.port,
-                'ssl': predefined_profile.ssl,
-                'tls': predefined_profile.tls,
-                'connection_timeout': predefined_profile.connection_timeout,
-                'identify_as': predefined_profile.identify_as,
-                'source_address': predefined_profile.source_address,
-            },
-            'smtpc_predefined_message': {
-                'name': predefined_message.name,
-                'envelope_from': predefined_message.envelope_from,
-                'address_from': predefined_message.address_from,
-                'envelope_to': predefined_message.envelope_to,
-                'address_to': predefined_message.address_to,
-                'address_cc': predefined_message.address_cc,
-                'address_bcc': predefined_message.address_bcc,
-                'reply_to': predefined_message.reply_to,
-                'subject': predefined_message.subject,
-                'raw_body': predefined_message.raw_body,
-                'body_type': predefined_message.body_type,
-                'headers': predefined_message.headers,
-            },
+        self.predefined_profile = predefined_profile
+        self.predefined_message = predefined_message
+
+    @staticmethod
+    def _predefined_profile_fields(profile: Optional[PredefinedProfile]) -> dict:
+        profile = profile or empty()
+        return {
+            'name': profile.name,
+            'login': profile.login,
+            'host': profile.host,
+            'port': profile.port,
+            'ssl': profile.ssl,
+            'tls': profile.tls,
+            'connection_timeout': profile.connection_timeout,
+            'identify_as': profile.identify_as,
+            'source_address': profile.source_address,
+        }
+
+    @staticmethod
+    def _predefined_message_fields(message: Optional[PredefinedMessage]) -> dict:
+        message = message or empty()
+        return {
+            'name': message.name,
+            'envelope_from': message.envelope_from,
+            'address_from': message.address_from,
+            'envelope_to': message.envelope_to,
+            'address_to': message.address_to,
+            'address_cc': message.address_cc,
+            'address_bcc': message.address_bcc,
+            'reply_to': message.reply_to,
+            'subject': message.subject,
+            'raw_body': message.raw_body,
+            'body_type': message.body_type,
+            'headers': message.headers,
         }
 
-    def execute(self) -> MIMEBase:
+    def execute(self) -> Union[MIMEBase, mime.MultipartStream]:
+        generated = {}
+
+        def part(text: str, subtype: str) -> Message:
+            if not self.stream_templates or not is_template(text):
+                return mime.text_part(self.template(text), subtype, self.allow_8bit, cache=not is_template(text))
+
+            message = mime.generated_text_part(subtype)
+            generated[message.get_payload()] = mime.GeneratedContent(functools.partial(
+                compile_template(text).generate, **self._template_context(template_variables(text))))
+            return message
+
+        message = self._build(part, lambda name, value: value(self), self.template)
+
+        if self.attachments and not self.raw_body:
+            message = mime.attach_files(message, self.attachments)
+            message.attachments.update(generated)
+        elif generated:
+            message = mime.MultipartStream(message, generated)
+        return message
+
+    def execute_cached(self, cache: DiskLRUCache) -> Union[MIMEBase, Message]:
+        """The same as `execute`, but message is taken from cache if it was already built with the same params
+        (see `cache_key`), only Date and Message-ID headers are generated again. Messages with raw body,
+        attachments or streamed templates are not cached."""
+        if self.raw_body or self.attachments or self.stream_templates:
+            return self.execute()
+
+        key = self.cache_key()
+        entry = cache.get(key)
+        if entry is not None:
+            try:
+                return self._from_cache_entry(entry)
+            except (ValueError, KeyError, TypeError):
+                logger.debug('invalid cached message, building it again', key=key)
+
+        entry = self._cache_entry()
+        cache.set(key, entry)
+        return self._from_cache_entry(entry)
+
+    def cache_key(self) -> str:
+        """Hash of everything message built by `execute` depends on, besides Date and Message-ID headers."""
+        data = {
+            'version': __version__,
+            'template_engine': Template.__module__,
+            'allow_8bit': self.allow_8bit,
+            'headers': self.headers,
+            'body': self.body,
+            'body_html': self.body_html,
+            'template_fields': self._template_fields(),
+            'template_context': self.template_context,
+            # message params, and predefined profile and message
+            **self.template_default_fields,
+        }
+        return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _cache_entry(self) -> bytes:
+        """Built message, with placeholders instead of Date and Message-ID headers, preceded with JSON line
+        mapping header names to offsets and lengths of their placeholders."""
+        placeholders = {}
+
+        def header(name: str, value: Callable[[Builder], Optional[str]]) -> Optional[str]:
+            if name not in ('Date', 'Message-ID'):
+                return value(self)
+            placeholders[name] = f'smtpc-placeholder-{uuid.uuid4().hex}'
+            return placeholders[name]
+
+        message = self._build(
+            lambda text, subtype: mime.text_part(self.template(text), subtype, self.allow_8bit, cache=not is_template(text)),
+            header,
+            self.template,
+        )
+        data = message.as_bytes()
+        offsets = {name: [data.index(placeholder.encode('ascii')), len(placeholder)] for name, placeholder in placeholders.items()}
+        return json.dumps(offsets).encode('ascii') + b'\n' + data
+
+    def _from_cache_entry(self, entry: bytes) -> Message:
+        offsets, data = entry.split(b'\n', 1)
+        values = {'Date': self._header_date, 'Message-ID': self._header_message_id}
+        parts, position = [], 0
+        for name, (offset, length) in sorted(json.loads(offsets).items(), key=lambda item: item[1][0]):
+            parts.extend([data[position:offset], values[name](self).encode('ascii')])
+            position = offset + length
+        parts.append(data[position:])
+        return email.message_from_bytes(b''.join(parts))
+
+    def render(self, template_context: Optional[dict] = None, **addresses) -> mime.MultipartStream:
+        """Message for given template context, and recipients (`envelope_to`, `address_to`, `address_cc`,
+        `address_bcc`) if they are different than given to Builder. Template context is used together with
+        template fields given to Builder, it has higher priority.
+
+        Message is compiled on the first call, so Builder should not be modified later."""
+        if self._compiled is None:
+            self._compiled = self.compile()
+        return self._compiled.render(template_context, **addresses)
+
+    def render_many(self, template_contexts: Iterable[dict]) -> Iterator[mime.MultipartStream]:
+        """Message for every template context. Everything which does not depend on template context is
+        prepared only once, see `compile`."""
+        for template_context in template_contexts:
+            yield self.render(template_context)
+
+    def compile(self) -> 'CompiledMessage':
+        """Prepare message for sending it many times with different template context and recipients.
+
+        Everything that does not depend on them (static headers, MIME structure, parts without templates) is
+        built and encoded once, templates are parsed once. See CompiledMessage.render."""
+        self._template_fields()
+        compiler = _MessageCompiler(self)
+        message = self._build(compiler.part, compiler.header, compiler.subject)
+
+        attachments = {}
+        if self.attachments and not self.raw_body:
+            attachments = mime.attach_files(message, self.attachments).attachments
+        return compiler.compile(message, attachments)
+
+    def _build(self,
+        part: Callable[[str, str], Message],
+        header: Callable[[str, Callable[['Builder'], Optional[str]]], Optional[str]],
+        subject: Callable[[str], str],
+    ) -> Message:
+        """Build message. Text parts are created by `part(text, subtype)`, `subject(text)` renders Subject,
+        and values of headers depending on recipients or time of sending are returned by `header(name, value)`."""
         if self.raw_body:
             message = email.message_from_string(self.body)
         else:
@@ -293,43 +446,81 @@ class Builder:
 
             if self.body_type == ContentType.HTML:
                 body = self.body if self.body is not None else self.body_html
-                message = MIMEText(self.template(body or ''), 'html')
+                message = part(body or '', 'html')
             elif self.body_type == ContentType.PLAIN:
-                message = MIMEText(self.template(self.body or ''), 'plain')
+                message = part(self.body or '', 'plain')
             else:
                 message = MIMEMultipart('alternative')
                 if self.body:
-                    message.attach(MIMEText(self.template(self.body), 'plain'))
+                    message.attach(part(self.body, 'plain'))
                 if self.body_html:
-                    message.attach(MIMEText(self.template(self.body_html), 'html'))
+                    message.attach(part(self.body_html, 'html'))
+
+            if self.attachments:
+                body, message = message, MIMEMultipart('mixed')
+                message.attach(body)
 
-        for header in self.headers:
-            header_name, header_value = header.split('=', 1)
+        for item in self.headers:
+            header_name, header_value = item.split('=', 1)
             message[header_name.strip()] = header_value.strip()
 
         if 'Date' not in message:
-            message['Date'] = email.utils.formatdate(usegmt=True)
+            self._set_header(message, 'Date', header('Date', self._header_date))
         if 'Message-ID' not in message:
-            message['Message-ID'] = f'<{uuid.uuid4()}@smtpc>'
+            self._set_header(message, 'Message-ID', header('Message-ID', self._header_message_id))
 
         if self.subject:
-            message['Subject'] = self.template(self.subject)
+            message['Subject'] = subject(self.subject)
         if self.reply_to:
             message['Reply-To'] = self.reply_to[0]
         message['From'] = self.address_from or self.envelope_from
-        if self.address_to or self.address_cc:
-            if self.address_to:
-                message['To'] = ', '.join(self.address_to)
-            if self.address_cc:
-                message['Cc'] = ', '.join(self.address_cc)
-        else:
-            message['To'] = ', '.join(self.envelope_to)
+        self._set_header(message, 'To', header('To', self._header_to))
+        self._set_header(message, 'Cc', header('Cc', self._header_cc))
 
         del message['User-Agent']
         message['User-Agent'] = f'SMTPc/{__version__} (https://smtpc.net (c) 2021 Marcin Sztolcman)'
-
         return message
 
+    @staticmethod
+    def _set_header(message: Message, name: str, value: Optional[str]) -> NoReturn:
+        if value is not None:
+            message[name] = value
+
+    @staticmethod
+    def _header_date(builder: 'Builder') -> str:
+        return email.utils.formatdate(usegmt=True)
+
+    @staticmethod
+    def _header_message_id(builder: 'Builder') -> str:
+        return f'<{uuid.uuid4()}@smtpc>'
+
+    @staticmethod
+    def _header_to(builder: 'Builder') -> Optional[str]:
+        if builder.address_to or builder.address_cc:
+            return ', '.join(builder.address_to) if builder.address_to else None
+        return ', '.join(builder.envelope_to)
+
+    @staticmethod
+    def _header_cc(builder: 'Builder') -> Optional[str]:
+        return ', '.join(builder.address_cc) if builder.address_cc else None
+
+    def _derive(self, template_context: Optional[dict] = None, **addresses) -> 'Builder':
+        """Copy of builder with another template context and recipients."""
+        builder = copy.copy(self)
+        for name, value in addresses.items():
+            if value is not None:
+                setattr(builder, name, value)
+        if template_context is not None:
+            for field in template_context:
+                self._template_validate_field_name(field)
+            builder.template_context = template_context
+        return builder
+
+    def envelope(self) -> Tuple[str, List[str]]:
+        envelope_from = self.envelope_from or self.address_from
+        envelope_to = self.envelope_to or (self.address_to + self.address_cc + self.address_bcc)
+        return envelope_from, envelope_to
+
     def _set_property(self, name: str, initial: Any, low_prio: Optional[PredefinedMessage], defaults: dict) -> NoReturn:
         value = initial
         if low_prio and initial is None:
@@ -338,22 +529,39 @@ class Builder:
             value = defaults[name]
         setattr(self, name, value)
 
-    def template(self, data: str) -> str:
-        if not self.template_fields and not self.template_fields_json and not self.template_default_fields:
-            return data
-
-        fields = self.template_default_fields.copy()
-        for field in self.template_fields:
-            field, value = self._template_parse_field(field)
-            fields[field] = value
-
-        for field in self.template_fields_json:
-            field, value = self._template_parse_field(field, True)
-            fields[field] = value
+    @property
+    def template_default_fields(self) -> dict:
+        return {name: value(self) for name, value in self.TEMPLATE_DEFAULT_FIELDS.items()}
 
-        tpl = Template(data)
-        data = tpl.render(**fields)
-        return data
+    def template(self, data: str) -> str:
+        if not is_template(data):
+            return static_text(data)
+
+        tpl = compile_template(data)
+        return tpl.render(**self._template_context(template_variables(data)))
+
+    def _template_context(self, variables: Optional[Collection[str]] = None) -> dict:
+        """Template fields, with only these of `smtpc_*` fields which are in `variables` (all if not given)."""
+        fields = {name: value(self) for name, value in self.TEMPLATE_DEFAULT_FIELDS.items()
+            if variables is None or name in variables}
+        fields.update(self._template_fields())
+        fields.update(self.template_context)
+        return fields
+
+    def _template_fields(self) -> dict:
+        """Values of template_fields and template_fields_json, parsed once."""
+        if self._parsed_template_fields is None:
+            fields = {}
+            for field in self.template_fields:
+                field, value = self._template_parse_field(field)
+                fields[field] = value
+
+            for field in self.template_fields_json:
+                field, value = self._template_parse_field(field, True)
+                fields[field] = value
+            self._parsed_template_fields = fields
+
+        return self._parsed_template_fields
 
     @classmethod
     def _template_parse_field(cls, field: str, is_json: bool = False) -> Tuple[str, str]:
@@ -376,6 +584,165 @@ class Builder:
                 ' digits and underscores.')
 
 
+class _MessageCompiler:
+    """Replaces parts of message which depend on template context, recipients or time of sending with unique
+    placeholders while message is built, and remembers how to render every one of them."""
+    __slots__ = ('builder', 'policy', 'renderers', 'variables', 'generated')
+
+    def __init__(self, builder: Builder) -> NoReturn:
+        self.builder = builder
+        self.policy = email.policy.compat32.clone(linesep='\r\n')
+        self.renderers = {}
+        # variables used by all templates of message
+        self.variables = set()
+        # placeholders of parts rendered while message is sent (with Builder.stream_templates)
+        self.generated = {}
+
+    def part(self, text: str, subtype: str) -> Message:
+        if not is_template(text):
+            return mime.text_part(static_text(text), subtype, self.builder.allow_8bit)
+
+        tpl = self._compile_template(text)
+        if self.builder.stream_templates:
+            message = mime.generated_text_part(subtype)
+            self.generated[message.get_payload()] = tpl
+            return message
+
+        placeholder = self._placeholder()
+        # part without headers is generated as empty line followed by payload, it's replaced with whole part
+        self.renderers[b'\r\n' + placeholder.encode('ascii')] = lambda builder, fields: message_to_bytes(
+            mime.text_part(tpl.render(**fields), subtype, builder.allow_8bit, cache=False))
+
+        message = Message()
+        message.set_payload(placeholder)
+        return message
+
+    def header(self, name: str, value: Callable[[Builder], Optional[str]]) -> str:
+        return self._header(name, lambda builder, fields: value(builder))
+
+    def subject(self, text: str) -> str:
+        if not is_template(text):
+            return static_text(text)
+
+        tpl = self._compile_template(text)
+        return self._header('Subject', lambda builder, fields: tpl.render(**fields))
+
+    def _header(self, name: str, value: Callable[[Builder, dict], Optional[str]]) -> str:
+        def render(builder: Builder, fields: dict) -> bytes:
+            rendered = value(builder, fields)
+            return self.policy.fold_binary(name, rendered) if rendered is not None else b''
+
+        placeholder = self._placeholder()
+        self.renderers[f'{name}: {placeholder}\r\n'.encode('ascii')] = render
+        return placeholder
+
+    def compile(self, message: Message, attachments: Dict[str, str]) -> 'CompiledMessage':
+        skeleton = message_to_bytes(message)
+        pattern = re.compile(b'|'.join(re.escape(placeholder) for placeholder in self.renderers))
+
+        segments = []
+        position = 0
+        for match in pattern.finditer(skeleton):
+            segments.append(skeleton[position:match.start()])
+            segments.append(self.renderers[match.group()])
+            position = match.end()
+        segments.append(skeleton[position:])
+
+        return CompiledMessage(self.builder, [segment for segment in segments if segment], attachments,
+            frozenset(self.variables), self.generated)
+
+    def _compile_template(self, text: str) -> Union[Template, SimpleTemplate]:
+        tpl = compile_template(text)
+        self.variables.update(template_variables(text))
+        return tpl
+
+    @staticmethod
+    def _placeholder() -> str:
+        return f'smtpc-placeholder-{uuid.uuid4().hex}'
+
+
+class CompiledMessage:
+    """Message built once, and rendered for many template contexts and recipients.
+
+    Message is kept as list of already encoded segments, and functions rendering the segments which depend
+    on template context, recipients, or time of sending (Date and Message-ID headers). Rendering is only
+    joining them, without building MIME structure again."""
+    __slots__ = ('builder', 'segments', 'attachments', 'variables', 'generated')
+
+    def __init__(self, builder: Builder, segments: List[Union[bytes, Callable[[Builder, dict], bytes]]],
+        attachments: Dict[str, str],
+        variables: Optional[FrozenSet[str]] = None,
+        generated: Optional[Dict[str, Union[Template, SimpleTemplate]]] = None,
+    ) -> NoReturn:
+        self.builder = builder
+        self.segments = segments
+        self.attachments = attachments
+        self.variables = variables
+        # templates of parts rendered while message is sent, by their placeholders
+        self.generated = generated or {}
+
+    def render(self, template_context: Optional[dict] = None, **addresses) -> mime.MultipartStream:
+        """Message for given template context and recipients (`envelope_to`, `address_to`, `address_cc`,
+        `address_bcc`), if they are different than recipients of the compiled Builder."""
+        builder = self.builder._derive(template_context, **addresses)
+        fields = builder._template_context(self.variables)
+        data = b''.join(segment if isinstance(segment, bytes) else segment(builder, fields) for segment in self.segments)
+        attachments = self.attachments
+        if self.generated:
+            attachments = {**attachments, **{placeholder: mime.GeneratedContent(functools.partial(tpl.generate, **fields))
+                for placeholder, tpl in self.generated.items()}}
+        return mime.MultipartStream(data, attachments)
+
+    def envelope(self, **addresses) -> Tuple[str, List[str]]:
+        return self.builder._derive(**addresses).envelope()
+
+    def __str__(self) -> str:
+        return f'<CompiledMessage segments={len(self.segments)}, attachments={list(self.attachments.values())}>'
+
+    __repr__ = __str__
+
+
+class SendResult:
+    __slots__ = ('recipients', 'rejects', 'error')
+
+    def __init__(self, recipients: List[str], *, rejects: Optional[dict] = None, error: Optional[Exception] = None) -> NoReturn:
+        self.recipients = recipients
+        self.rejects = rejects or {}
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __str__(self) -> str:
+        return f'<SendResult recipients={self.recipients}, rejects={self.rejects}, error={self.error!r}>'
+
+    __repr__ = __str__
+
+
+class _SenderSession:
+    """SMTP session used by single worker of Sender.execute_many, switched when destination host changes."""
+    __slots__ = ('pool', 'conn', 'sent')
+
+    def __init__(self, pool: ConnectionPool) -> NoReturn:
+        self.pool = pool
+        self.conn: Optional[PooledConnection] = None
+        self.sent = 0
+
+    def acquire(self, key: PoolKey, factory: Callable[[], smtplib.SMTP]) -> PooledConnection:
+        if self.conn is not None and self.conn.key != key:
+            self.release()
+        if self.conn is None:
+            self.conn = self.pool.checkout(key, factory)
+            self.sent = 0
+        return self.conn
+
+    def release(self, discard: bool = False) -> NoReturn:
+        if self.conn is not None:
+            self.pool.checkin(self.conn, discard=discard)
+            self.conn = None
+
+
 class Sender:
     __slots__ = (
         'connection_timeout', 'source_address',
@@ -385,7 +752,7 @@ class Sender:
         'envelope_to', 'address_to', 'address_cc', 'address_bcc', 'reply_to',
         'message_body', 'predefined_profile', 'predefined_message',
         'debug_level', 'dry_run',
-        'disable_ehlo', 'auth_method', 'smtp_interactive',
+        'disable_ehlo', 'auth_method', 'smtp_interactive', 'delivery', 'mx_resolver', 'pool',
     )
 
     def __init__(self, *,
@@ -409,19 +776,24 @@ class Sender:
         address_cc: Optional[List[str]],
         address_bcc: Optional[List[str]],
         reply_to: Optional[List[str]],
-        message_body: Optional[Union[MIMEBase, str]],
+        message_body: Optional[Union[MIMEBase, str, MessageStream]],
         predefined_profile: Optional[PredefinedProfile],
         predefined_message: Optional[PredefinedMessage],
         dry_run: Optional[bool],
         disable_ehlo: Optional[bool],
         auth_method: Optional[SMTPAuthMethod],
         smtp_interactive: Optional[bool],
+        delivery: Optional[DeliveryMode] = None,
+        mx_resolver: Optional[mx.MXCache] = None,
+        pool: Optional[ConnectionPool] = None,
     ) -> NoReturn:
         self.debug_level = debug_level
         self.message_body = message_body
         self.dry_run = dry_run
         self.disable_ehlo = disable_ehlo
         self.smtp_interactive = smtp_interactive
+        self.predefined_profile = predefined_profile
+        self.pool = pool
 
         if predefined_profile:
             logger.debug('using connection details from predefined profile', profile=predefined_profile.name)
@@ -435,11 +807,13 @@ class Sender:
             'connection_timeout': connection_timeout,
             'identify_as': identify_as,
             'source_address': source_address,
+            'delivery': delivery,
         }
         for name in profile_fields:
             self._set_property(name, profile_fields[name], predefined_profile, DEFAULTS_VALUES_PROFILE)
 
         self.password = self.prepare_password(self.password, password_key)
+        self.mx_resolver = mx_resolver
 
         if any(item is not None for item in [port, ssl, tls, no_ssl, no_tls]) or not predefined_profile:
             self.ssl, self.tls = determine_ssl_tls_by_port(port, ssl, tls, no_ssl, no_tls)
@@ -463,22 +837,250 @@ class Sender:
             logger.debug('message settings', **{k: getattr(self, k) for k in message_fields})
 
     def execute(self) -> List[str]:
-        if self.ssl:
-            logger.debug('connecting using ssl', host=self.host, port=self.port,
-                connection_timeout=self.connection_timeout, source_address=self.source_address)
-            # don't pass host, don't want to connect yet!
-            if not self.dry_run:
-                smtp = smtplib.SMTP_SSL(timeout=self.connection_timeout, source_address=self.source_address)
-        else:
-            logger.debug('connecting using plain connection', host=self.host, port=self.port,
-                connection_timeout=self.connection_timeout, source_address=self.source_address)
-            # don't pass host, don't want to connect yet!
-            if not self.dry_run:
-                smtp = smtplib.SMTP(timeout=self.connection_timeout, source_address=self.source_address)
-
         if self.dry_run:
+            self._log_connecting(self.host, self.port)
             return []
 
+        if self.delivery == DeliveryMode.MX:
+            result = next(self.execute_many([(self.message_body, *self.envelope())]))
+            if not result.ok:
+                raise result.error
+            return result.recipients
+
+        self.wait_for_rate_limit()
+        pool = self.pool or ConnectionPool(probe=False)
+        try:
+            try:
+                conn = pool.checkout(self.pool_key, self.connect)
+            except ConnectionFailedError:
+                exitc(ExitCodes.CONNECTION_ERROR)
+
+            envelope_from, envelope_to = self.envelope()
+
+            rejects = None
+            discard = False
+            try:
+                rejects = self.send(conn.smtp, self.message_body, envelope_from, envelope_to)
+                conn.mark_used()
+            except smtplib.SMTPSenderRefused as exc:
+                self.log_exception(exc.smtp_error.decode(), smtp_code=exc.smtp_code)
+                exitc(ExitCodes.OTHER)
+            except (smtplib.SMTPServerDisconnected, OSError):
+                discard = True
+                raise
+            finally:
+                pool.checkin(conn, discard=discard)
+        finally:
+            if pool is not self.pool:
+                pool.close()
+
+        return self.accepted_recipients(envelope_to, rejects)
+
+    def execute_many(self, messages: Iterable[Tuple[Union[MIMEBase, str], str, List[str]]],
+        concurrency: int = 1,
+        reconnect_attempts: int = 0,
+    ) -> Iterator[SendResult]:
+        """Send every (message_body, envelope_from, envelope_to) item reusing SMTP sessions.
+
+        With `concurrency` > 1 messages are spread across that many worker threads, every one of them
+        with own SMTP session. Results are yielded in the same order as messages.
+
+        Session is checked out from the pool lazily on the first message, and RSET is issued between
+        transactions. Session is given back to the pool when it reaches pool's max messages limit.
+        When session is lost during transaction, new one is opened and message is sent again, at most
+        `reconnect_attempts` times. Errors related to single transaction are reported in the SendResult,
+        connection errors are raised.
+        """
+        pool = self.pool or ConnectionPool(max_size=concurrency, probe=False)
+        try:
+            if concurrency > 1:
+                yield from self._execute_threaded(pool, messages, concurrency, reconnect_attempts)
+            else:
+                for _, result in self._execute_session(pool, enumerate(messages), reconnect_attempts):
+                    yield result
+        finally:
+            if pool is not self.pool:
+                pool.close()
+
+    def _execute_session(self, pool: ConnectionPool, messages: Iterable[Tuple[int, tuple]],
+        reconnect_attempts: int,
+    ) -> Iterator[Tuple[int, SendResult]]:
+        session = _SenderSession(pool)
+        try:
+            for index, (message_body, envelope_from, envelope_to) in messages:
+                if self.delivery == DeliveryMode.MX:
+                    result = self._deliver_mx(session, message_body, envelope_from, envelope_to, reconnect_attempts)
+                else:
+                    result = self._transaction(session, self.pool_key, self.connect,
+                        message_body, envelope_from, envelope_to, reconnect_attempts)
+                yield index, result
+        finally:
+            session.release()
+
+    def _transaction(self, session: '_SenderSession', key: PoolKey, factory: Callable[[], smtplib.SMTP],
+        message_body: Union[MIMEBase, str], envelope_from: str, envelope_to: List[str], reconnect_attempts: int,
+    ) -> SendResult:
+        self.wait_for_rate_limit()
+        attempt = 0
+        while True:
+            conn = session.acquire(key, factory)
+            try:
+                if session.sent:
+                    conn.smtp.rset()
+                session.sent += 1
+                rejects = self.send(conn.smtp, message_body, envelope_from, envelope_to)
+            except (smtplib.SMTPSenderRefused, smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError) as exc:
+                if conn.smtp.sock is None:
+                    # connection closed after 421 reply, next message needs a new one
+                    session.release(discard=True)
+                return SendResult(envelope_to, error=exc)
+            except (smtplib.SMTPServerDisconnected, OSError) as exc:
+                session.release(discard=True)
+                if attempt >= reconnect_attempts:
+                    raise
+                attempt += 1
+                logger.warning('connection lost, reconnecting', attempt=attempt, message=str(exc))
+                continue
+
+            conn.mark_used()
+            if session.pool.is_exhausted(conn):
+                session.release()
+
+            return SendResult(self.accepted_recipients(envelope_to, rejects), rejects=rejects)
+
+    def _deliver_mx(self, session: '_SenderSession', message_body: Union[MIMEBase, str], envelope_from: str,
+        envelope_to: List[str], reconnect_attempts: int,
+    ) -> SendResult:
+        """Deliver message directly to MX hosts of recipients domains, one transaction per domain.
+
+        Failure of one domain doesn't stop delivery to others: it's logged and message is reported
+        as failed only if no recipient accepted it."""
+        resolver = self.mx_resolver or mx.default_resolver()
+        accepted, rejects, errors = [], {}, []
+        for domain, recipients in mx.group_by_domain(envelope_to).items():
+            try:
+                result = None
+                for host in resolver.resolve(domain):
+                    try:
+                        result = self._transaction(session, self._pool_key(host), functools.partial(self._connect_mx, host),
+                            message_body, envelope_from, recipients, reconnect_attempts)
+                        break
+                    except ConnectionFailedError as exc:
+                        result = SendResult(recipients, error=exc)
+            except (MXLookupError, smtplib.SMTPServerDisconnected, OSError) as exc:
+                result = SendResult(recipients, error=exc)
+
+            if result.ok:
+                accepted.extend(result.recipients)
+                rejects.update(result.rejects)
+            else:
+                self.log_exception('cannot deliver message', domain=domain, recipients=recipients, message=str(result.error))
+                errors.append(result.error)
+
+        if errors and not accepted:
+            return SendResult(envelope_to, rejects=rejects, error=errors[0])
+        return SendResult(accepted, rejects=rejects)
+
+    def _connect_mx(self, host: str) -> smtplib.SMTP:
+        """Connect to MX host, failure before the transaction (greeting, EHLO, STARTTLS) means next MX host should be tried."""
+        try:
+            return self.connect(host)
+        except (smtplib.SMTPException, OSError) as exc:
+            self.log_exception('connection error', host=host, port=self.port, message=str(exc), exception=exc.__class__.__name__)
+            raise ConnectionFailedError(f'Cannot connect to {host}:{self.port}: {exc}') from exc
+
+    def _execute_threaded(self, pool: ConnectionPool, messages: Iterable[tuple], concurrency: int,
+        reconnect_attempts: int,
+    ) -> Iterator[SendResult]:
+        tasks = queue.SimpleQueue()
+        results = queue.SimpleQueue()
+
+        def _worker() -> NoReturn:
+            try:
+                for index, result in self._execute_session(pool, iter(tasks.get, None), reconnect_attempts):
+                    results.put((index, result, None))
+            except BaseException as exc:  # SystemExit too, otherwise main thread would wait forever
+                results.put((None, None, exc))
+
+        workers = [threading.Thread(target=_worker, name=f'smtpc-sender-{i}', daemon=True) for i in range(concurrency)]
+        for worker in workers:
+            worker.start()
+
+        messages = enumerate(messages)
+        pending = {}
+        next_index = in_flight = 0
+        exhausted = False
+        try:
+            while True:
+                # keep workers busy, but don't build all messages upfront
+                while not exhausted and in_flight < concurrency * 2:
+                    item = next(messages, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    tasks.put(item)
+                    in_flight += 1
+
+                if not in_flight:
+                    break
+
+                index, result, error = results.get()
+                if error is not None:
+                    raise error
+                in_flight -= 1
+                pending[index] = result
+                while next_index in pending:
+                    yield pending.pop(next_index)
+                    next_index += 1
+        finally:
+            try:
+                while True:
+                    tasks.get_nowait()
+            except queue.Empty:
+                pass
+            for _ in workers:
+                tasks.put(None)
+            for worker in workers:
+                worker.join()
+
+    @property
+    def pool_key(self) -> PoolKey:
+        return self._pool_key(self.host)
+
+    @property
+    def ssl_context(self) -> tls.SessionCachingContext:
+        """SSL context shared by all connections using the same profile, so TLS sessions can be resumed."""
+        return tls.get_context(self.predefined_profile.name if self.predefined_profile else f'{self.host}:{self.port}')
+
+    @property
+    def rate_limiter(self) -> Optional[RateLimiter]:
+        """Rate limiter of used profile, shared with every other smtpc process using the same profile."""
+        profile = self.predefined_profile
+        if not profile or not (profile.rate_limit or profile.rate_limit_daily):
+            return None
+        return RateLimiter(config.RATE_LIMIT_DIR / f'{profile.name}.json', rate=profile.rate_limit,
+            burst=profile.rate_limit_burst, daily_quota=profile.rate_limit_daily)
+
+    def wait_for_rate_limit(self) -> NoReturn:
+        rate_limiter = self.rate_limiter
+        if rate_limiter:
+            rate_limiter.acquire()
+
+    def _pool_key(self, host: str) -> PoolKey:
+        return host, self.port, bool(self.ssl), bool(self.tls), self.login, self.source_address, self.identify_as
+
+    def connect(self, host: Optional[str] = None, port: Optional[int] = None) -> smtplib.SMTP:
+        host = host or self.host
+        port = port or self.port
+
+        self._log_connecting(host, port)
+        # don't pass host, don't want to connect yet!
+        if self.ssl:
+            smtp = smtplib.SMTP_SSL(timeout=self.connection_timeout, source_address=self.source_address,
+                context=self.ssl_context)
+        else:
+            smtp = smtplib.SMTP(timeout=self.connection_timeout, source_address=self.source_address)
+
         smtp.set_debuglevel(1)  # noqa
         if self.debug_level > 1:
             smtp_debug_printer = SmtpDebugPrinter()
@@ -490,16 +1092,16 @@ class Sender:
 
         try:
             # HACK: connect doesn't set smtp._host, then ssl/tls will not work :/
-            smtp._host = self.host
-            smtp_code, smtp_message = smtp.connect(self.host, self.port, source_address=self.source_address)
-            logger.debug('connected', host=self.host, port=self.port, source_address=self.source_address,
+            smtp._host = host
+            smtp_code, smtp_message = smtp.connect(host, port, source_address=self.source_address)
+            logger.debug('connected', host=host, port=port, source_address=self.source_address,
                 smtp_code=smtp_code, smtp_message=smtp_message.decode())
         except socket.gaierror as exc:
-            self.log_exception('connection error', host=self.host, port=self.port, errno=exc.errno, message=exc.strerror)
-            exitc(ExitCodes.CONNECTION_ERROR)
+            self.log_exception('connection error', host=host, port=port, errno=exc.errno, message=exc.strerror)
+            raise ConnectionFailedError(f'Cannot connect to {host}:{port}: {exc.strerror}') from exc
         except Exception as exc:
-            self.log_exception('connection error', host=self.host, port=self.port, message=str(exc), exception=exc.__class__.__name__)
-            exitc(ExitCodes.CONNECTION_ERROR)
+            self.log_exception('connection error', host=host, port=port, message=str(exc), exception=exc.__class__.__name__)
+            raise ConnectionFailedError(f'Cannot connect to {host}:{port}: {exc}') from exc
 
         if self.smtp_interactive:
             smtp.sock = _interactive_socket(smtp.sock)
@@ -509,34 +1111,179 @@ class Sender:
 
         if self.tls:
             logger.debug('upgrading connection to tls')
-            smtp.starttls()
+            smtp.starttls(context=self.ssl_context)
             self.smtp_ehlo_or_helo_if_needed(smtp, self.identify_as, self.disable_ehlo)
 
         if self.login and self.password:
             self.smtp_login(smtp, self.login, self.password, self.auth_method)
 
-        envelope_from = self.envelope_from or self.address_from
-        envelope_to = self.envelope_to or (self.address_to + self.address_cc + self.address_bcc)
+        return smtp
+
+    def send(self, smtp: smtplib.SMTP, message_body: Union[MIMEBase, str, MessageStream],
+        envelope_from: str, envelope_to: List[str],
+    ) -> dict:
+        mail_options = self.mail_options(smtp, message_body, envelope_from, envelope_to)
+        if mime.has_8bit(message_body) and not smtp.has_extn('8bitmime'):
+            message_body = mime.downgrade_8bit(message_body)
+
+        if isinstance(message_body, MessageStream) and message_body.streamed:
+            rejects = self.smtp_sendmail(smtp, envelope_from, envelope_to, message_body, mail_options)
+        elif mail_options or smtp.has_extn('pipelining') or smtp.has_extn('chunking'):
+            rejects = self.smtp_sendmail(smtp, envelope_from, envelope_to, message_to_bytes(message_body), mail_options)
+        else:
+            get_body = getattr(message_body, 'as_string', lambda: message_body)
+            body = get_body()
+            # smtplib can send only ASCII strings, anything else has to be encoded first
+            rejects = smtp.sendmail(envelope_from, envelope_to, body if body.isascii() else message_to_bytes(body))
+        logger.debug('message sent', recipients=envelope_to, rejects=rejects or None)
+        return rejects
+
+    @staticmethod
+    def mail_options(smtp: smtplib.SMTP, message_body: Union[MIMEBase, str, MessageStream],
+        envelope_from: str, envelope_to: List[str],
+    ) -> List[str]:
+        """MAIL FROM parameters for 8bit message (RFC 6152) and internationalized addresses (RFC 6531),
+        if server supports them."""
+        mail_options = []
+        if smtp.has_extn('8bitmime') and mime.has_8bit(message_body):
+            mail_options.append('BODY=8BITMIME')
+        if smtp.has_extn('smtputf8') and not all(address.isascii() for address in [envelope_from, *envelope_to]):
+            mail_options.append('SMTPUTF8')
+        return mail_options
+
+    def smtp_sendmail(self, smtp: smtplib.SMTP, envelope_from: str, envelope_to: List[str],
+        message_body: Union[bytes, MessageStream],
+        mail_options: Optional[List[str]] = None,
+    ) -> dict:
+        """The same as smtplib.SMTP.sendmail, but MAIL FROM and all RCPT TO commands are sent at once
+        if server supports it (RFC 2920), message is sent with BDAT if server supports it (RFC 3030),
+        and message can be streamed from MessageStream."""
+        mail_options = list(mail_options or [])
+        if 'SMTPUTF8' in mail_options:
+            # reset to ASCII by smtplib on RSET
+            smtp.command_encoding = 'utf-8'
+        size = message_body.size if isinstance(message_body, MessageStream) else len(message_body)
+        if smtp.has_extn('size') and size is not None:
+            mail_options.append(f'size={size}')
+
+        commands = [f"mail FROM:{smtplib.quoteaddr(envelope_from)}{''.join(' ' + item for item in mail_options)}"]
+        commands.extend(f'rcpt TO:{smtplib.quoteaddr(address)}' for address in envelope_to)
+        if smtp.has_extn('pipelining'):
+            logger.debug('pipelining envelope', commands=len(commands))
+            smtp.send(''.join(f'{command}{smtplib.CRLF}' for command in commands))
+            # replies have to be read for all commands, even if the server refused the sender
+            mail_code, mail_resp = smtp.getreply()
+            rcpt_replies = [smtp.getreply() for _ in envelope_to]
+        else:
+            smtp.putcmd(commands[0])
+            mail_code, mail_resp = smtp.getreply()
+            rcpt_replies = []
+            if mail_code == 250:
+                for command in commands[1:]:
+                    smtp.putcmd(command)
+                    rcpt_replies.append(smtp.getreply())
+
+        rejects = {}
+        for address, (code, resp) in zip(envelope_to, rcpt_replies):
+            if code not in (250, 251):
+                rejects[address] = (code, resp)
+
+        if mail_code != 250:
+            self._smtp_abort_transaction(smtp, mail_code)
+            raise smtplib.SMTPSenderRefused(mail_code, mail_resp, envelope_from)
+
+        if any(code == 421 for code, _ in rcpt_replies):
+            smtp.close()
+            raise smtplib.SMTPRecipientsRefused(rejects)
+
+        if len(rejects) == len(envelope_to):
+            self._smtp_abort_transaction(smtp)
+            raise smtplib.SMTPRecipientsRefused(rejects)
+
+        if smtp.has_extn('chunking'):
+            code, resp = self.smtp_bdat(smtp, message_body)
+        else:
+            code, resp = self.smtp_data(smtp, message_body)
+        if code != 250:
+            self._smtp_abort_transaction(smtp, code)
+            raise smtplib.SMTPDataError(code, resp)
+
+        return rejects
+
+    def smtp_data(self, smtp: smtplib.SMTP, message_body: Union[bytes, MessageStream]) -> Tuple[int, bytes]:
+        """DATA command, with MessageStream sent in chunks as they are read."""
+        if not isinstance(message_body, MessageStream):
+            return smtp.data(message_body)
+
+        smtp.putcmd('data')
+        code, resp = smtp.getreply()
+        if code != 354:
+            raise smtplib.SMTPDataError(code, resp)
+
+        for chunk in encode_data(message_body.chunks()):
+            smtp.send(chunk)
+        return smtp.getreply()
+
+    def smtp_bdat(self, smtp: smtplib.SMTP, message_body: Union[bytes, MessageStream]) -> Tuple[int, bytes]:
+        """Send message with BDAT commands (RFC 3030): in binary chunks, without dot stuffing and end of data marker.
+
+        With PIPELINING chunks are sent without waiting for replies, which are read after every BDAT_MAX_PENDING
+        chunks and at the end."""
+        if isinstance(message_body, MessageStream):
+            chunks = normalize_line_endings(message_body.chunks())
+        else:
+            chunks = split_chunks(message_body)
+        pipelining = smtp.has_extn('pipelining')
+
+        chunks = iter(chunks)
+        chunk = next(chunks, b'')
+        pending = 0
+        while True:
+            following = next(chunks, None)
+            last = following is None
+            smtp.send(f"BDAT {len(chunk)}{' LAST' if last else ''}{smtplib.CRLF}".encode('ascii') + chunk)
+            pending += 1
+            if pipelining and not last and pending < BDAT_MAX_PENDING:
+                chunk = following
+                continue
+
+            replies = [smtp.getreply() for _ in range(pending)]
+            pending = 0
+            failed = [reply for reply in replies if reply[0] != 250]
+            if failed:
+                return failed[0]
+            if last:
+                return replies[-1]
+            chunk = following
+
+    def _smtp_abort_transaction(self, smtp: smtplib.SMTP, code: Optional[int] = None) -> NoReturn:
+        if code == 421:
+            smtp.close()
+            return
 
-        rejects = None
-        get_body = getattr(self.message_body, 'as_string', lambda: self.message_body)
         try:
-            rejects = smtp.sendmail(envelope_from, envelope_to, get_body())
-            logger.debug('message sent', recipients=envelope_from, rejects=rejects or None)
-        except smtplib.SMTPSenderRefused as exc:
-            self.log_exception(exc.smtp_error.decode(), smtp_code=exc.smtp_code)
-            exitc(ExitCodes.OTHER)
-        finally:
-            smtp.quit()
-            logger.debug('disconnected from remote server')
+            smtp.rset()
+        except smtplib.SMTPServerDisconnected:
+            pass
+
+    def envelope(self) -> Tuple[str, List[str]]:
+        envelope_from = self.envelope_from or self.address_from
+        envelope_to = self.envelope_to or (self.address_to + self.address_cc + self.address_bcc)
+        return envelope_from, envelope_to
 
-        senders = list(copy.copy(envelope_to))
+    @staticmethod
+    def accepted_recipients(envelope_to: List[str], rejects: Optional[dict]) -> List[str]:
+        receivers = list(copy.copy(envelope_to))
         if rejects:
             for address, info in rejects.items():
                 logger.error(f"server doesn't accept message for {address}", smtp_code=info[0], smtp_message=info[1])
-                senders.remove(address)
+                receivers.remove(address)
+
+        return receivers
 
-        return senders
+    def _log_connecting(self, host: str, port: int) -> NoReturn:
+        logger.debug('connecting using ssl' if self.ssl else 'connecting using plain connection', host=host, port=port,
+            connection_timeout=self.connection_timeout, source_address=self.source_address)
 
     def smtp_ehlo_or_helo_if_needed(self, smtp: smtplib.SMTP, name: str = '', disable_ehlo: bool = False) -> NoReturn:
         if smtp.helo_resp is None and smtp.ehlo_resp is None:
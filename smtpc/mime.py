@@ -0,0 +1,329 @@
+__all__ = ['text_part', 'choose_encoding', 'encoded_sizes', 'has_8bit', 'downgrade_8bit',
+    'attachment_part', 'attach_files', 'generated_text_part', 'GeneratedContent', 'MultipartStream', 'freeze']
+
+import base64
+import copy
+import email
+import email.charset
+import hashlib
+import mimetypes
+import os
+import re
+import uuid
+from email.message import Message
+from email.mime.base import MIMEBase
+from email.mime.text import MIMEText
+from typing import Callable, Dict, Iterable, Iterator, List, NoReturn, Optional, Union
+
+from .cache import LRUCache
+from .enums import TransferEncoding
+from .errors import AttachmentError
+from .stream import MessageStream, read_chunks, split_chunks
+
+# RFC 5322 2.1.1: lines must not be longer than 998 characters, excluding CRLF
+MAX_LINE_LENGTH = 998
+# bytes which quoted-printable leaves as they are
+_QP_SAFE = bytes(sorted(set(range(33, 127)) - {ord('=')})) + b' \t\r\n'
+_BODY_ENCODINGS = {
+    TransferEncoding.SEVEN_BIT: None,
+    TransferEncoding.EIGHT_BIT: None,
+    TransferEncoding.QUOTED_PRINTABLE: email.charset.QP,
+    TransferEncoding.BASE64: email.charset.BASE64,
+}
+# encoded parts, keyed by hash of their content, reused by every message containing the same part
+ENCODED_PARTS = LRUCache(64 * 1024 * 1024)
+# bigger attachments are always encoded on the fly, without keeping them in memory
+MAX_CACHED_FILE_SIZE = 16 * 1024 * 1024
+# (path, device, inode, size, mtime) => hash of attachment content, to avoid reading unchanged files again
+_FILE_DIGESTS = LRUCache(1024)
+
+
+def _has_long_lines(data: bytes) -> bool:
+    return any(len(line) > MAX_LINE_LENGTH for line in data.splitlines())
+
+
+def encoded_sizes(data: bytes, allow_8bit: bool = True) -> Dict[TransferEncoding, int]:
+    """Size of data after encoding with every transfer encoding which can be used for it."""
+    if data.isascii() and not _has_long_lines(data):
+        return {TransferEncoding.SEVEN_BIT: len(data)}
+
+    unsafe = len(data.translate(None, _QP_SAFE))
+    qp_size = len(data) + 2 * unsafe
+    # soft line breaks ("=\n") to keep lines at most 76 characters long
+    qp_size += qp_size // 75 * 2
+    base64_size = (len(data) + 2) // 3 * 4
+    base64_size += base64_size // 76 + 1
+
+    sizes = {TransferEncoding.QUOTED_PRINTABLE: qp_size, TransferEncoding.BASE64: base64_size}
+    if allow_8bit and not _has_long_lines(data):
+        sizes[TransferEncoding.EIGHT_BIT] = len(data)
+    return sizes
+
+
+def choose_encoding(data: bytes, allow_8bit: bool = True) -> TransferEncoding:
+    """Transfer encoding giving the smallest size on the wire. On ties 8bit is preferred over quoted-printable
+    (which is still readable) and quoted-printable over base64."""
+    sizes = encoded_sizes(data, allow_8bit)
+    return min(sizes, key=lambda item: (sizes[item], list(TransferEncoding).index(item)))
+
+
+def text_part(text: str, subtype: str, allow_8bit: bool = True, cache: bool = True) -> MIMEText:
+    """MIMEText with the most compact transfer encoding: 7bit for ASCII text, otherwise the smallest of
+    8bit (if allowed), quoted-printable and base64.
+
+    Text rendered from template for single message should not be cached, it would only evict shared parts."""
+    data = text.encode('utf-8')
+    if not cache:
+        return _text_part(data, text, subtype, allow_8bit)
+
+    key = ('text', hashlib.sha256(data).digest(), subtype, allow_8bit)
+    part = ENCODED_PARTS.get(key)
+    if part is None:
+        part = _text_part(data, text, subtype, allow_8bit)
+        ENCODED_PARTS.set(key, part, len(part.get_payload()))
+    # cached part is shared, every message gets its own copy (strings with encoded content are not copied)
+    return copy.deepcopy(part)
+
+
+def _text_part(data: bytes, text: str, subtype: str, allow_8bit: bool) -> MIMEText:
+    encoding = choose_encoding(data, allow_8bit)
+    if encoding == TransferEncoding.SEVEN_BIT:
+        return MIMEText(text, subtype, 'us-ascii')
+
+    charset = email.charset.Charset('utf-8')
+    charset.body_encoding = _BODY_ENCODINGS[encoding]
+    return MIMEText(text, subtype, charset)
+
+
+def has_8bit(message: Union[Message, MessageStream, str, bytes]) -> bool:
+    """Check if message (or raw message body) contains anything but 7bit data."""
+    if isinstance(message, MessageStream):
+        return message.has_8bit()
+    if isinstance(message, (str, bytes)):
+        return not message.isascii()
+    return any(str(part.get('Content-Transfer-Encoding', '')).lower() == '8bit' for part in message.walk())
+
+
+def downgrade_8bit(message: Union[Message, MessageStream, str, bytes]) -> Union[Message, MessageStream, str, bytes]:
+    """Copy of message with 8bit parts encoded again with quoted-printable or base64,
+    for servers without 8BITMIME extension. Raw message bodies without 8bit parts are returned as they are."""
+    if isinstance(message, MessageStream):
+        return message.downgrade_8bit()
+    if isinstance(message, (str, bytes)):
+        parsed = email.message_from_bytes(message.encode('utf-8') if isinstance(message, str) else message)
+        return downgrade_8bit(parsed) if has_8bit(parsed) else message
+
+    message = copy.deepcopy(message)
+    for part in message.walk():
+        if str(part.get('Content-Transfer-Encoding', '')).lower() != '8bit':
+            continue
+
+        data = part.get_payload(decode=True)
+        charset = email.charset.Charset(part.get_content_charset() or 'utf-8')
+        charset.body_encoding = _BODY_ENCODINGS[choose_encoding(data, allow_8bit=False)]
+        del part['Content-Transfer-Encoding']
+        part.set_payload(data.decode(str(charset), 'replace'), charset)
+    return message
+
+
+# 76 characters long lines of base64
+_BASE64_LINE = 57
+_BASE64_CHUNK_SIZE = _BASE64_LINE * 1024
+
+
+def attachment_part(path: str) -> MIMEBase:
+    """Headers of attachment part for file, content is added when message is sent."""
+    content_type, encoding = mimetypes.guess_type(path)
+    if content_type is None or encoding is not None:
+        content_type = 'application/octet-stream'
+    maintype, subtype = content_type.split('/', 1)
+
+    part = MIMEBase(maintype, subtype)
+    part.add_header('Content-Disposition', 'attachment', filename=os.path.basename(path))
+    part['Content-Transfer-Encoding'] = 'base64'
+    return part
+
+
+def attach_files(message: MIMEBase, paths: List[str]) -> 'MultipartStream':
+    """Add attachments to multipart message."""
+    attachments = {}
+    for path in paths:
+        if not os.path.isfile(path):
+            raise AttachmentError(f'Cannot attach {path}: no such file')
+
+        part = attachment_part(path)
+        placeholder = f'smtpc-attachment-{uuid.uuid4().hex}'
+        part.set_payload(placeholder)
+        message.attach(part)
+        attachments[placeholder] = path
+
+    return MultipartStream(message, attachments)
+
+
+def generated_text_part(subtype: str) -> MIMEBase:
+    """Headers of text part with GeneratedContent, it's represented in the message by placeholder (part's payload).
+    Content is not known upfront, so it's always base64 encoded."""
+    part = MIMEBase('text', subtype, charset='utf-8')
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.set_payload(f'smtpc-generated-{uuid.uuid4().hex}')
+    return part
+
+
+class GeneratedContent:
+    """Content of text part produced in pieces (ie. by template generator) while message is sent, and encoded
+    on the fly, so it's never kept in memory as a whole. `generate` is called again for every transaction."""
+    __slots__ = ('generate', )
+
+    def __init__(self, generate: Callable[[], Iterable[str]]) -> NoReturn:
+        self.generate = generate
+
+    def encoded_chunks(self) -> Iterator[bytes]:
+        return _encode_base64_chunks(piece.encode('utf-8') for piece in self.generate())
+
+    def __str__(self) -> str:
+        return f'<GeneratedContent generate={self.generate}>'
+
+    __repr__ = __str__
+
+
+def _encode_base64(data: bytes) -> bytes:
+    """Base64 with 76 characters long lines, separated (but not terminated) with CRLF."""
+    return base64.encodebytes(data)[:-1].replace(b'\n', b'\r\n')
+
+
+def _encode_base64_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """The same as _encode_base64 on all chunks joined, but encoded in pieces of about _BASE64_CHUNK_SIZE."""
+    buffer = bytearray()
+    first = True
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) < _BASE64_CHUNK_SIZE:
+            continue
+
+        size = len(buffer) - len(buffer) % _BASE64_LINE
+        encoded = _encode_base64(bytes(buffer[:size]))
+        del buffer[:size]
+        yield encoded if first else b'\r\n' + encoded
+        first = False
+
+    if buffer:
+        encoded = _encode_base64(bytes(buffer))
+        yield encoded if first else b'\r\n' + encoded
+
+
+def _encoded_file(path: str, stat: os.stat_result) -> bytes:
+    """Base64 encoded content of the file, from cache if the same content was already encoded."""
+    signature = (path, stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    digest = _FILE_DIGESTS.get(signature)
+    if digest is not None:
+        encoded = ENCODED_PARTS.get(('file', digest, TransferEncoding.BASE64))
+        if encoded is not None:
+            return encoded
+
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    digest = hashlib.sha256(data).digest()
+    _FILE_DIGESTS.set(signature, digest, 1)
+
+    key = ('file', digest, TransferEncoding.BASE64)
+    encoded = ENCODED_PARTS.get(key)
+    if encoded is None:
+        encoded = _encode_base64(data)
+        ENCODED_PARTS.set(key, encoded, len(encoded))
+    return encoded
+
+
+class MultipartStream(MessageStream):
+    """Message with attached files. Message structure and text parts are kept in memory, but attached files
+    are read and base64 encoded in chunks, straight into the output, when the message is sent. Encoded content
+    of files up to MAX_CACHED_FILE_SIZE is cached, so it's reused when the same file is sent many times.
+    The same way GeneratedContent of text parts is produced while message is sent.
+
+    Content of every attachment is represented in the message by unique placeholder. Message can be given
+    also as already encoded bytes (with CRLF line endings), ie. rendered from compiled message."""
+    __slots__ = ('message', 'attachments', '_downgraded')
+
+    def __init__(self, message: Union[Message, bytes], attachments: Dict[str, Union[str, GeneratedContent]]) -> NoReturn:
+        self.message = message
+        self.attachments = attachments
+        # set by `freeze`
+        self._downgraded: Optional[MultipartStream] = None
+
+    @property
+    def streamed(self) -> bool:
+        return bool(self.attachments)
+
+    @property
+    def size(self) -> Optional[int]:
+        if any(isinstance(content, GeneratedContent) for content in self.attachments.values()):
+            return None
+
+        size = len(self._skeleton())
+        for placeholder, path in self.attachments.items():
+            encoded = (os.stat(path).st_size + 2) // 3 * 4
+            size += encoded + max(encoded - 1, 0) // 76 * 2 - len(placeholder)
+        return size
+
+    def chunks(self) -> Iterator[bytes]:
+        data = self._skeleton()
+        if not self.attachments:
+            yield data
+            return
+
+        pattern = re.compile(b'|'.join(re.escape(placeholder.encode('ascii')) for placeholder in self.attachments))
+        position = 0
+        for match in pattern.finditer(data):
+            yield data[position:match.start()]
+            content = self.attachments[match.group().decode('ascii')]
+            if isinstance(content, GeneratedContent):
+                yield from content.encoded_chunks()
+            else:
+                yield from self._encode_file(content)
+            position = match.end()
+        yield data[position:]
+
+    def has_8bit(self) -> bool:
+        if isinstance(self.message, bytes):
+            return not self.message.isascii()
+        return has_8bit(self.message)
+
+    def downgrade_8bit(self) -> 'MultipartStream':
+        if self._downgraded is not None:
+            return self._downgraded
+
+        message = self.message
+        if isinstance(message, bytes):
+            message = email.message_from_bytes(message)
+        return MultipartStream(downgrade_8bit(message), self.attachments)
+
+    def _skeleton(self) -> bytes:
+        if isinstance(self.message, bytes):
+            return self.message
+        return self.message.as_bytes(policy=self.message.policy.clone(linesep='\r\n'))
+
+    @staticmethod
+    def _encode_file(path: str) -> Iterator[bytes]:
+        stat = os.stat(path)
+        if stat.st_size <= MAX_CACHED_FILE_SIZE:
+            yield from split_chunks(_encoded_file(path, stat))
+            return
+
+        with open(path, 'rb') as fh:
+            yield from _encode_base64_chunks(read_chunks(fh, _BASE64_CHUNK_SIZE))
+
+    def __str__(self) -> str:
+        return f'<MultipartStream attachments={list(self.attachments.values())}>'
+
+    __repr__ = __str__
+
+
+def freeze(message: Union[Message, MultipartStream]) -> MultipartStream:
+    """Message encoded once (and downgraded once, if it has 8bit parts), to be sent many times, also by many
+    threads at once. Message objects are not safe to encode in parallel: boundaries of multipart messages
+    are set while they are generated."""
+    stream = message if isinstance(message, MultipartStream) else MultipartStream(message, {})
+    frozen = MultipartStream(stream._skeleton(), stream.attachments)
+    if frozen.has_8bit():
+        downgraded = stream.downgrade_8bit()
+        frozen._downgraded = MultipartStream(downgraded._skeleton(), downgraded.attachments)
+    return frozen
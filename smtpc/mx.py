@@ -0,0 +1,129 @@
+__all__ = ['AbstractMXResolver', 'DnsMXResolver', 'StaticMXResolver', 'MXCache', 'default_resolver',
+    'domain_of', 'group_by_domain']
+
+import email.utils
+import threading
+import time
+from typing import Dict, List, NoReturn, Optional, Tuple
+
+import structlog
+
+try:
+    import dns.exception
+    import dns.resolver
+except ImportError:
+    dns = None
+
+from .errors import MXLookupError
+
+logger = structlog.get_logger()
+
+
+def domain_of(address: str) -> str:
+    _, address = email.utils.parseaddr(address)
+    return address.rpartition('@')[2].lower()
+
+
+def group_by_domain(addresses: List[str]) -> Dict[str, List[str]]:
+    """Group addresses by domain, keeping the order of first occurrence."""
+    groups = {}
+    for address in addresses:
+        groups.setdefault(domain_of(address), []).append(address)
+    return groups
+
+
+class AbstractMXResolver:
+    """Resolve domain to list of mail exchangers, ordered by preference."""
+
+    def lookup(self, domain: str) -> Tuple[List[str], float]:
+        """Return list of MX hosts for domain, and TTL (in seconds) of the answer."""
+        raise NotImplementedError
+
+
+class DnsMXResolver(AbstractMXResolver):
+    __slots__ = ('resolver', 'timeout')
+
+    def __init__(self, resolver: Optional['dns.resolver.Resolver'] = None, timeout: float = 10.0) -> NoReturn:
+        if not dns:
+            raise MXLookupError('No MX lookup support found. Do you have "dnspython" module installed?')
+        self.resolver = resolver or dns.resolver.Resolver()
+        self.timeout = timeout
+
+    def lookup(self, domain: str) -> Tuple[List[str], float]:
+        try:
+            answer = self.resolver.resolve(domain, 'MX', lifetime=self.timeout)
+        except dns.resolver.NXDOMAIN:
+            raise MXLookupError(f'Domain {domain} does not exist')
+        except dns.resolver.NoAnswer:
+            # RFC 5321 5.1: no MX records, domain itself is the implicit MX
+            return [domain], 300.0
+        except dns.exception.DNSException as exc:
+            raise MXLookupError(f'Cannot lookup MX records for {domain}: {exc}')
+
+        records = sorted(answer, key=lambda record: record.preference)
+        hosts = [record.exchange.to_text(omit_final_dot=True) for record in records]
+        # RFC 7505: null MX, domain doesn't accept emails
+        if hosts in ([''], ['.']):
+            raise MXLookupError(f'Domain {domain} does not accept emails (null MX)')
+        return hosts, float(answer.rrset.ttl)
+
+
+class StaticMXResolver(AbstractMXResolver):
+    """Resolver with fixed answers, for tests or local stand-ins of real MX hosts.
+
+    Domains not found in mapping are resolved to `default` hosts, or to the domain itself if there is no default."""
+    __slots__ = ('mapping', 'default', 'ttl')
+
+    def __init__(self, mapping: Dict[str, List[str]], default: Optional[List[str]] = None, ttl: float = 300.0) -> NoReturn:
+        self.mapping = {domain.lower(): hosts for domain, hosts in mapping.items()}
+        self.default = default
+        self.ttl = ttl
+
+    def lookup(self, domain: str) -> Tuple[List[str], float]:
+        return list(self.mapping.get(domain, self.default or [domain])), self.ttl
+
+
+class MXCache:
+    """Thread safe, TTL respecting cache in front of MX resolver.
+
+    TTL of answers is clamped to <min_ttl, max_ttl>, failed lookups are not cached."""
+
+    def __init__(self, resolver: AbstractMXResolver, *, min_ttl: float = 60.0, max_ttl: float = 3600.0) -> NoReturn:
+        self.resolver = resolver
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Tuple[float, List[str]]] = {}
+
+    def resolve(self, domain: str) -> List[str]:
+        domain = domain.lower()
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(domain)
+        if cached and cached[0] > now:
+            return cached[1]
+
+        hosts, ttl = self.resolver.lookup(domain)
+        ttl = min(max(ttl, self.min_ttl), self.max_ttl)
+        logger.debug('mx lookup', domain=domain, hosts=hosts, ttl=ttl)
+        with self._lock:
+            self._cache[domain] = (now + ttl, hosts)
+        return hosts
+
+    def clear(self) -> NoReturn:
+        with self._lock:
+            self._cache.clear()
+
+
+_default_resolver = None
+_default_resolver_lock = threading.Lock()
+
+
+def default_resolver() -> MXCache:
+    """Shared, cached resolver using system DNS configuration."""
+    global _default_resolver
+    with _default_resolver_lock:
+        if _default_resolver is None:
+            _default_resolver = MXCache(DnsMXResolver())
+        return _default_resolver
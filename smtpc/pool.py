@@ -0,0 +1,164 @@
+__all__ = ['ConnectionPool', 'PooledConnection', 'PoolKey']
+
+import smtplib
+import threading
+import time
+from typing import Callable, Dict, List, NoReturn, Optional, Tuple
+
+import structlog
+
+from .errors import PoolTimeoutError
+
+logger = structlog.get_logger()
+
+# (host, port, ssl, tls, login, source_address, identify_as)
+PoolKey = Tuple[str, int, bool, bool, Optional[str], Optional[str], Optional[str]]
+
+
+class PooledConnection:
+    __slots__ = ('key', 'smtp', 'created_at', 'last_used_at', 'messages_sent')
+
+    def __init__(self, key: PoolKey, smtp: smtplib.SMTP) -> NoReturn:
+        self.key = key
+        self.smtp = smtp
+        self.created_at = self.last_used_at = time.monotonic()
+        self.messages_sent = 0
+
+    def mark_used(self) -> NoReturn:
+        self.messages_sent += 1
+        self.last_used_at = time.monotonic()
+
+    def __str__(self) -> str:
+        return f'<PooledConnection host={self.key[0]}:{self.key[1]}, messages_sent={self.messages_sent}>'
+
+    __repr__ = __str__
+
+
+class ConnectionPool:
+    """Pool of ready to use (connected, greeted and authenticated) SMTP sessions.
+
+    Sessions are grouped by PoolKey, every key can have at most `max_size` sessions at once.
+    Idle sessions are closed after `idle_timeout` seconds, and every session is recycled after
+    sending `max_messages` messages. Reused sessions are checked with NOOP command before
+    they are returned by `checkout` (if `probe` is enabled).
+    """
+
+    def __init__(self, *,
+        max_size: int = 1,
+        idle_timeout: Optional[float] = 60.0,
+        max_messages: Optional[int] = None,
+        probe: bool = True,
+    ) -> NoReturn:
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self.probe = probe
+
+        self._cond = threading.Condition()
+        self._idle: Dict[PoolKey, List[PooledConnection]] = {}
+        self._in_use: Dict[PoolKey, int] = {}
+        self._closed = False
+
+    def checkout(self, key: PoolKey, factory: Callable[[], smtplib.SMTP], timeout: Optional[float] = None) -> PooledConnection:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            conn, expired = self._reserve(key, deadline)
+            for item in expired:
+                self._close(item)
+
+            if conn is None:
+                try:
+                    return PooledConnection(key, factory())
+                except BaseException:
+                    self._unreserve(key)
+                    raise
+
+            if not self.probe or self._is_alive(conn):
+                return conn
+
+            logger.debug('pooled connection is dead, dropping', connection=conn)
+            self._close(conn)
+            self._unreserve(key)
+
+    def checkin(self, conn: PooledConnection, discard: bool = False) -> NoReturn:
+        with self._cond:
+            self._in_use[conn.key] -= 1
+            if not discard and not self._closed and not self.is_exhausted(conn):
+                conn.last_used_at = time.monotonic()
+                self._idle.setdefault(conn.key, []).append(conn)
+                conn = None
+            self._cond.notify_all()
+
+        if conn is not None:
+            self._close(conn)
+
+    def is_exhausted(self, conn: PooledConnection) -> bool:
+        return bool(self.max_messages) and conn.messages_sent >= self.max_messages
+
+    def close(self) -> NoReturn:
+        with self._cond:
+            self._closed = True
+            idle = [conn for conns in self._idle.values() for conn in conns]
+            self._idle.clear()
+            self._cond.notify_all()
+
+        for conn in idle:
+            self._close(conn)
+
+    def __enter__(self) -> 'ConnectionPool':
+        return self
+
+    def __exit__(self, *exc_info) -> NoReturn:
+        self.close()
+
+    def _reserve(self, key: PoolKey, deadline: Optional[float]) -> Tuple[Optional[PooledConnection], List[PooledConnection]]:
+        """Reserve slot for key, returns idle connection to reuse (or None if new one should be created)
+        and list of expired connections to close."""
+        with self._cond:
+            while True:
+                expired = self._evict_expired()
+                idle = self._idle.get(key)
+                if idle:
+                    self._in_use[key] = self._in_use.get(key, 0) + 1
+                    return idle.pop(), expired
+
+                if self._in_use.get(key, 0) < self.max_size:
+                    self._in_use[key] = self._in_use.get(key, 0) + 1
+                    return None, expired
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise PoolTimeoutError(f'No free connection in pool for {key[0]}:{key[1]}')
+                self._cond.wait(remaining)
+
+    def _unreserve(self, key: PoolKey) -> NoReturn:
+        with self._cond:
+            self._in_use[key] -= 1
+            self._cond.notify_all()
+
+    def _evict_expired(self) -> List[PooledConnection]:
+        if self.idle_timeout is None:
+            return []
+
+        now = time.monotonic()
+        expired = []
+        for key, conns in self._idle.items():
+            alive = [conn for conn in conns if now - conn.last_used_at < self.idle_timeout]
+            if len(alive) != len(conns):
+                expired.extend(conn for conn in conns if conn not in alive)
+                self._idle[key] = alive
+        return expired
+
+    def _is_alive(self, conn: PooledConnection) -> bool:
+        try:
+            code, _ = conn.smtp.noop()
+        except (smtplib.SMTPException, OSError):
+            return False
+        return code == 250
+
+    def _close(self, conn: PooledConnection) -> NoReturn:
+        try:
+            conn.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            conn.smtp.close()
+        logger.debug('disconnected from remote server', host=conn.key[0], port=conn.key[1], messages_sent=conn.messages_sent)
@@ -2,8 +2,6 @@ import copy
 import enum
 from typing import Optional, List, NoReturn
 
-import toml
-
 from . import config
 from .enums import ContentType
 
@@ -11,7 +9,7 @@ from .enums import ContentType
 class PredefinedMessage:
     __slots__ = (
         'name', 'envelope_from', 'address_from', 'envelope_to', 'address_to', 'address_cc', 'address_bcc', 'reply_to',
-        'subject', 'body', 'body_html', 'raw_body', 'body_type', 'headers', 'profile',
+        'subject', 'body', 'body_html', 'raw_body', 'body_type', 'headers', 'profile', 'attachments',
     )
 
     def __init__(self,
@@ -30,6 +28,7 @@ class PredefinedMessage:
         body_type: Optional[ContentType] = None,
         headers: Optional[List[str]] = None,
         profile: Optional[str] = None,
+        attachments: Optional[List[str]] = None,
     ) -> NoReturn:
         self.name = name
         self.envelope_from = envelope_from
@@ -46,6 +45,7 @@ class PredefinedMessage:
         self.body_type = body_type
         self.headers = headers
         self.profile = profile
+        self.attachments = attachments
 
     def to_dict(self) -> dict:
         keys = list(copy.copy(self.__slots__))
@@ -72,8 +72,7 @@ class PredefinedMessage:
 class PredefinedMessages(dict):
     @classmethod
     def read(cls) -> 'PredefinedMessages':
-        with config.PREDEFINED_MESSAGES_FILE.open('r') as fh:
-            data = toml.load(fh)
+        data = config.load_toml_file(config.PREDEFINED_MESSAGES_FILE)
 
         m = cls()
         if 'messages' not in data:
@@ -108,6 +107,7 @@ class PredefinedMessages(dict):
                 body_type=ContentType(message['body_type']) if 'body_type' in message else None,
                 headers=message.get('headers'),
                 profile=message.get('profile'),
+                attachments=message.get('attachments'),
             )
 
         if rewrite_messages:
@@ -2,8 +2,6 @@ import copy
 import enum
 from typing import Optional, NoReturn
 
-import toml
-
 from . import config
 from . import enums
 
@@ -12,7 +10,8 @@ class PredefinedProfile:
     __slots__ = (
         'name', 'login', 'password', 'auth_method',
         'host', 'port', 'ssl', 'tls',
-        'connection_timeout', 'identify_as', 'source_address',
+        'connection_timeout', 'identify_as', 'source_address', 'delivery',
+        'rate_limit', 'rate_limit_burst', 'rate_limit_daily',
     )
 
     def __init__(self,
@@ -27,6 +26,10 @@ class PredefinedProfile:
         connection_timeout: Optional[int] = None,
         identify_as: Optional[str] = None,
         source_address: Optional[str] = None,
+        delivery: Optional[enums.DeliveryMode] = None,
+        rate_limit: Optional[float] = None,
+        rate_limit_burst: Optional[int] = None,
+        rate_limit_daily: Optional[int] = None,
     ) -> NoReturn:
         self.name = name
         self.login = login
@@ -39,6 +42,10 @@ class PredefinedProfile:
         self.connection_timeout = connection_timeout
         self.identify_as = identify_as
         self.source_address = source_address
+        self.delivery = delivery
+        self.rate_limit = rate_limit
+        self.rate_limit_burst = rate_limit_burst
+        self.rate_limit_daily = rate_limit_daily
 
     def to_dict(self) -> dict:
         keys = list(copy.copy(self.__slots__))
@@ -62,8 +69,7 @@ class PredefinedProfile:
 class PredefinedProfiles(dict):
     @classmethod
     def read(cls) -> 'PredefinedProfiles':
-        with config.PREDEFINED_PROFILES_FILE.open('r') as fh:
-            data = toml.load(fh)
+        data = config.load_toml_file(config.PREDEFINED_PROFILES_FILE)
 
         p = cls()
         if 'profiles' not in data:
@@ -82,6 +88,10 @@ class PredefinedProfiles(dict):
                 connection_timeout=profile.get('connection_timeout'),
                 identify_as=profile.get('identify_as'),
                 source_address=profile.get('source_address'),
+                delivery=enums.DeliveryMode(profile['delivery']) if 'delivery' in profile else None,
+                rate_limit=profile.get('rate_limit'),
+                rate_limit_burst=profile.get('rate_limit_burst'),
+                rate_limit_daily=profile.get('rate_limit_daily'),
             )
 
         return p
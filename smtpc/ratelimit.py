@@ -0,0 +1,117 @@
+__all__ = ['RateLimiter']
+
+import datetime
+import fcntl
+import json
+import os
+import pathlib
+import time
+from typing import NoReturn, Optional, TextIO
+
+import fileperms
+import structlog
+
+from .errors import RateLimitError
+
+logger = structlog.get_logger()
+
+
+class RateLimiter:
+    """Token bucket shared by all processes (and threads) using the same state file.
+
+    Bucket is refilled with `rate` tokens per second, up to `burst` tokens, every message takes one token.
+    Additionally no more than `daily_quota` messages can be sent during single (local) day. State is kept
+    in JSON file, guarded by exclusive lock on that file."""
+    __slots__ = ('path', 'rate', 'burst', 'daily_quota')
+
+    def __init__(self, path: pathlib.Path, *,
+        rate: Optional[float] = None,
+        burst: Optional[int] = None,
+        daily_quota: Optional[int] = None,
+    ) -> NoReturn:
+        self.path = path
+        self.rate = rate
+        self.burst = max(burst or 1, 1)
+        self.daily_quota = daily_quota
+
+    def acquire(self) -> float:
+        """Take one token, waiting for it if needed. Returns number of seconds spent on waiting.
+
+        Raises RateLimitError if daily quota is exhausted."""
+        waited = 0.0
+        while True:
+            wait = self._try_acquire()
+            if not wait:
+                if waited:
+                    logger.debug('rate limited', path=str(self.path), waited=round(waited, 3))
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def _try_acquire(self) -> float:
+        """Take one token if available and return 0, or return time to wait for the next one."""
+        self._ensure_dir()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with os.fdopen(fd, 'r+') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                state = self._load(fh)
+                now = time.time()
+                today = datetime.date.fromtimestamp(now).isoformat()
+
+                if state['day'] != today:
+                    state['day'], state['sent'] = today, 0
+                if self.daily_quota and state['sent'] >= self.daily_quota:
+                    raise RateLimitError(f'Daily quota of {self.daily_quota} messages exhausted')
+
+                wait = 0.0
+                if self.rate:
+                    elapsed = max(now - state['updated_at'], 0)
+                    state['tokens'] = min(self.burst, state['tokens'] + elapsed * self.rate)
+                    state['updated_at'] = now
+                    if state['tokens'] < 1:
+                        wait = (1 - state['tokens']) / self.rate
+                    else:
+                        state['tokens'] -= 1
+
+                if not wait:
+                    state['sent'] += 1
+                self._save(fh, state)
+                return wait
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _load(self, fh: TextIO) -> dict:
+        fh.seek(0)
+        try:
+            state = json.loads(fh.read() or '{}')
+        except json.decoder.JSONDecodeError:
+            logger.warning('invalid rate limiter state, resetting', path=str(self.path))
+            state = {}
+
+        state.setdefault('tokens', float(self.burst))
+        state.setdefault('updated_at', time.time())
+        state.setdefault('day', None)
+        state.setdefault('sent', 0)
+        return state
+
+    def _save(self, fh: TextIO, state: dict) -> NoReturn:
+        fh.seek(0)
+        fh.truncate()
+        json.dump(state, fh)
+        fh.flush()
+
+    def _ensure_dir(self) -> NoReturn:
+        if self.path.parent.exists():
+            return
+
+        dir_perms = fileperms.Permissions()
+        dir_perms.owner_read = True
+        dir_perms.owner_write = True
+        dir_perms.owner_exec = True
+        self.path.parent.mkdir(mode=int(dir_perms), parents=True, exist_ok=True)
+
+    def __str__(self) -> str:
+        return f'<RateLimiter rate={self.rate}, burst={self.burst}, daily_quota={self.daily_quota}>'
+
+    __repr__ = __str__
@@ -0,0 +1,311 @@
+__all__ = ['SendService', 'SendServer', 'MESSAGE_FIELDS', 'send_request', 'handle_stream']
+
+import json
+import os
+import pathlib
+import socket
+import socketserver
+import threading
+from typing import Callable, Dict, Iterable, NoReturn, Optional, Tuple, Union
+
+import structlog
+
+from . import config
+from .enums import ContentType
+from .errors import SMTPcError, InvalidPasswordKeyError
+from .message import Builder, Sender
+from .pool import ConnectionPool
+from .predefined_messages import PredefinedMessages, PredefinedMessage
+from .predefined_profiles import PredefinedProfiles, PredefinedProfile
+
+try:
+    from . import encryption
+except ImportError:
+    encryption = None
+
+logger = structlog.get_logger()
+
+# fields of send request passed to message.Builder, named after `smtpc send` arguments
+MESSAGE_FIELDS = (
+    'subject', 'envelope_from', 'address_from', 'envelope_to', 'address_to', 'address_cc', 'address_bcc', 'reply_to',
+    'body_type', 'body_html', 'body', 'raw_body', 'headers', 'template_fields', 'template_fields_json', 'attachments',
+)
+
+
+class SendService:
+    """Keeps everything needed for sending messages warm between requests: parsed profiles and messages
+    (reloaded when config files are modified), decrypted passwords and pool of SMTP sessions.
+
+    Request is a dict with optional keys: `profile`, `message` (names of predefined profile and message),
+    `context` (dict of template fields) and any of MESSAGE_FIELDS. In JSON requests also `id` can be given,
+    it's copied to the response.
+
+    `password_key` can be given as a callable too, it's called (once) only when an encrypted password is used."""
+
+    def __init__(self, *,
+        pool: ConnectionPool,
+        password_key: Optional[Union[str, Callable[[], str]]] = None,
+        reconnect_attempts: int = 1,
+    ) -> NoReturn:
+        self.pool = pool
+        self.password_key = password_key
+        self.reconnect_attempts = reconnect_attempts
+
+        self._lock = threading.Lock()
+        self._profiles: PredefinedProfiles = PredefinedProfiles()
+        self._messages: PredefinedMessages = PredefinedMessages()
+        self._mtimes: Tuple[Optional[int], Optional[int]] = (None, None)
+        self._passwords: Dict[str, str] = {}
+
+    def handle(self, request: dict) -> dict:
+        try:
+            recipients, rejects = self.send(request)
+        except SMTPcError as exc:
+            logger.error('cannot send message', message=str(exc))
+            return {'ok': False, 'error': str(exc)}
+        except Exception as exc:
+            logger.exception('cannot send message', message=str(exc))
+            return {'ok': False, 'error': f'{exc.__class__.__name__}: {exc}'}
+
+        return {'ok': True, 'recipients': recipients, 'rejects': {k: [v[0], _decode(v[1])] for k, v in rejects.items()}}
+
+    def handle_line(self, line: str, defaults: Optional[dict] = None) -> dict:
+        """Handle request encoded as JSON object. Missing fields are taken from `defaults`."""
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('request must be a JSON object')
+        except ValueError as exc:
+            return {'ok': False, 'error': f'Invalid request: {exc}'}
+
+        request_id = request.pop('id', None)
+        response = self.handle({**(defaults or {}), **request})
+        if request_id is not None:
+            response['id'] = request_id
+        return response
+
+    def send(self, request: dict) -> Tuple[list, dict]:
+        unknown = set(request) - set(MESSAGE_FIELDS) - {'profile', 'message', 'context'}
+        if unknown:
+            raise SMTPcError(f'Unknown fields in request: {", ".join(sorted(unknown))}')
+
+        profile, predefined_message = self._get_profile_and_message(request.get('profile'), request.get('message'))
+        fields = {name: request.get(name) for name in MESSAGE_FIELDS}
+        if fields['body_type']:
+            fields['body_type'] = ContentType(fields['body_type'])
+
+        builder = Builder(predefined_message=predefined_message, predefined_profile=profile,
+            template_context=request.get('context'), **fields)
+        if not predefined_message and fields['raw_body']:
+            message_body = fields['body']
+        else:
+            message_body = builder.execute()
+        envelope_from, envelope_to = builder.envelope()
+        if not envelope_from or not envelope_to:
+            raise SMTPcError('Any sender and receiver required')
+
+        sender = self._create_sender(profile)
+        result, = sender.execute_many([(message_body, envelope_from, envelope_to)],
+            reconnect_attempts=self.reconnect_attempts)
+        if not result.ok:
+            raise SMTPcError(str(result.error))
+        return result.recipients, result.rejects
+
+    def reload(self) -> NoReturn:
+        """Read profiles and messages again if config files were modified."""
+        mtimes = (_mtime(config.PREDEFINED_PROFILES_FILE), _mtime(config.PREDEFINED_MESSAGES_FILE))
+        with self._lock:
+            if mtimes == self._mtimes:
+                return
+
+            if mtimes[0] != self._mtimes[0]:
+                self._profiles = PredefinedProfiles.read()
+                logger.info('profiles loaded', profiles=len(self._profiles))
+            if mtimes[1] != self._mtimes[1]:
+                self._messages = PredefinedMessages.read()
+                logger.info('messages loaded', messages=len(self._messages))
+            self._mtimes = mtimes
+
+    def _get_profile_and_message(self, profile_name: Optional[str],
+        message_name: Optional[str],
+    ) -> Tuple[Optional[PredefinedProfile], Optional[PredefinedMessage]]:
+        self.reload()
+        with self._lock:
+            profiles, messages = self._profiles, self._messages
+
+        predefined_message = None
+        if message_name:
+            try:
+                predefined_message = messages[message_name]
+            except KeyError:
+                raise SMTPcError(f'Unknown message: {message_name}')
+            profile_name = profile_name or predefined_message.profile
+
+        profile = None
+        if profile_name:
+            try:
+                profile = profiles[profile_name]
+            except KeyError:
+                raise SMTPcError(f'Unknown profile: {profile_name}')
+
+        return profile, predefined_message
+
+    def _create_sender(self, profile: Optional[PredefinedProfile]) -> Sender:
+        return Sender(
+            predefined_profile=profile,
+            predefined_message=None,
+            connection_timeout=None,
+            source_address=None,
+            debug_level=0,
+            host=None,
+            port=None,
+            identify_as=None,
+            tls=None,
+            no_tls=None,
+            ssl=None,
+            no_ssl=None,
+            login=None,
+            password=self._get_password(profile),
+            password_key=None,
+            envelope_from=None,
+            address_from=None,
+            envelope_to=None,
+            address_to=None,
+            address_cc=None,
+            address_bcc=None,
+            reply_to=None,
+            message_body=None,
+            dry_run=False,
+            disable_ehlo=None,
+            auth_method=None,
+            smtp_interactive=False,
+            pool=self.pool,
+        )
+
+    def _get_password(self, profile: Optional[PredefinedProfile]) -> Optional[str]:
+        """Return password of profile as `raw:` one, decrypting it (which is slow) only once."""
+        if not profile or not profile.password or not profile.password.startswith('enc:'):
+            return None
+
+        with self._lock:
+            if profile.password not in self._passwords:
+                if callable(self.password_key):
+                    self.password_key = self.password_key()
+                if not encryption or self.password_key is None:
+                    raise InvalidPasswordKeyError(f'Password for profile "{profile.name}" is encrypted, '
+                        'but no key for password decryption was given')
+                password = encryption.decrypt(profile.password, os.environ.get(config.ENV_SMTPC_SALT, ''), self.password_key)
+                self._passwords[profile.password] = f'raw:{password}'
+            return self._passwords[profile.password]
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> NoReturn:
+        for line in self.rfile:
+            if not line.strip():
+                continue
+
+            response = self.server.service.handle_line(line.decode('utf-8', 'replace'))
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class SendServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server accepting newline delimited JSON send requests, every one answered with JSON line."""
+    daemon_threads = True
+
+    def __init__(self, socket_path: pathlib.Path, service: SendService) -> NoReturn:
+        self.service = service
+        if socket_path.is_socket():
+            if _is_listening(socket_path):
+                raise SMTPcError(f'Another smtpc daemon is already listening on: {socket_path}')
+            # left by daemon which was killed
+            socket_path.unlink()
+
+        # socket is created with permissions for owner only
+        umask = os.umask(0o077)
+        try:
+            super().__init__(str(socket_path), _RequestHandler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self) -> NoReturn:
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def handle_stream(send_service: SendService, lines: Iterable[str], write: Callable[[dict], None], *,
+    concurrency: int = 1,
+    defaults: Optional[dict] = None,
+) -> int:
+    """Send messages from stream of JSON lines as they arrive, up to `concurrency` at once. Response for every
+    line (with its number in `line` key) is passed to `write` as soon as message is sent, so responses can be
+    in different order than requests. Reading next lines waits while `concurrency` messages are being sent.
+
+    Returns number of failed requests."""
+    slots = threading.BoundedSemaphore(concurrency)
+    lock = threading.Lock()
+    failed = 0
+
+    def _handle(line_no: int, line: str) -> NoReturn:
+        nonlocal failed
+        try:
+            response = send_service.handle_line(line, defaults)
+            response['line'] = line_no
+            with lock:
+                failed += not response['ok']
+                write(response)
+        finally:
+            slots.release()
+
+    threads = []
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+
+        slots.acquire()
+        thread = threading.Thread(target=_handle, args=(line_no, line), name=f'smtpc-stream-{line_no}', daemon=True)
+        thread.start()
+        threads.append(thread)
+        threads = [thread for thread in threads if thread.is_alive()]
+
+    for thread in threads:
+        thread.join()
+    return failed
+
+
+def send_request(socket_path: pathlib.Path, request: dict, timeout: Optional[float] = None) -> dict:
+    """Send single request to `smtpc serve` daemon and return its response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(str(socket_path))
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as fh:
+            line = fh.readline()
+
+    if not line:
+        raise SMTPcError('Connection closed by smtpc daemon')
+    return json.loads(line)
+
+
+def _is_listening(socket_path: pathlib.Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except OSError:
+            return False
+    return True
+
+
+def _mtime(path: pathlib.Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _decode(value: bytes) -> str:
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) else value
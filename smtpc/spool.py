@@ -0,0 +1,192 @@
+__all__ = ['Spool', 'SpoolEntry', 'retry_delay']
+
+import contextlib
+import fcntl
+import itertools
+import json
+import os
+import pathlib
+import socket
+import time
+from typing import Iterator, List, NoReturn, Optional
+
+import fileperms
+import structlog
+
+from .errors import SpoolError
+
+logger = structlog.get_logger()
+
+_counter = itertools.count()
+
+
+def retry_delay(attempts: int, base: float, maximum: float) -> float:
+    """Exponential backoff: base, 2*base, 4*base... but no more than maximum."""
+    return min(base * 2 ** max(attempts - 1, 0), maximum)
+
+
+class SpoolEntry:
+    """Single message in the spool: envelope, connection settings and message body.
+
+    On disk it's a file with JSON metadata in the first line, and message body in the rest."""
+    __slots__ = (
+        'path', 'envelope_from', 'envelope_to', 'connection',
+        'attempts', 'queued_at', 'next_attempt_at', 'last_error', 'message',
+    )
+
+    def __init__(self, path: Optional[pathlib.Path], *,
+        envelope_from: str,
+        envelope_to: List[str],
+        connection: dict,
+        message: str,
+        attempts: int = 0,
+        queued_at: Optional[float] = None,
+        next_attempt_at: float = 0,
+        last_error: Optional[str] = None,
+    ) -> NoReturn:
+        self.path = path
+        self.envelope_from = envelope_from
+        self.envelope_to = envelope_to
+        self.connection = connection
+        self.message = message
+        self.attempts = attempts
+        self.queued_at = queued_at or time.time()
+        self.next_attempt_at = next_attempt_at
+        self.last_error = last_error
+
+    @property
+    def id(self) -> str:
+        return self.path.name
+
+    @classmethod
+    def read_meta(cls, path: pathlib.Path) -> dict:
+        with path.open('r', encoding='utf-8') as fh:
+            return json.loads(fh.readline())
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> 'SpoolEntry':
+        with path.open('r', encoding='utf-8') as fh:
+            try:
+                meta = json.loads(fh.readline())
+            except json.decoder.JSONDecodeError as exc:
+                raise SpoolError(f'Invalid spool entry {path.name}: {exc}')
+            return cls(path, message=fh.read(), **meta)
+
+    def dump(self) -> str:
+        meta = {name: getattr(self, name) for name in self.__slots__ if name not in ('path', 'message')}
+        return json.dumps(meta) + '\n' + self.message
+
+    def __str__(self) -> str:
+        return f'<SpoolEntry id={self.path.name if self.path else None}, envelope_to={self.envelope_to}, attempts={self.attempts}>'
+
+    __repr__ = __str__
+
+
+class Spool:
+    """Maildir-like spool of messages waiting for delivery.
+
+    Entries are written to `tmp/` and atomically moved to `new/`. Drainer claims due entries by moving
+    them to `cur/`, and then removes them (delivered), moves back to `new/` (retry later) or moves
+    to `failed/` (permanent failure or too many attempts)."""
+
+    def __init__(self, path: pathlib.Path) -> NoReturn:
+        self.path = path
+        self.tmp = path / 'tmp'
+        self.new = path / 'new'
+        self.cur = path / 'cur'
+        self.failed = path / 'failed'
+
+    def ensure(self) -> NoReturn:
+        dir_perms = fileperms.Permissions()
+        dir_perms.owner_read = True
+        dir_perms.owner_write = True
+        dir_perms.owner_exec = True
+        for path in (self.path, self.tmp, self.new, self.cur, self.failed):
+            path.mkdir(mode=int(dir_perms), parents=True, exist_ok=True)
+
+    def add(self, entry: SpoolEntry) -> SpoolEntry:
+        self.ensure()
+        self._write(entry, self.new / self._unique_name())
+        logger.debug('message queued', entry=entry)
+        return entry
+
+    def split(self, entry: SpoolEntry, envelope_to: List[str]) -> SpoolEntry:
+        """Copy claimed entry for part of its recipients, copy is claimed too."""
+        copy = SpoolEntry(None, envelope_from=entry.envelope_from, envelope_to=envelope_to, connection=entry.connection,
+            message=entry.message, attempts=entry.attempts, queued_at=entry.queued_at)
+        self._write(copy, self.cur / self._unique_name())
+        return copy
+
+    @contextlib.contextmanager
+    def lock(self) -> Iterator[NoReturn]:
+        """Exclusive lock for draining the spool, raises SpoolError if spool is already locked."""
+        self.ensure()
+        with (self.path / '.lock').open('w') as fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise SpoolError(f'Spool {self.path} is already processed by another process')
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def recover(self) -> NoReturn:
+        """Move entries claimed by crashed drainer back to `new/`. Call only with lock held."""
+        for path in self.cur.iterdir():
+            logger.warning('recovering unfinished spool entry', entry=path.name)
+            path.rename(self.new / path.name)
+
+    def claim(self, now: Optional[float] = None) -> Iterator[SpoolEntry]:
+        """Claim entries due for delivery, oldest first."""
+        now = time.time() if now is None else now
+        for path in sorted(self.new.iterdir()):
+            try:
+                if SpoolEntry.read_meta(path)['next_attempt_at'] > now:
+                    continue
+                path.rename(self.cur / path.name)
+            except FileNotFoundError:
+                continue
+            except (ValueError, KeyError) as exc:
+                logger.error('invalid spool entry', entry=path.name, message=str(exc))
+                path.rename(self.failed / path.name)
+                continue
+
+            yield SpoolEntry.load(self.cur / path.name)
+
+    def done(self, entry: SpoolEntry) -> NoReturn:
+        entry.path.unlink()
+        logger.debug('spool entry delivered', entry=entry)
+
+    def retry(self, entry: SpoolEntry, envelope_to: List[str], error: str, delay: float) -> NoReturn:
+        entry.envelope_to = envelope_to
+        entry.attempts += 1
+        entry.last_error = error
+        entry.next_attempt_at = time.time() + delay
+        self._write(entry, self.new / entry.path.name, entry.path)
+        logger.debug('spool entry deferred', entry=entry, delay=delay)
+
+    def fail(self, entry: SpoolEntry, envelope_to: List[str], error: str) -> NoReturn:
+        entry.envelope_to = envelope_to
+        entry.attempts += 1
+        entry.last_error = error
+        self._write(entry, self.failed / entry.path.name, entry.path)
+        logger.debug('spool entry failed', entry=entry)
+
+    def _unique_name(self) -> str:
+        return f'{time.time_ns()}.P{os.getpid()}Q{next(_counter)}.{socket.gethostname()}'
+
+    def _write(self, entry: SpoolEntry, target: pathlib.Path, previous: Optional[pathlib.Path] = None) -> NoReturn:
+        tmp_path = self.tmp / target.name
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+            fh.write(entry.dump())
+            fh.flush()
+            os.fsync(fh.fileno())
+        tmp_path.rename(target)
+        if previous is not None and previous != target:
+            previous.unlink()
+        entry.path = target
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.new.iterdir()) if self.new.exists() else 0
@@ -0,0 +1,141 @@
+__all__ = ['MessageStream', 'FileMessageStream', 'encode_data', 'normalize_line_endings', 'split_chunks', 'read_chunks',
+    'DEFAULT_CHUNK_SIZE']
+
+import re
+import sys
+from typing import BinaryIO, Iterable, Iterator, NoReturn, Optional
+
+from .errors import SMTPcError
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+CRLF = b'\r\n'
+
+_RE_LINE_ENDINGS = re.compile(rb'\r\n|\r|\n')
+_RE_LEADING_DOTS = re.compile(rb'(?<=\n)\.')
+
+
+def normalize_line_endings(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Convert line endings in stream of chunks to CRLF."""
+    pending_cr = False
+    for chunk in chunks:
+        if pending_cr:
+            chunk = b'\r' + chunk
+            pending_cr = False
+        # CR at the end of chunk can be the first half of CRLF, decide when next chunk is read
+        if chunk.endswith(b'\r'):
+            chunk = chunk[:-1]
+            pending_cr = True
+        if chunk:
+            yield _RE_LINE_ENDINGS.sub(CRLF, chunk)
+
+    if pending_cr:
+        yield CRLF
+
+
+def encode_data(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Encode message for DATA command on the fly, the same way as smtplib.SMTP.data does it on whole message:
+    line endings are normalized to CRLF, leading dots are doubled and the terminating <CRLF>.<CRLF> is appended.
+
+    Only single chunk is kept in memory, whatever size of the message is."""
+    at_line_start = True
+    last = b''
+    for chunk in normalize_line_endings(chunks):
+        chunk = _RE_LEADING_DOTS.sub(b'..', chunk)
+        if at_line_start and chunk.startswith(b'.'):
+            chunk = b'.' + chunk
+        at_line_start = chunk.endswith(b'\n')
+        last = chunk[-2:]
+        yield chunk
+
+    if last != CRLF:
+        yield CRLF
+    yield b'.' + CRLF
+
+
+def split_chunks(data: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    for idx in range(0, len(data), chunk_size):
+        yield data[idx:idx + chunk_size]
+
+
+def read_chunks(fh: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    while True:
+        chunk = fh.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+class MessageStream:
+    """Message sent in chunks as they are produced, instead of being built in memory as a whole."""
+    __slots__ = ()
+
+    @property
+    def size(self) -> Optional[int]:
+        """Size of the message (before dot stuffing), if known upfront."""
+        return None
+
+    @property
+    def streamed(self) -> bool:
+        """If message is produced while it's sent, False if whole message is already in memory."""
+        return True
+
+    def chunks(self) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    def has_8bit(self) -> bool:
+        """If message can contain 8bit data, True if it's unknown."""
+        return True
+
+    def downgrade_8bit(self) -> 'MessageStream':
+        """Message with 8bit parts encoded with 7bit transfer encoding, if it's possible."""
+        return self
+
+    def as_string(self) -> str:
+        return b''.join(self.chunks()).decode('utf-8', 'replace')
+
+
+class FileMessageStream(MessageStream):
+    """Raw message read in chunks from file ("-" for STDIN) when it's sent, instead of loading it into memory.
+
+    File is opened again for every transaction, but STDIN can be read only once."""
+    __slots__ = ('path', 'chunk_size', '_consumed')
+
+    def __init__(self, path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> NoReturn:
+        self.path = path
+        self.chunk_size = chunk_size
+        self._consumed = False
+
+    @property
+    def is_stdin(self) -> bool:
+        return self.path == '-'
+
+    @property
+    def size(self) -> Optional[int]:
+        """Size of the message with line endings converted to CRLF (as it's sent), so file is read once more
+        to count it."""
+        if self.is_stdin:
+            return None
+
+        size = 0
+        last = b''
+        for chunk in normalize_line_endings(self.chunks()):
+            size += len(chunk)
+            last = chunk
+        # CRLF appended by encode_data
+        return size if last.endswith(CRLF) else size + len(CRLF)
+
+    def chunks(self) -> Iterator[bytes]:
+        if self.is_stdin:
+            if self._consumed:
+                raise SMTPcError('Message from STDIN was already sent, cannot read it again')
+            self._consumed = True
+            yield from read_chunks(sys.stdin.buffer, self.chunk_size)
+            return
+
+        with open(self.path, 'rb') as fh:
+            yield from read_chunks(fh, self.chunk_size)
+
+    def __str__(self) -> str:
+        return f'<FileMessageStream path={self.path}, chunk_size={self.chunk_size}>'
+
+    __repr__ = __str__
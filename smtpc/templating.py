@@ -0,0 +1,183 @@
+__all__ = ['SimpleTemplate', 'Template', 'compile_template', 'get_environment', 'is_template', 'static_text', 'template_variables']
+
+import functools
+import hashlib
+import json
+import os
+import pathlib
+import re
+import threading
+from typing import Dict, FrozenSet, Iterator, List, NoReturn, Optional, Tuple, Union
+
+import fileperms
+import structlog
+
+from . import config
+
+logger = structlog.get_logger()
+_RE_PLACEHOLDER = re.compile(r'\{\{\s*([a-zA-Z0-9_]+)\s*\}\}')
+_RE_NEWLINE = re.compile(r'\r\n|\r|\n')
+
+
+class SimpleTemplate:
+    """Template engine used when Jinja is not available: substitutes "{{ name }}" placeholders with values of fields.
+    Placeholders of fields which were not given are left untouched.
+
+    Template is split into literal text and placeholders once, so rendering is single join, whatever number
+    of fields is."""
+    __slots__ = ('tpl', '_parts', '_placeholders')
+
+    def __init__(self, tpl: str) -> NoReturn:
+        self.tpl = tpl
+        # literal text and placeholders alternately, and positions of placeholders in _parts with field names
+        self._parts: List[str] = []
+        self._placeholders: List[Tuple[int, str]] = []
+
+        position = 0
+        for match in _RE_PLACEHOLDER.finditer(tpl):
+            self._parts.append(tpl[position:match.start()])
+            self._placeholders.append((len(self._parts), match.group(1)))
+            self._parts.append(match.group())
+            position = match.end()
+        self._parts.append(tpl[position:])
+
+    def render(self, **fields) -> str:
+        if not fields or not self._placeholders:
+            return self.tpl
+
+        parts = self._parts.copy()
+        for idx, name in self._placeholders:
+            if name in fields:
+                parts[idx] = str(fields[name])
+        return ''.join(parts)
+
+    def generate(self, **fields) -> Iterator[str]:
+        """Rendered template in pieces, like jinja2.Template.generate."""
+        yield self.render(**fields)
+
+    @property
+    def variables(self) -> FrozenSet[str]:
+        return frozenset(name for _, name in self._placeholders)
+
+    def __str__(self) -> str:
+        return f'<SimpleTemplate placeholders={len(self._placeholders)}>'
+
+    __repr__ = __str__
+
+
+try:
+    import jinja2
+    import jinja2.meta
+    from jinja2 import Template
+except ImportError:
+    jinja2 = None
+    Template = SimpleTemplate
+
+_environments: Dict[pathlib.Path, 'jinja2.Environment'] = {}
+_environments_lock = threading.Lock()
+
+
+def get_environment() -> Optional['jinja2.Environment']:
+    """Jinja environment shared by all templates, with bytecode cache in SMTPc config directory.
+    None if Jinja is not available."""
+    if jinja2 is None:
+        return None
+
+    cache_dir = config.TEMPLATES_CACHE_DIR
+    with _environments_lock:
+        env = _environments.get(cache_dir)
+        if env is None:
+            # templates are used for plain text bodies and headers too, so nothing is escaped (as with jinja2.Template)
+            env = _environments[cache_dir] = jinja2.Environment(bytecode_cache=_bytecode_cache(cache_dir),
+                autoescape=jinja2.select_autoescape(enabled_extensions=(), default_for_string=False))
+        return env
+
+
+def is_template(text: str) -> bool:
+    """False if text has no template syntax at all, so there is nothing to render."""
+    return '{' in text and ('{{' in text or '{%' in text or '{#' in text)
+
+
+def static_text(text: str) -> str:
+    """Text without template syntax (see `is_template`), as it would be rendered by template engine:
+    Jinja normalizes line endings and removes single trailing newline."""
+    if jinja2 is None:
+        return text
+
+    if '\r' in text:
+        text = _RE_NEWLINE.sub('\n', text)
+    return text[:-1] if text.endswith('\n') else text
+
+
+def _bytecode_cache(cache_dir: pathlib.Path) -> Optional['jinja2.BytecodeCache']:
+    dir_perms = fileperms.Permissions()
+    dir_perms.owner_read = True
+    dir_perms.owner_write = True
+    dir_perms.owner_exec = True
+    try:
+        cache_dir.mkdir(mode=int(dir_perms), parents=True, exist_ok=True)
+    except OSError as exc:
+        logger.debug('templates cache disabled', path=str(cache_dir), error=str(exc))
+        return None
+
+    return jinja2.FileSystemBytecodeCache(str(cache_dir))
+
+
+@functools.lru_cache(maxsize=128)
+def compile_template(source: str) -> Union['jinja2.Template', SimpleTemplate]:
+    """Template for given source, compiled once per process. Jinja templates compiled by any process are
+    kept in bytecode cache, under hash of their source, so compilation is skipped also in the next runs."""
+    env = get_environment()
+    if env is None:
+        return SimpleTemplate(source)
+    if env.bytecode_cache is None:
+        return env.from_string(source)
+
+    # the same what jinja2.BaseLoader.load does for templates from files
+    name = _source_hash(source)
+    bucket = env.bytecode_cache.get_bucket(env, name, None, source)
+    code = bucket.code
+    if code is None:
+        code = env.compile(source, name)
+        bucket.code = code
+        try:
+            env.bytecode_cache.set_bucket(bucket)
+        except OSError as exc:
+            logger.debug('cannot save compiled template', error=str(exc))
+
+    return env.template_class.from_code(env, code, env.make_globals(None), None)
+
+
+@functools.lru_cache(maxsize=128)
+def template_variables(source: str) -> FrozenSet[str]:
+    """Names of variables used by template with given source, so only these have to be put in its context.
+
+    Jinja template has to be parsed to find them, what takes as long as compiling it, so they are kept
+    next to the compiled template in bytecode cache."""
+    tpl = compile_template(source)
+    if isinstance(tpl, SimpleTemplate):
+        return tpl.variables
+
+    env = get_environment()
+    if env.bytecode_cache is None:
+        return frozenset(jinja2.meta.find_undeclared_variables(env.parse(source)))
+
+    path = pathlib.Path(env.bytecode_cache.directory) / f'{_source_hash(source)}.variables'
+    try:
+        return frozenset(json.loads(path.read_text('utf-8')))
+    except (OSError, ValueError):
+        pass
+
+    variables = frozenset(jinja2.meta.find_undeclared_variables(env.parse(source)))
+    # written at once, other processes never read partial file
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    try:
+        tmp_path.write_text(json.dumps(sorted(variables)), 'utf-8')
+        os.replace(tmp_path, path)
+    except OSError as exc:
+        logger.debug('cannot save template variables', error=str(exc))
+    return variables
+
+
+def _source_hash(source: str) -> str:
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
@@ -0,0 +1,102 @@
+__all__ = ['SessionCachingContext', 'get_context']
+
+import os
+import socket
+import ssl
+import sys
+import threading
+from typing import Dict, NoReturn, Optional
+
+import structlog
+
+logger = structlog.get_logger()
+
+
+class _SessionCachingSocket(ssl.SSLSocket):
+    """SSLSocket which remembers its TLS session in the context when closed.
+
+    With TLS 1.3 session tickets are sent by the server after the handshake, so the session
+    available just after `wrap_socket` is often not resumable yet."""
+
+    def close(self) -> NoReturn:
+        self.context.store_session(self.server_hostname, self)
+        super().close()
+
+    def unwrap(self) -> socket.socket:
+        self.context.store_session(self.server_hostname, self)
+        return super().unwrap()
+
+
+class SessionCachingContext(ssl.SSLContext):
+    """SSLContext which caches TLS sessions per server hostname, and resumes them in next connections.
+
+    Used as `context` for smtplib.SMTP_SSL and smtplib.SMTP.starttls, which just call `wrap_socket`."""
+    sslsocket_class = _SessionCachingSocket
+
+    def __init__(self, *args, **kwargs) -> NoReturn:
+        super().__init__()
+        self._sessions: Dict[str, ssl.SSLSession] = {}
+        self._sessions_lock = threading.Lock()
+
+    def wrap_socket(self, sock: socket.socket, server_side: bool = False, do_handshake_on_connect: bool = True,
+        suppress_ragged_eofs: bool = True, server_hostname: Optional[str] = None, session: Optional[ssl.SSLSession] = None,
+    ) -> ssl.SSLSocket:
+        if session is None and server_hostname:
+            with self._sessions_lock:
+                session = self._sessions.get(server_hostname)
+
+        try:
+            ssl_sock = super().wrap_socket(sock, server_side=server_side, do_handshake_on_connect=do_handshake_on_connect,
+                suppress_ragged_eofs=suppress_ragged_eofs, server_hostname=server_hostname, session=session)
+        except ssl.SSLError:
+            # cached session can be rejected (ie. server was restarted), don't reuse it anymore
+            if session is not None:
+                self.forget_session(server_hostname)
+            raise
+
+        if session is not None:
+            logger.debug('tls session resumption', host=server_hostname, reused=ssl_sock.session_reused)
+        self.store_session(server_hostname, ssl_sock)
+        return ssl_sock
+
+    def store_session(self, server_hostname: Optional[str], ssl_sock: ssl.SSLSocket) -> NoReturn:
+        if not server_hostname:
+            return
+
+        try:
+            session = ssl_sock.session
+        except (ValueError, OSError):
+            return
+        if session is None or not (session.has_ticket or session.id):
+            return
+
+        with self._sessions_lock:
+            self._sessions[server_hostname] = session
+
+    def forget_session(self, server_hostname: str) -> NoReturn:
+        with self._sessions_lock:
+            self._sessions.pop(server_hostname, None)
+
+
+def _create_context() -> SessionCachingContext:
+    # the same settings as ssl._create_stdlib_context, which is used by smtplib by default
+    context = SessionCachingContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+
+    keylogfile = os.environ.get('SSLKEYLOGFILE')
+    if keylogfile and not sys.flags.ignore_environment:
+        context.keylog_filename = keylogfile
+    return context
+
+
+_contexts: Dict[str, SessionCachingContext] = {}
+_contexts_lock = threading.Lock()
+
+
+def get_context(key: str) -> SessionCachingContext:
+    """Shared SSL context for given key (name of profile, or host:port if no profile is used)."""
+    with _contexts_lock:
+        if key not in _contexts:
+            _contexts[key] = _create_context()
+        return _contexts[key]
@@ -0,0 +1,17 @@
+import pytest
+
+from smtpc import config
+from .smtpserver import FakeSMTPServer
+
+
+@pytest.fixture
+def smtp_server():
+    server = FakeSMTPServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(autouse=True)
+def templates_cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'TEMPLATES_CACHE_DIR', tmp_path / 'templates')
+    return tmp_path / 'templates'
@@ -52,3 +52,4 @@ def prepare_smtp_mock(mocked_smtp):
     mocked_smtp.connect.return_value = ['250', b'OK, mocked']
     mocked_smtp.ehlo_resp = mocked_smtp.helo_resp = None
     mocked_smtp.ehlo.return_value = [250]
+    mocked_smtp.has_extn.return_value = False
@@ -257,3 +257,33 @@ def test_add_message_raw_body_error(smtpctmppath, capsys, params, expected_in_er
 
     assert r.code == ExitCodes.OTHER.value
     assert expected_in_err in r.err
+
+
+def test_add_message_attachments(smtpctmppath, capsys, monkeypatch):
+    (smtpctmppath / 'report.pdf').write_bytes(b'%PDF')
+    monkeypatch.chdir(smtpctmppath)
+    r = callsmtpc(['messages', 'add', 'simple1', '--from', 'smtpc@smtpc.net', '--to', 'receiver@smtpc.net',
+        '--attach', 'report.pdf'], capsys)
+
+    assert r.code == ExitCodes.OK.value, r
+    data = load_toml_file(smtpctmppath / config.PREDEFINED_MESSAGES_FILE.name)
+    assert data['messages']['simple1']['attachments'] == [str(smtpctmppath / 'report.pdf')]
+
+
+@pytest.mark.parametrize('params, expected_in_err',
+    [
+        [['--attach', 'missing.pdf'], 'No such file: missing.pdf'],
+        [['--body', 'raw', '--raw-body', '--attach', 'report.pdf'], 'Cannot use --attach together with --raw-body'],
+    ],
+    ids=[
+        'missing file',
+        'attachment with raw body',
+    ]
+)
+def test_add_message_attachments_error(smtpctmppath, capsys, monkeypatch, params, expected_in_err):
+    (smtpctmppath / 'report.pdf').write_bytes(b'%PDF')
+    monkeypatch.chdir(smtpctmppath)
+    r = callsmtpc(['messages', 'add', 'simple1', '--from', 'smtpc@smtpc.net', '--to', 'receiver@smtpc.net', *params], capsys)
+
+    assert r.code == ExitCodes.OTHER.value, r
+    assert expected_in_err in r.err
@@ -84,6 +84,14 @@ def test_add_profile_missing_login_password(smtpctmppath, capsys):
         ['--host', 'localhost', '--connection-timeout', '10', '--source-address', '1.1.1.1', '--identify-as', 'smtpc.net', '--auth-method', SMTPAuthMethod.PLAIN.value],
         {'host': 'localhost', 'connection_timeout': 10, 'source_address': '1.1.1.1', 'identify_as': 'smtpc.net', 'auth_method': SMTPAuthMethod.PLAIN.value}
     ],
+    [
+        ['--delivery', 'mx', '--identify-as', 'smtpc.net'],
+        {'delivery': 'mx', 'identify_as': 'smtpc.net'}
+    ],
+    [
+        ['--host', 'localhost', '--rate-limit', '0.5', '--rate-limit-burst', '10', '--rate-limit-daily', '1000'],
+        {'host': 'localhost', 'rate_limit': 0.5, 'rate_limit_burst': 10, 'rate_limit_daily': 1000}
+    ],
 ])
 def test_add_profile_valid(smtpctmppath, capsys, params, expected):
     r = callsmtpc(['profiles', 'add', 'simple1', *params], capsys)
@@ -95,6 +103,13 @@ def test_add_profile_valid(smtpctmppath, capsys, params, expected):
     assert profiles['simple1'] == expected
 
 
+@pytest.mark.parametrize('param', ['--rate-limit', '--rate-limit-burst', '--rate-limit-daily'])
+def test_add_profile_invalid_rate_limit(smtpctmppath, capsys, param):
+    r = callsmtpc(['profiles', 'add', 'simple1', '--host', 'localhost', param, '0'], capsys)
+    assert r.code == ExitCodes.OTHER.value
+    assert f'{param} must be greater than 0' in r.err
+
+
 def test_add_profile_interactive_password(smtpctmppath, capsys):
     with mock.patch('getpass.getpass', lambda: 'pass'):
         r = callsmtpc(['profiles', 'add', 'simple1', '--login', 'asd', '--password'], capsys)
@@ -0,0 +1,160 @@
+import email
+from unittest import mock
+
+import pytest
+
+from smtpc.enums import ExitCodes
+from smtpc.spool import Spool, SpoolEntry
+from . import *
+from ..smtpserver import FakeSMTPServer
+
+
+def _queue_add(capsys, *params):
+    r = callsmtpc(['queue', 'add', '--from', 'sender@smtpc.net', '--subject', 'Queued', '--body', 'some body',
+        '--host', 'smtp.smtpc.net', *params], capsys)
+    assert r.code == ExitCodes.OK.value, r
+    assert 'Message queued:' in r.out
+    return r
+
+
+def test_queue_add(smtpctmppath, capsys):
+    _queue_add(capsys, '--to', 'receiver@smtpc.net', '--port', '587')
+
+    spool = Spool(smtpctmppath / 'spool')
+    entry, = spool.claim()
+    assert entry.envelope_from == 'sender@smtpc.net'
+    assert entry.envelope_to == ['receiver@smtpc.net']
+    assert entry.connection['host'] == 'smtp.smtpc.net'
+    assert entry.connection['port'] == 587
+    assert entry.connection['profile'] is None
+    assert email.message_from_string(entry.message)['Subject'] == 'Queued'
+
+    r = callsmtpc(['queue', 'list'], capsys)
+    assert 'Queue is empty' in r.out
+
+
+def test_queue_add_rows(smtpctmppath, capsys):
+    rows_file = smtpctmppath / 'rows.csv'
+    rows_file.write_text('name,to\nJohn,john@smtpc.net\nJane,jane@smtpc.net\n')
+    r = _queue_add(capsys, '--rows', str(rows_file))
+    assert r.out.count('Message queued:') == 2
+
+    r = callsmtpc(['queue'], capsys)
+    assert 'to: "john@smtpc.net", attempts: 0' in r.out
+    assert 'to: "jane@smtpc.net", attempts: 0' in r.out
+
+
+def test_queue_run(smtpctmppath, capsys):
+    _queue_add(capsys, '--to', 'receiver1@smtpc.net')
+    _queue_add(capsys, '--to', 'receiver2@smtpc.net')
+
+    with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+        mocked_smtp = mocked_smtp_class.return_value
+        prepare_smtp_mock(mocked_smtp)
+        mocked_smtp.sendmail.return_value = {}
+
+        r = callsmtpc(['queue', 'run'], capsys)
+        assert r.code == ExitCodes.OK.value, r
+
+        mocked_smtp.connect.assert_called_once_with('smtp.smtpc.net', 25, source_address=None)
+        assert [call.args[1] for call in mocked_smtp.sendmail.call_args_list] == [['receiver1@smtpc.net'], ['receiver2@smtpc.net']]
+        assert 'Message sent to: receiver1@smtpc.net' in r.out
+
+    spool = Spool(smtpctmppath / 'spool')
+    assert len(spool) == 0
+    assert not list(spool.failed.iterdir())
+
+
+@pytest.mark.parametrize('params', [['--build-cache'], []], ids=['build cache', 'no build cache'])
+def test_queue_run_8bit_without_8bitmime(smtpctmppath, capsys, params):
+    server = FakeSMTPServer(extensions=('PIPELINING', )).start()
+    try:
+        for _ in range(2):
+            r = callsmtpc(['queue', 'add', '--from', 'sender@smtpc.net', '--to', 'receiver@smtpc.net', '--subject', 'Queued',
+                '--body', 'zażółć gęślą jaźń', '--host', server.host, '--port', str(server.port), *params], capsys)
+            assert r.code == ExitCodes.OK.value, r
+
+        r = callsmtpc(['queue', 'run'], capsys)
+        assert r.code == ExitCodes.OK.value, r
+    finally:
+        server.stop()
+
+    assert len(server.messages) == 2
+    for received in server.messages:
+        assert received.data.isascii()
+        assert email.message_from_bytes(received.data).get_payload(decode=True).decode('utf-8') == 'zażółć gęślą jaźń'
+    assert len(Spool(smtpctmppath / 'spool')) == 0
+
+
+def test_queue_run_retry(smtpctmppath, capsys):
+    _queue_add(capsys, '--to', 'receiver@smtpc.net', '--to', 'tempfail@smtpc.net', '--to', 'reject@smtpc.net')
+
+    with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+        mocked_smtp = mocked_smtp_class.return_value
+        prepare_smtp_mock(mocked_smtp)
+        mocked_smtp.sendmail.return_value = {'tempfail@smtpc.net': (451, b'try later'), 'reject@smtpc.net': (550, b'no such user')}
+
+        r = callsmtpc(['queue', 'run'], capsys)
+        assert r.code == ExitCodes.OTHER.value, r
+        assert 'Message sent to: receiver@smtpc.net' in r.out
+
+    spool = Spool(smtpctmppath / 'spool')
+    failed = SpoolEntry.load(next(spool.failed.iterdir()))
+    assert failed.envelope_to == ['reject@smtpc.net']
+
+    assert not list(spool.claim())
+    deferred, = spool.claim(now=2 ** 40)
+    assert deferred.envelope_to == ['tempfail@smtpc.net']
+
+
+def test_queue_run_connection_error(smtpctmppath, capsys):
+    _queue_add(capsys, '--to', 'receiver@smtpc.net')
+
+    with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+        mocked_smtp = mocked_smtp_class.return_value
+        prepare_smtp_mock(mocked_smtp)
+        mocked_smtp.connect.side_effect = ConnectionRefusedError(111, 'Connection refused')
+
+        r = callsmtpc(['queue', 'run', '--retry-delay', '30'], capsys)
+        assert r.code == ExitCodes.OK.value, r
+
+        r = callsmtpc(['queue', 'run', '--max-attempts', '2'], capsys)
+        assert r.code == ExitCodes.OK.value, r
+        mocked_smtp.connect.assert_called_once()
+
+    spool = Spool(smtpctmppath / 'spool')
+    entry, = spool.claim(now=2 ** 40)
+    assert entry.attempts == 1
+    spool.retry(entry, entry.envelope_to, entry.last_error, 0)
+
+    with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+        mocked_smtp = mocked_smtp_class.return_value
+        prepare_smtp_mock(mocked_smtp)
+        mocked_smtp.connect.side_effect = ConnectionRefusedError(111, 'Connection refused')
+
+        r = callsmtpc(['queue', 'run', '--max-attempts', '3'], capsys)
+        assert r.code == ExitCodes.OTHER.value, r
+
+    assert len(spool) == 0
+    assert len(list(spool.failed.iterdir())) == 1
+
+
+@pytest.mark.parametrize('params, expected_in_err',
+    [
+        [['queue', 'add', '--from', 'sender@smtpc.net'], 'Any receiver'],
+        [['queue', 'add', '--from', 'sender@smtpc.net', '--to', 'receiver@smtpc.net', '--smtp-interactive'], 'Cannot queue messages'],
+        [['queue', 'add', '--from', 'sender@smtpc.net', '--to', 'receiver@smtpc.net', '--login', 'login', '--password', 'secret'],
+            'Cannot queue messages with --login and --password'],
+        [['queue', 'run', '--max-attempts', '0'], '--max-attempts must be greater than 0'],
+    ],
+    ids=[
+        'add without receiver',
+        'add with smtp interactive',
+        'add with password',
+        'run with zero max attempts',
+    ]
+)
+def test_queue_invalid(smtpctmppath, capsys, params, expected_in_err):
+    r = callsmtpc(params, capsys)
+    assert r.code == ExitCodes.OTHER.value, r
+    assert expected_in_err in r.err
@@ -1,12 +1,16 @@
 import email
+import io
+import json
+import re
 from unittest import mock
 
 import pytest
 
 import smtpc
-from smtpc import config
+from smtpc import config, mx
 from smtpc.enums import ContentType, ExitCodes, SMTPAuthMethod
 from . import *
+from ..smtpserver import FakeSMTPServer
 
 
 def test_send_simple_valid(smtpctmppath, capsys):
@@ -924,3 +928,314 @@ def test_send_auth_method(smtpctmppath, capsys, profile_params, message_params,
 
         mocked_smtp.sendmail.assert_called()
         mocked_smtp.auth.assert_called_with(expected['auth_method'], getattr(mocked_smtp, f'auth_{expected["auth_method"]}'))
+
+
+def test_send_concurrency(smtpctmppath, capsys):
+    with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+        mocked_smtp = mocked_smtp_class.return_value
+        prepare_smtp_mock(mocked_smtp)
+        mocked_smtp.sendmail.return_value = {}
+
+        r = callsmtpc(['send', '--from', 'sender@smtpc.net', '--to', 'receiver1@smtpc.net', '--to', 'receiver2@smtpc.net',
+            '--cc', 'receiver3@smtpc.net', '--concurrency', '2'], capsys)
+        assert r.code == ExitCodes.OK.value, r
+
+        assert mocked_smtp.sendmail.call_count == 2
+        envelopes = sorted(call.args[1] for call in mocked_smtp.sendmail.call_args_list)
+        assert envelopes == [['receiver1@smtpc.net', 'receiver3@smtpc.net'], ['receiver2@smtpc.net']]
+        assert 'Message sent to: receiver1@smtpc.net, receiver3@smtpc.net, receiver2@smtpc.net' in r.out
+
+        received_message = email.message_from_string(mocked_smtp.sendmail.call_args.args[2])
+        assert received_message['To'] == 'receiver1@smtpc.net, receiver2@smtpc.net'
+
+
+@pytest.mark.parametrize('extensions', [('PIPELINING', '8BITMIME'), ('PIPELINING', )], ids=['8bitmime', 'no 8bitmime'])
+def test_send_concurrency_multipart(smtpctmppath, capsys, extensions):
+    attachment = smtpctmppath / 'notes.txt'
+    attachment.write_bytes(b'first line\nsecond line\n')
+    recipients = [f'receiver{i}@smtpc.net' for i in range(8)]
+
+    server = FakeSMTPServer(extensions=extensions).start()
+    try:
+        r = callsmtpc(['send', '--from', 'sender@smtpc.net', *[f'--to={address}' for address in recipients],
+            '--subject', 'notes', '--body', 'zażółć gęślą jaźń', '--body-html', '<p>zażółć gęślą jaźń</p>',
+            '--attach', str(attachment), '--host', server.host, '--port', str(server.port), '--concurrency', '4'], capsys)
+        assert r.code == ExitCodes.OK.value, r
+    finally:
+        server.stop()
+
+    assert len(server.messages) == 4
+    assert sorted(address for received in server.messages for address in received.rcpt_to) == sorted(recipients)
+    for received in server.messages:
+        received_message = email.message_from_bytes(received.data)
+        assert not received_message.defects
+        body, file = received_message.get_payload()
+        assert [part.get_payload(decode=True).decode('utf-8') for part in body.get_payload()] == \
+            ['zażółć gęślą jaźń', '<p>zażółć gęślą jaźń</p>']
+        assert file.get_payload(decode=True) == attachment.read_bytes()
+        assert received.data.isascii() == ('8BITMIME' not in extensions)
+
+
+@pytest.mark.parametrize('params, expected_in_err',
+    [
+        [['--concurrency', '0'], '--concurrency must be greater than 0'],
+        [['--reconnect-attempts', '-1'], '--reconnect-attempts cannot be negative'],
+        [['--concurrency', '2', '--smtp-interactive'], 'Cannot use --concurrency together with'],
+    ],
+    ids=[
+        'zero concurrency',
+        'negative reconnect attempts',
+        'concurrency with smtp interactive',
+    ]
+)
+def test_send_concurrency_invalid(smtpctmppath, capsys, params, expected_in_err):
+    r = callsmtpc(['send', '--from', 'sender@smtpc.net', '--to', 'receiver@smtpc.net', *params], capsys)
+    assert r.code == ExitCodes.OTHER.value, r
+    assert expected_in_err in r.err
+
+
+def test_send_delivery_mx(smtpctmppath, capsys):
+    resolver = mx.MXCache(mx.StaticMXResolver({'a.smtpc.net': ['mx.a.smtpc.net'], 'b.smtpc.net': ['mx.b.smtpc.net']}))
+    with \
+        mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class,\
+        mock.patch('smtpc.mx.default_resolver', return_value=resolver)\
+    :
+        mocked_smtp = mocked_smtp_class.return_value
+        prepare_smtp_mock(mocked_smtp)
+        mocked_smtp.sendmail.return_value = {}
+
+        r = callsmtpc(['send', '--from', 'sender@smtpc.net', '--to', 'receiver1@a.smtpc.net', '--to', 'receiver@b.smtpc.net',
+            '--cc', 'receiver2@a.smtpc.net', '--delivery', 'mx'], capsys)
+        assert r.code == ExitCodes.OK.value, r
+
+        assert [call.args[:2] for call in mocked_smtp.connect.call_args_list] == [('mx.a.smtpc.net', 25), ('mx.b.smtpc.net', 25)]
+        assert [call.args[1] for call in mocked_smtp.sendmail.call_args_list] == [
+            ['receiver1@a.smtpc.net', 'receiver2@a.smtpc.net'],
+            ['receiver@b.smtpc.net'],
+        ]
+        assert 'Message sent to: receiver1@a.smtpc.net, receiver2@a.smtpc.net, receiver@b.smtpc.net' in r.out
+
+
+def test_send_daemon(smtpctmppath, capsys):
+    response = {'ok': True, 'recipients': ['receiver@smtpc.net'], 'rejects': {'reject@smtpc.net': [550, 'rejected']}}
+    with mock.patch('smtpc.service.send_request', return_value=response) as mocked_send_request:
+        r = callsmtpc(['send', '--daemon', '--from', 'sender@smtpc.net', '--to', 'receiver@smtpc.net', '--to', 'reject@smtpc.net',
+            '--subject', 'Hello {{ name }}', '--template-field', 'name=John'], capsys)
+        assert r.code == ExitCodes.OK.value, r
+        assert 'Message sent to: receiver@smtpc.net' in r.out
+
+        socket_path, request = mocked_send_request.call_args.args
+        assert socket_path == smtpctmppath / 'smtpc.sock'
+        assert request == {
+            'address_from': 'sender@smtpc.net',
+            'address_to': ['receiver@smtpc.net', 'reject@smtpc.net'],
+            'subject': 'Hello {{ name }}',
+            'template_fields': ['name=John'],
+            'raw_body': False,
+        }
+
+    with mock.patch('smtpc.service.send_request', return_value={'ok': False, 'error': 'Unknown profile: x'}):
+        r = callsmtpc(['send', '--daemon', '/tmp/smtpc.sock', '--from', 'sender@smtpc.net', '--to', 'receiver@smtpc.net'], capsys)
+        assert r.code == ExitCodes.OTHER.value, r
+        assert 'Unknown profile: x' in r.out
+
+    r = callsmtpc(['send', '--daemon', str(smtpctmppath / 'missing.sock'), '--from', 'sender@smtpc.net',
+        '--to', 'receiver@smtpc.net'], capsys)
+    assert r.code == ExitCodes.CONNECTION_ERROR.value, r
+
+
+@pytest.mark.parametrize('params, expected_in_err',
+    [
+        [['--host', 'smtp.smtpc.net', '--port', '587'], 'Cannot use connection params together with --daemon: --host, --port'],
+        [['--dry-run'], 'Cannot use --daemon together with'],
+    ],
+    ids=[
+        'connection params',
+        'dry run',
+    ]
+)
+def test_send_daemon_invalid(smtpctmppath, capsys, params, expected_in_err):
+    r = callsmtpc(['send', '--daemon', '--from', 'sender@smtpc.net', '--to', 'receiver@smtpc.net', *params], capsys)
+    assert r.code == ExitCodes.OTHER.value, r
+    assert expected_in_err in r.err
+
+
+def test_send_body_file(smtpctmppath, capsys):
+    body_file = smtpctmppath / 'body.txt'
+    body_file.write_text('some message from file')
+    with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+        mocked_smtp = mocked_smtp_class.return_value
+        prepare_smtp_mock(mocked_smtp)
+        r = callsmtpc(['send', '--from', 'send@smtpc.net', '--to', 'receive@smtpc.net', '--subject', 'file',
+            '--body-file', str(body_file)], capsys)
+        assert r.code == ExitCodes.OK.value, r
+
+        received_message = email.message_from_string(mocked_smtp.sendmail.call_args.args[2])
+        assert received_message['Subject'] == 'file'
+        assert received_message.get_payload() == 'some message from file'
+
+
+def test_send_body_file_raw_streamed(smtpctmppath, capsys):
+    body_file = smtpctmppath / 'body.eml'
+    body_file.write_bytes(b'Subject: raw\n\n.dot\nline\r\n')
+    with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+        mocked_smtp = mocked_smtp_class.return_value
+        prepare_smtp_mock(mocked_smtp)
+        mocked_smtp.getreply.side_effect = [(250, b'OK'), (250, b'OK'), (354, b'go ahead'), (250, b'queued')]
+        r = callsmtpc(['send', '--from', 'send@smtpc.net', '--to', 'receive@smtpc.net', '--raw-body',
+            '--body-file', str(body_file)], capsys)
+        assert r.code == ExitCodes.OK.value, r
+
+        mocked_smtp.sendmail.assert_not_called()
+        assert [call.args[0] for call in mocked_smtp.putcmd.call_args_list] == [
+            'mail FROM:<send@smtpc.net>', 'rcpt TO:<receive@smtpc.net>', 'data',
+        ]
+        sent = b''.join(call.args[0] for call in mocked_smtp.send.call_args_list)
+        assert sent == b'Subject: raw\r\n\r\n..dot\r\nline\r\n.\r\n'
+        assert 'Message sent to: receive@smtpc.net' in r.out
+
+
+@pytest.mark.parametrize('params, expected_in_err',
+    [
+        [['--body', 'asd', '--body-file', 'body.txt'], 'Cannot use --body together with --body-file'],
+        [['--body-file', '/nonexistent/body.txt'], 'No such file: /nonexistent/body.txt'],
+    ],
+    ids=[
+        'body and body file',
+        'missing body file',
+    ]
+)
+def test_send_body_file_invalid(smtpctmppath, capsys, params, expected_in_err):
+    r = callsmtpc(['send', '--from', 'sender@smtpc.net', '--to', 'receiver@smtpc.net', *params], capsys)
+    assert r.code == ExitCodes.OTHER.value, r
+    assert expected_in_err in r.err
+
+
+def test_send_attachments(smtpctmppath, capsys):
+    attachment = smtpctmppath / 'notes.txt'
+    attachment.write_bytes(b'first line\nsecond line\n')
+    with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+        mocked_smtp = mocked_smtp_class.return_value
+        prepare_smtp_mock(mocked_smtp)
+        mocked_smtp.getreply.side_effect = [(250, b'OK'), (250, b'OK'), (354, b'go ahead'), (250, b'queued')]
+        r = callsmtpc(['send', '--from', 'send@smtpc.net', '--to', 'receive@smtpc.net', '--subject', 'notes',
+            '--body', 'see attachment', '--attach', str(attachment)], capsys)
+        assert r.code == ExitCodes.OK.value, r
+
+        mocked_smtp.sendmail.assert_not_called()
+        sent = b''.join(call.args[0] for call in mocked_smtp.send.call_args_list)
+        assert sent.endswith(b'\r\n.\r\n')
+        received_message = email.message_from_bytes(sent[:-3])
+        assert received_message['Subject'] == 'notes'
+        assert received_message.get_content_type() == 'multipart/mixed'
+        assert received_message.get_payload(0).get_payload() == 'see attachment'
+        assert received_message.get_payload(1).get_filename() == 'notes.txt'
+        assert received_message.get_payload(1).get_payload(decode=True) == attachment.read_bytes()
+
+
+@pytest.mark.parametrize('params, cached', [[['--build-cache'], 1], [[], 0]], ids=['build cache', 'no build cache'])
+def test_send_build_cache(smtpctmppath, capsys, params, cached):
+    message_ids = []
+    for _ in range(2):
+        with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+            mocked_smtp = mocked_smtp_class.return_value
+            prepare_smtp_mock(mocked_smtp)
+            mocked_smtp.sendmail.return_value = {}
+            r = callsmtpc(['send', '--from', 'send@smtpc.net', '--to', 'receive@smtpc.net', '--subject', 'Hello {{ name }}',
+                '--body', 'body', '--template-field', 'name=John', *params], capsys)
+            assert r.code == ExitCodes.OK.value, r
+
+            received_message = email.message_from_string(mocked_smtp.sendmail.call_args.args[2])
+            assert received_message['Subject'] == 'Hello John'
+            assert received_message.get_payload() == 'body'
+            message_ids.append(received_message['Message-ID'])
+
+    assert message_ids[0] != message_ids[1]
+    builds_dir = smtpctmppath / 'cache' / 'builds'
+    assert len(list(builds_dir.iterdir()) if builds_dir.exists() else []) == cached
+
+
+def test_send_build_cache_message_dump(smtpctmppath, capsys):
+    def send(*params):
+        with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+            prepare_smtp_mock(mocked_smtp_class.return_value)
+            mocked_smtp_class.return_value.sendmail.return_value = {}
+            r = callsmtpc(['send', '--from', 'send@smtpc.net', '--to', 'receive@smtpc.net', '--subject', 'Hello {{ name }}',
+                '--body', 'zażółć gęślą jaźń', '--template-field', 'name=John', '--message-dump', '--header',
+                'X-Long=' + 'zażółć gęślą jaźń ' * 10, *params], capsys)
+            assert r.code == ExitCodes.OK.value, r
+        return re.sub(r'(Date|Message-ID): .*\n', '', r.err[r.err.index('Message body start'):])
+
+    builds_dir = smtpctmppath / 'cache' / 'builds'
+    send('--dry-run', '--build-cache')
+    assert not builds_dir.exists()
+
+    # the first message is built and cached, the second one is taken from cache
+    dumps = [send(), send('--build-cache'), send('--build-cache')]
+    assert len(list(builds_dir.iterdir())) == 1
+    assert '\r' not in dumps[0]
+    assert 'zażółć gęślą jaźń' in dumps[0]
+    assert dumps[0] == dumps[1] == dumps[2]
+
+
+def test_send_stream_templates(smtpctmppath, capsys):
+    with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+        mocked_smtp = mocked_smtp_class.return_value
+        prepare_smtp_mock(mocked_smtp)
+        mocked_smtp.getreply.side_effect = [(250, b'OK'), (250, b'OK'), (354, b'go ahead'), (250, b'queued')]
+        r = callsmtpc(['send', '--from', 'send@smtpc.net', '--to', 'receive@smtpc.net', '--subject', 'report',
+            '--body', '{% for i in range(count) %}{{ i }},{% endfor %}', '--template-field-json', 'count=1000',
+            '--stream-templates'], capsys)
+        assert r.code == ExitCodes.OK.value, r
+
+        mocked_smtp.sendmail.assert_not_called()
+        sent = b''.join(call.args[0] for call in mocked_smtp.send.call_args_list)
+        received_message = email.message_from_bytes(sent[:-3])
+        assert received_message['Subject'] == 'report'
+        assert received_message['Content-Transfer-Encoding'] == 'base64'
+        assert received_message.get_payload(decode=True) == ''.join(f'{i},' for i in range(1000)).encode()
+
+
+def test_send_stream(smtpctmppath, capsys, monkeypatch):
+    r = callsmtpc(['profiles', 'add', 'local', '--host', '127.0.0.1', '--port', '25'], capsys)
+    assert r.code == ExitCodes.OK.value, r
+
+    monkeypatch.setattr('sys.stdin', io.StringIO(
+        json.dumps({'id': 1, 'address_to': ['john@smtpc.net'], 'subject': 'Hello {{ name }}', 'context': {'name': 'John'}}) + '\n' +
+        json.dumps({'id': 2, 'address_to': ['jane@smtpc.net'], 'profile': 'unknown'}) + '\n'
+    ))
+    with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+        mocked_smtp = mocked_smtp_class.return_value
+        prepare_smtp_mock(mocked_smtp)
+        mocked_smtp.sendmail.return_value = {}
+        r = callsmtpc(['send', '--stream', '--profile', 'local', '--from', 'sender@smtpc.net'], capsys)
+        assert r.code == ExitCodes.OTHER.value, r
+
+        mocked_smtp.sendmail.assert_called_once()
+        envelope_from, envelope_to, body = mocked_smtp.sendmail.call_args.args
+        assert (envelope_from, envelope_to) == ('sender@smtpc.net', ['john@smtpc.net'])
+        assert email.message_from_string(body)['Subject'] == 'Hello John'
+
+        responses = [json.loads(line) for line in r.out.splitlines() if line.startswith('{')]
+        assert responses == [
+            {'ok': True, 'recipients': ['john@smtpc.net'], 'rejects': {}, 'id': 1, 'line': 1},
+            {'ok': False, 'error': 'Unknown profile: unknown', 'id': 2, 'line': 2},
+        ]
+
+
+@pytest.mark.parametrize('params, expected_in_err',
+    [
+        [['--host', 'smtp.smtpc.net'], 'Cannot use connection params together with --stream: --host'],
+        [['--rows', 'rows.csv'], 'Cannot use --stream together with'],
+        [['--dry-run'], 'Cannot use --stream together with'],
+    ],
+    ids=[
+        'connection params',
+        'rows',
+        'dry run',
+    ]
+)
+def test_send_stream_invalid(smtpctmppath, capsys, params, expected_in_err):
+    r = callsmtpc(['send', '--stream', *params], capsys)
+    assert r.code == ExitCodes.OTHER.value, r
+    assert expected_in_err in r.err
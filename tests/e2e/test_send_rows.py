@@ -0,0 +1,179 @@
+import email
+import json
+from unittest import mock
+
+import pytest
+
+from smtpc.enums import ExitCodes
+from . import *
+
+
+def _add_message(capsys):
+    r = callsmtpc(['messages', 'add', 'report', '--subject', 'Report for {{ name }}',
+        '--body', 'Hello {{ name }}, you have {{ count }} items', '--from', 'sender@smtpc.net',
+        '--to', 'default@smtpc.net'], capsys)
+    assert r.code == ExitCodes.OK.value, r
+
+
+@pytest.mark.parametrize('file_name, content',
+    [
+        [
+            'rows.csv',
+            'name,count,to\nJohn,1,john@smtpc.net\nJane,2,"jane@smtpc.net, jane2@smtpc.net"\n',
+        ],
+        [
+            'rows.jsonl',
+            json.dumps({'name': 'John', 'count': 1, 'to': 'john@smtpc.net'}) + '\n\n' +
+            json.dumps({'name': 'Jane', 'count': 2, 'to': ['jane@smtpc.net', 'jane2@smtpc.net']}) + '\n',
+        ],
+    ],
+    ids=[
+        'csv',
+        'jsonl',
+    ]
+)
+def test_send_rows_valid(smtpctmppath, capsys, file_name, content):
+    _add_message(capsys)
+    rows_file = smtpctmppath / file_name
+    rows_file.write_text(content)
+
+    with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+        mocked_smtp = mocked_smtp_class.return_value
+        prepare_smtp_mock(mocked_smtp)
+        mocked_smtp.sendmail.return_value = {}
+
+        r = callsmtpc(['send', '--message', 'report', '--rows', str(rows_file)], capsys)
+        assert r.code == ExitCodes.OK.value, r
+
+        mocked_smtp_class.assert_called_once()
+        mocked_smtp.connect.assert_called_once()
+        mocked_smtp.quit.assert_called_once()
+        mocked_smtp.rset.assert_called_once()
+        assert mocked_smtp.sendmail.call_count == 2
+
+        first, second = [call.args for call in mocked_smtp.sendmail.call_args_list]
+        assert first[:2] == ('sender@smtpc.net', ['john@smtpc.net'])
+        assert second[:2] == ('sender@smtpc.net', ['jane@smtpc.net', 'jane2@smtpc.net'])
+
+        received_message = email.message_from_string(first[2])
+        assert received_message['Subject'] == 'Report for John'
+        assert received_message['To'] == 'john@smtpc.net'
+        assert received_message.get_payload() == 'Hello John, you have 1 items'
+
+        received_message = email.message_from_string(second[2])
+        assert received_message['Subject'] == 'Report for Jane'
+        assert received_message['To'] == 'jane@smtpc.net, jane2@smtpc.net'
+        assert received_message.get_payload() == 'Hello Jane, you have 2 items'
+
+        assert r.out == 'Message sent to: john@smtpc.net\nMessage sent to: jane@smtpc.net, jane2@smtpc.net\n'
+
+
+def test_send_rows_without_recipients_column(smtpctmppath, capsys):
+    _add_message(capsys)
+    rows_file = smtpctmppath / 'rows.csv'
+    rows_file.write_text('name,count\nJohn,1\n')
+
+    with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+        mocked_smtp = mocked_smtp_class.return_value
+        prepare_smtp_mock(mocked_smtp)
+        mocked_smtp.sendmail.return_value = {}
+
+        r = callsmtpc(['send', '--message', 'report', '--rows', str(rows_file)], capsys)
+        assert r.code == ExitCodes.OK.value, r
+
+        mocked_smtp.sendmail.assert_called_once()
+        assert mocked_smtp.sendmail.call_args.args[1] == ['default@smtpc.net']
+        mocked_smtp.rset.assert_not_called()
+
+
+@pytest.mark.parametrize('params, expected_in_err',
+    [
+        [
+            ['--rows', 'rows.txt'],
+            'Cannot detect format of rows file',
+        ],
+        [
+            ['--rows', 'rows.csv', '--message-interactive'],
+            'Cannot use --rows together with',
+        ],
+        [
+            ['--render-processes', '2'],
+            '--render-processes can be used only together with --rows',
+        ],
+        [
+            ['--rows', 'rows.csv', '--render-processes', '-1'],
+            '--render-processes cannot be negative',
+        ],
+        [
+            ['--rows', 'rows.csv', '--render-processes', '2', '--stream-templates'],
+            'Cannot use --render-processes together with --stream-templates',
+        ],
+    ],
+    ids=[
+        'unknown rows format',
+        'rows with interactive message',
+        'render processes without rows',
+        'negative render processes',
+        'render processes with stream templates',
+    ]
+)
+def test_send_rows_invalid(smtpctmppath, capsys, params, expected_in_err):
+    _add_message(capsys)
+    r = callsmtpc(['send', '--message', 'report', *params], capsys)
+    assert r.code == ExitCodes.OTHER.value, r
+    assert expected_in_err in r.err
+
+
+def test_send_rows_invalid_json(smtpctmppath, capsys):
+    _add_message(capsys)
+    rows_file = smtpctmppath / 'rows.jsonl'
+    rows_file.write_text('{"name": "John"}\n[1, 2]\n')
+
+    with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+        mocked_smtp = mocked_smtp_class.return_value
+        prepare_smtp_mock(mocked_smtp)
+        mocked_smtp.sendmail.return_value = {}
+
+        r = callsmtpc(['send', '--message', 'report', '--rows', str(rows_file)], capsys)
+        assert r.code == ExitCodes.OTHER.value, r
+        assert 'expected json object' in r.out
+
+
+def test_send_rows_session_max_messages(smtpctmppath, capsys):
+    _add_message(capsys)
+    rows_file = smtpctmppath / 'rows.csv'
+    rows_file.write_text('name,count\nJohn,1\nJane,2\nJack,3\n')
+
+    with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+        mocked_smtp = mocked_smtp_class.return_value
+        prepare_smtp_mock(mocked_smtp)
+        mocked_smtp.sendmail.return_value = {}
+
+        r = callsmtpc(['send', '--message', 'report', '--rows', str(rows_file), '--session-max-messages', '2'], capsys)
+        assert r.code == ExitCodes.OK.value, r
+
+        assert mocked_smtp.connect.call_count == 2
+        assert mocked_smtp.quit.call_count == 2
+        assert mocked_smtp.sendmail.call_count == 3
+        mocked_smtp.rset.assert_called_once()
+
+
+def test_send_rows_render_processes(smtpctmppath, capsys):
+    _add_message(capsys)
+    rows_file = smtpctmppath / 'rows.jsonl'
+    rows_file.write_text(''.join(json.dumps({'name': f'user{i}', 'count': i, 'to': f'user{i}@smtpc.net'}) + '\n' for i in range(50)))
+
+    with mock.patch('smtplib.SMTP', autospec=True) as mocked_smtp_class:
+        mocked_smtp = mocked_smtp_class.return_value
+        prepare_smtp_mock(mocked_smtp)
+        mocked_smtp.sendmail.return_value = {}
+
+        r = callsmtpc(['send', '--message', 'report', '--rows', str(rows_file), '--render-processes', '2'], capsys)
+        assert r.code == ExitCodes.OK.value, r
+
+        assert mocked_smtp.sendmail.call_count == 50
+        for i, call in enumerate(mocked_smtp.sendmail.call_args_list):
+            assert call.args[:2] == ('sender@smtpc.net', [f'user{i}@smtpc.net'])
+            received_message = email.message_from_string(call.args[2])
+            assert received_message['Subject'] == f'Report for user{i}'
+            assert received_message.get_payload() == f'Hello user{i}, you have {i} items'
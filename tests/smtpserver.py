@@ -0,0 +1,255 @@
+"""Minimal, threaded SMTP server used in tests.
+
+It understands just enough of SMTP to test smtpc transport: EHLO/HELO, AUTH PLAIN/LOGIN, MAIL, RCPT,
+DATA, BDAT, RSET, NOOP, STARTTLS and QUIT. Recipients with local part starting with "reject" are refused with 550,
+with "tempfail" with 451, and with "shutdown" with 421 after which the connection is closed. Senders with
+local part starting with "reject" are refused with 550.
+"""
+
+import base64
+import datetime
+import socket
+import socketserver
+import ssl
+import threading
+
+
+class ReceivedMessage:
+    def __init__(self, mail_from, mail_options, rcpt_to, data):
+        self.mail_from = mail_from
+        self.mail_options = mail_options
+        self.rcpt_to = rcpt_to
+        self.data = data
+
+    def __repr__(self):
+        return f'<ReceivedMessage from={self.mail_from} to={self.rcpt_to} size={len(self.data)}>'
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.buffer = b''
+        self.server.smtpc_fake.sessions += 1
+
+    def _reply(self, line):
+        self.request.sendall(line.encode() + b'\r\n')
+
+    def _read_line(self):
+        while b'\r\n' not in self.buffer:
+            chunk = self.request.recv(65536)
+            if not chunk:
+                return None
+            self.server.smtpc_fake.reads.append(chunk)
+            self.buffer += chunk
+        line, self.buffer = self.buffer.split(b'\r\n', 1)
+        return line
+
+    def _read_exact(self, size):
+        while len(self.buffer) < size:
+            chunk = self.request.recv(65536)
+            if not chunk:
+                return None
+            self.server.smtpc_fake.reads.append(chunk)
+            self.buffer += chunk
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def handle(self):
+        fake = self.server.smtpc_fake
+        self._reply('220 fake.smtpc.net ESMTP')
+        mail_from, mail_options, rcpt_to, chunks = None, [], [], []
+
+        while True:
+            line = self._read_line()
+            if line is None:
+                return
+            line = line.decode('utf-8')
+            fake.commands.append(line)
+            cmd, _, arg = line.partition(' ')
+            cmd = cmd.upper()
+
+            if cmd == 'EHLO':
+                lines = ['fake.smtpc.net'] + list(fake.extensions)
+                for ext in lines[:-1]:
+                    self._reply(f'250-{ext}')
+                self._reply(f'250 {lines[-1]}')
+            elif cmd == 'HELO':
+                self._reply('250 fake.smtpc.net')
+            elif cmd == 'AUTH':
+                method, _, initial = arg.partition(' ')
+                if method.upper() == 'PLAIN':
+                    credentials = base64.b64decode(initial).split(b'\0')
+                    login, password = credentials[1].decode(), credentials[2].decode()
+                else:
+                    self._reply('334 ' + base64.b64encode(b'Username:').decode())
+                    login = base64.b64decode(self._read_line()).decode()
+                    self._reply('334 ' + base64.b64encode(b'Password:').decode())
+                    password = base64.b64decode(self._read_line()).decode()
+                if (login, password) == fake.credentials:
+                    self._reply('235 Authentication successful')
+                else:
+                    self._reply('535 Authentication failed')
+            elif cmd == 'MAIL':
+                address, *options = arg[5:].split(' ')
+                address = address.strip('<>')
+                if address.startswith('reject'):
+                    self._reply('550 sender rejected')
+                else:
+                    mail_from, mail_options, rcpt_to, chunks = address, options, [], []
+                    self._reply('250 OK')
+            elif cmd == 'RCPT':
+                address = arg[3:].split(' ')[0].strip('<>')
+                if address.startswith('reject'):
+                    self._reply('550 recipient rejected')
+                elif address.startswith('tempfail'):
+                    self._reply('451 try again later')
+                elif address.startswith('shutdown'):
+                    self._reply('421 service shutting down')
+                    return
+                else:
+                    rcpt_to.append(address)
+                    self._reply('250 OK')
+            elif cmd == 'DATA':
+                with fake.lock:
+                    drop = fake.drop_on_data > 0
+                    fake.drop_on_data -= drop
+                if drop:
+                    return
+                if not rcpt_to:
+                    self._reply('503 no valid recipients')
+                    continue
+                self._reply('354 go ahead')
+                lines = []
+                while True:
+                    data_line = self._read_line()
+                    if data_line is None:
+                        return
+                    if data_line == b'.':
+                        break
+                    if data_line.startswith(b'.'):
+                        data_line = data_line[1:]
+                    lines.append(data_line)
+                fake.messages.append(ReceivedMessage(mail_from, mail_options, rcpt_to, b'\r\n'.join(lines) + b'\r\n'))
+                mail_from, rcpt_to = None, []
+                self._reply('250 queued')
+            elif cmd == 'BDAT':
+                size, *last = arg.split(' ')
+                chunk = self._read_exact(int(size))
+                if chunk is None:
+                    return
+                chunks.append(chunk)
+                fake.bdat_sizes.append(int(size))
+                if last:
+                    fake.messages.append(ReceivedMessage(mail_from, mail_options, rcpt_to, b''.join(chunks)))
+                    mail_from, rcpt_to, chunks = None, [], []
+                self._reply('250 OK')
+            elif cmd == 'RSET':
+                mail_from, rcpt_to, chunks = None, [], []
+                self._reply('250 OK')
+            elif cmd == 'NOOP':
+                self._reply('250 OK')
+            elif cmd == 'STARTTLS':
+                if fake.tls_context is None:
+                    self._reply('454 TLS not available')
+                    continue
+                self._reply('220 ready to start TLS')
+                self.request = fake.tls_context.wrap_socket(self.request, server_side=True)
+                self.buffer = b''
+            elif cmd == 'QUIT':
+                self._reply('221 bye')
+                return
+            else:
+                self._reply('502 command not implemented')
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeSMTPServer:
+    def __init__(self, extensions=('PIPELINING', '8BITMIME', 'AUTH PLAIN LOGIN'), credentials=('login', 'password'),
+        address=('127.0.0.1', 0), tls_context=None,
+    ):
+        self.extensions = extensions
+        self.credentials = credentials
+        # STARTTLS is refused with 454 without it
+        self.tls_context = tls_context
+        self.messages = []
+        self.commands = []
+        self.reads = []
+        self.bdat_sizes = []
+        self.sessions = 0
+        # number of next DATA commands on which connection is dropped without reply
+        self.drop_on_data = 0
+        self.lock = threading.Lock()
+        self._server = _Server(address, _Handler)
+        self._server.smtpc_fake = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05, ), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reads_containing(self, fragment):
+        return [chunk for chunk in self.reads if fragment in chunk]
+
+
+def sender_params(server, **kwargs):
+    """Arguments for smtpc.message.Sender (and AsyncSender) sending to the given fake server."""
+    params = dict(
+        connection_timeout=5, source_address=None, debug_level=0,
+        host=server.host if server else '127.0.0.1', port=server.port if server else free_port(),
+        identify_as='client.smtpc.net',
+        tls=None, no_tls=None, ssl=None, no_ssl=None,
+        login=None, password=None, password_key=None,
+        envelope_from=None, address_from='sender@smtpc.net', envelope_to=None,
+        address_to=['receiver@smtpc.net'], address_cc=None, address_bcc=None, reply_to=None,
+        message_body='Subject: test\n\nsome body\n.starts with dot\n',
+        predefined_profile=None, predefined_message=None,
+        dry_run=False, disable_ehlo=False, auth_method=None, smtp_interactive=False,
+    )
+    params.update(kwargs)
+    return params
+
+
+def tls_server_context(directory):
+    """Server side SSLContext with self-signed certificate for localhost, requires cryptography package."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'localhost')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()).not_valid_before(now) \
+        .not_valid_after(now + datetime.timedelta(days=1)).sign(key, hashes.SHA256())
+
+    cert_file, key_file = directory / 'cert.pem', directory / 'key.pem'
+    cert_file.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_file.write_bytes(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()))
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_file, key_file)
+    return context
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
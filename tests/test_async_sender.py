@@ -0,0 +1,161 @@
+import asyncio
+import email
+import smtplib
+
+import pytest
+
+from smtpc.async_sender import AsyncSender
+from smtpc.enums import DeliveryMode, SMTPAuthMethod
+from smtpc.errors import ConnectionFailedError, UnsupportedFeatureError
+from smtpc.message import Builder
+from .smtpserver import FakeSMTPServer, sender_params, tls_server_context
+
+
+def create_sender(server, **kwargs):
+    return AsyncSender(**sender_params(server, **kwargs))
+
+
+def test_async_sender_execute(smtp_server):
+    sender = create_sender(smtp_server)
+    receivers = asyncio.run(sender.execute())
+
+    assert receivers == ['receiver@smtpc.net']
+    assert len(smtp_server.messages) == 1
+    received = smtp_server.messages[0]
+    assert received.mail_from == 'sender@smtpc.net'
+    assert received.rcpt_to == ['receiver@smtpc.net']
+    assert received.data == b'Subject: test\r\n\r\nsome body\r\n.starts with dot\r\n'
+    assert smtp_server.commands[0] == 'EHLO client.smtpc.net'
+    assert smtp_server.commands[-1] == 'QUIT'
+
+
+@pytest.mark.parametrize('auth_method', [None, SMTPAuthMethod.PLAIN, SMTPAuthMethod.LOGIN])
+def test_async_sender_auth(smtp_server, auth_method):
+    sender = create_sender(smtp_server, login='login', password='password', auth_method=auth_method)
+    assert asyncio.run(sender.execute()) == ['receiver@smtpc.net']
+
+    auth_commands = [item for item in smtp_server.commands if item.startswith('AUTH')]
+    assert auth_commands[0].startswith('AUTH LOGIN' if auth_method == SMTPAuthMethod.LOGIN else 'AUTH PLAIN')
+
+
+def test_async_sender_rejects(smtp_server):
+    sender = create_sender(smtp_server, address_to=['receiver@smtpc.net', 'reject@smtpc.net'])
+    assert asyncio.run(sender.execute()) == ['receiver@smtpc.net']
+    assert smtp_server.messages[0].rcpt_to == ['receiver@smtpc.net']
+
+
+def test_async_sender_named_addresses(smtp_server):
+    sender = create_sender(smtp_server, envelope_from='Alice <alice@smtpc.net>', envelope_to=['Bob <bob@smtpc.net>'])
+    assert asyncio.run(sender.execute()) == ['Bob <bob@smtpc.net>']
+    assert 'MAIL FROM:<alice@smtpc.net>' in smtp_server.commands
+    assert 'RCPT TO:<bob@smtpc.net>' in smtp_server.commands
+    assert smtp_server.messages[0].mail_from == 'alice@smtpc.net'
+
+
+def test_async_sender_non_ascii_address(smtp_server):
+    sender = create_sender(smtp_server, address_to=['użytkownik@smtpc.net'])
+    with pytest.raises(smtplib.SMTPNotSupportedError):
+        asyncio.run(sender.execute())
+    assert not smtp_server.messages
+
+
+def test_async_sender_smtputf8():
+    server = FakeSMTPServer(extensions=('PIPELINING', 'SMTPUTF8')).start()
+    try:
+        sender = create_sender(server, address_to=['użytkownik@smtpc.net'])
+        assert asyncio.run(sender.execute()) == ['użytkownik@smtpc.net']
+        assert server.messages[0].rcpt_to == ['użytkownik@smtpc.net']
+        assert server.messages[0].mail_options == ['SMTPUTF8']
+    finally:
+        server.stop()
+
+
+def polish_message():
+    return Builder(subject='Raport', envelope_from=None, address_from='sender@smtpc.net', envelope_to=None,
+        address_to=['receiver@smtpc.net'], address_cc=None, address_bcc=None, reply_to=None, body_type=None,
+        body='Wszystkie zadania zostały zakończone poprawnie.\n').execute()
+
+
+def test_async_sender_8bitmime(smtp_server):
+    sender = create_sender(smtp_server, message_body=polish_message())
+    assert asyncio.run(sender.execute()) == ['receiver@smtpc.net']
+
+    received = smtp_server.messages[0]
+    assert received.mail_options == ['BODY=8BITMIME']
+    assert b'Content-Transfer-Encoding: 8bit' in received.data
+    assert 'zakończone'.encode('utf-8') in received.data
+
+
+def test_async_sender_8bit_downgrade():
+    server = FakeSMTPServer(extensions=('PIPELINING', )).start()
+    try:
+        sender = create_sender(server, message_body=polish_message())
+        assert asyncio.run(sender.execute()) == ['receiver@smtpc.net']
+
+        received = server.messages[0]
+        assert received.mail_options == []
+        assert received.data.isascii()
+        assert email.message_from_bytes(received.data).get_payload(decode=True).decode('utf-8') == \
+            'Wszystkie zadania zostały zakończone poprawnie.\r\n'
+    finally:
+        server.stop()
+
+
+@pytest.mark.parametrize('streams_start_tls', [True, False], ids=['start_tls', 'new streams'])
+def test_async_sender_starttls(tmp_path, monkeypatch, streams_start_tls):
+    pytest.importorskip('cryptography')
+    if not streams_start_tls:
+        # Python < 3.11
+        monkeypatch.delattr(asyncio.StreamWriter, 'start_tls', raising=False)
+    elif not hasattr(asyncio.StreamWriter, 'start_tls'):
+        pytest.skip('StreamWriter.start_tls requires Python 3.11')
+
+    server = FakeSMTPServer(extensions=('PIPELINING', 'STARTTLS'), tls_context=tls_server_context(tmp_path)).start()
+    try:
+        sender = create_sender(server, tls=True, address_to=['receiver1@smtpc.net', 'receiver2@smtpc.net'])
+        messages = [('Subject: test\n\nbody\n', 'sender@smtpc.net', ['receiver1@smtpc.net'])] * 3
+        results = asyncio.run(sender.execute_many(messages, concurrency=1))
+
+        assert all(result.ok for result in results)
+        assert server.commands.count('STARTTLS') == 1
+        assert len(server.messages) == 3
+    finally:
+        server.stop()
+
+
+def test_async_sender_mx_delivery_not_supported(smtp_server):
+    with pytest.raises(UnsupportedFeatureError):
+        create_sender(smtp_server, delivery=DeliveryMode.MX)
+
+
+def test_async_sender_connection_error():
+    sender = create_sender(None)
+    with pytest.raises(ConnectionFailedError):
+        asyncio.run(sender.execute())
+
+
+def test_async_sender_execute_many(smtp_server):
+    sender = create_sender(smtp_server, message_body=None)
+
+    messages = []
+    for idx in range(20):
+        builder = Builder(
+            subject=f'message {idx}', envelope_from=None, address_from='sender@smtpc.net', envelope_to=None,
+            address_to=[f'receiver{idx}@smtpc.net' if idx != 7 else 'reject@smtpc.net'],
+            address_cc=None, address_bcc=None, reply_to=None, body_type=None, body=f'body {idx}',
+        )
+        messages.append((builder.execute(), *builder.envelope()))
+
+    results = asyncio.run(sender.execute_many(messages, concurrency=5))
+
+    assert len(results) == 20
+    assert smtp_server.sessions == 5
+    for idx, result in enumerate(results):
+        if idx == 7:
+            assert not result.ok
+        else:
+            assert result.ok
+            assert result.recipients == [f'receiver{idx}@smtpc.net']
+
+    subjects = sorted(email.message_from_bytes(item.data)['Subject'] for item in smtp_server.messages)
+    assert subjects == sorted(f'message {idx}' for idx in range(20) if idx != 7)
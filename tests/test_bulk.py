@@ -0,0 +1,57 @@
+import email
+import pickle
+
+import pytest
+
+from smtpc import bulk
+from smtpc.errors import InvalidTemplateFieldNameError
+from smtpc.message import Builder, message_to_bytes
+
+
+def create_builder():
+    return Builder(subject='Report for {{ name }}', envelope_from=None, address_from='smtpc@example.com',
+        envelope_to=None, address_to=['default@example.net'], address_cc=None, address_bcc=None, reply_to=None,
+        body_type=None, body='{% for i in range(count) %}<td>{{ i }}</td>{% endfor %}')
+
+
+def test_render_rows_processes():
+    rows = [{'name': f'user{i}', 'count': i, 'to': f'user{i}@example.net'} for i in range(40)]
+    expected = list(bulk.render_rows(create_builder(), rows))
+    rendered = list(bulk.render_rows(create_builder(), rows, processes=2))
+
+    assert len(rendered) == len(expected) == 40
+    for (message, *envelope), (expected_message, *expected_envelope) in zip(rendered, expected):
+        assert envelope == expected_envelope
+        message = email.message_from_bytes(message_to_bytes(message))
+        expected_message = email.message_from_bytes(message_to_bytes(expected_message))
+        assert message['Subject'] == expected_message['Subject']
+        assert message.get_payload() == expected_message.get_payload()
+    assert envelope == ['smtpc@example.com', ['user39@example.net']]
+
+
+def test_builder_pickle_without_profile_and_message():
+    # builder is sent to render worker processes
+    builder = pickle.loads(pickle.dumps(create_builder()))
+    assert builder.predefined_profile is None
+    assert builder.predefined_message is None
+    assert builder.template('{{ smtpc_predefined_profile.name }}') == 'None'
+
+
+def test_render_rows_backpressure():
+    read = 0
+
+    def rows():
+        nonlocal read
+        for i in range(1000):
+            read += 1
+            yield {'name': f'user{i}', 'count': 1}
+
+    messages = bulk.render_rows(create_builder(), rows(), processes=2)
+    next(messages)
+    assert read <= (2 * bulk.RENDER_QUEUE_SIZE + 1) * bulk.RENDER_BATCH_SIZE
+    messages.close()
+
+
+def test_render_rows_error():
+    with pytest.raises(InvalidTemplateFieldNameError):
+        list(bulk.render_rows(create_builder(), [{'name': 'John', 'count': 1}, {'invalid name': 'Jane'}], processes=2))
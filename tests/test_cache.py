@@ -0,0 +1,75 @@
+import os
+
+from smtpc.cache import DiskLRUCache, LRUCache
+
+
+def test_lru_cache():
+    cache = LRUCache(10)
+    cache.set('a', 'aaaa', 4)
+    cache.set('b', 'bbbb', 4)
+    assert cache.get('a') == 'aaaa'
+
+    # 'b' is the least recently used
+    cache.set('c', 'cccc', 4)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'aaaa'
+    assert cache.get('c') == 'cccc'
+    assert cache.size == 8
+
+
+def test_lru_cache_replace():
+    cache = LRUCache(10)
+    cache.set('a', 'aaaa', 4)
+    cache.set('a', 'aaaaaa', 6)
+    assert cache.get('a') == 'aaaaaa'
+    assert cache.size == 6
+    assert len(cache) == 1
+
+
+def test_lru_cache_too_big_value():
+    cache = LRUCache(10)
+    cache.set('a', 'aaaa', 4)
+    cache.set('b', 'b' * 11, 11)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'aaaa'
+
+    cache.clear()
+    assert cache.get('a') is None
+    assert cache.size == 0
+
+
+def test_disk_lru_cache(tmp_path):
+    cache = DiskLRUCache(tmp_path / 'cache', 10)
+    assert cache.get('a') is None
+    cache.set('a', b'aaaa')
+    cache.set('b', b'bbbb')
+    os.utime(tmp_path / 'cache' / 'a', ns=(0, 0))
+    os.utime(tmp_path / 'cache' / 'b', ns=(0, 1))
+    assert cache.get('a') == b'aaaa'
+
+    # 'b' is the least recently used
+    cache.set('c', b'cccc')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'aaaa'
+    assert cache.get('c') == b'cccc'
+    assert sorted(path.name for path in (tmp_path / 'cache').iterdir()) == ['a', 'c']
+
+
+def test_disk_lru_cache_too_big_value(tmp_path):
+    cache = DiskLRUCache(tmp_path, 10)
+    cache.set('a', b'a' * 11)
+    assert cache.get('a') is None
+
+
+def test_disk_lru_cache_not_writable(tmp_path):
+    (tmp_path / 'file').write_text('')
+    cache = DiskLRUCache(tmp_path / 'file' / 'cache', 10)
+    cache.set('a', b'aaaa')
+    assert cache.get('a') is None
+
+
+def test_disk_lru_cache_clear(tmp_path):
+    cache = DiskLRUCache(tmp_path, 10)
+    cache.set('a', b'aaaa')
+    cache.clear()
+    assert cache.get('a') is None
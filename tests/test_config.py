@@ -1,6 +1,10 @@
 import os
 import pathlib
 
+import pytest
+import toml
+
+from smtpc import config
 from smtpc.config import get_config_dir
 
 
@@ -22,3 +26,61 @@ def test_get_config_dir():
     finally:
         os.environ = orginal_env
 
+
+@pytest.fixture
+def toml_file(tmp_path):
+    file = tmp_path / 'messages.toml'
+    file.write_text('[messages.report]\nsubject = "Report"\nbody = "<p>zażółć</p>"\naddress_to = ["a@example.net"]\n')
+    return file
+
+
+def fail_parsing(monkeypatch):
+    monkeypatch.setattr(toml, 'load', lambda *args: pytest.fail('parsed again'))
+    if config.tomllib:
+        monkeypatch.setattr(config.tomllib, 'load', lambda *args: pytest.fail('parsed again'))
+
+
+def test_load_toml_file_cached(toml_file, monkeypatch):
+    expected = {'messages': {'report': {'subject': 'Report', 'body': '<p>zażółć</p>', 'address_to': ['a@example.net']}}}
+    assert config.load_toml_file(toml_file) == expected
+    assert (toml_file.parent / 'messages.toml.cache').is_file()
+
+    fail_parsing(monkeypatch)
+    assert config.load_toml_file(toml_file) == expected
+
+
+def test_load_toml_file_modified(toml_file):
+    config.load_toml_file(toml_file)
+    toml_file.write_text('[messages]\n')
+    os.utime(toml_file, ns=(0, 0))
+    assert config.load_toml_file(toml_file) == {'messages': {}}
+
+
+def test_load_toml_file_invalid_cache(toml_file):
+    (toml_file.parent / 'messages.toml.cache').write_bytes(b'invalid')
+    assert config.load_toml_file(toml_file)['messages']['report']['subject'] == 'Report'
+
+
+def test_load_toml_file_with_dates_not_cached(tmp_path):
+    toml_file = tmp_path / 'messages.toml'
+    toml_file.write_text('[messages.report]\ncreated = 2020-01-02\n')
+    assert str(config.load_toml_file(toml_file)['messages']['report']['created']) == '2020-01-02'
+    assert not (tmp_path / 'messages.toml.cache').exists()
+
+
+def test_load_toml_file_without_tomllib(toml_file, monkeypatch):
+    monkeypatch.setattr(config, 'tomllib', None)
+    assert config.load_toml_file(toml_file)['messages']['report']['subject'] == 'Report'
+
+
+@pytest.mark.parametrize('use_tomllib', [True, False], ids=['tomllib', 'toml'])
+def test_load_toml_file_invalid(tmp_path, monkeypatch, use_tomllib):
+    if not use_tomllib:
+        monkeypatch.setattr(config, 'tomllib', None)
+    elif not config.tomllib:
+        pytest.skip('requires tomllib')
+
+    file = tmp_path / 'messages.toml'
+    file.write_text('[messages\n')
+    with pytest.raises(config.TOML_DECODE_ERRORS):
+        config.load_toml_file(file)
@@ -1,5 +1,14 @@
+import email
+import re
+
+import pytest
+
+from smtpc import mime
+from smtpc.cache import DiskLRUCache
 from smtpc.enums import ContentType
-from smtpc.message import Builder
+from smtpc.errors import InvalidTemplateFieldNameError
+from smtpc.message import Builder, message_to_bytes
+from smtpc.mime import MultipartStream
 
 
 def test_builder_simple():
@@ -32,3 +41,207 @@ def test_builder_simple():
     assert builder.body_html is None
     assert builder.body == 'some body'
     assert builder.headers == []
+
+
+def create_builder(**kwargs):
+    params = dict(
+        subject='Report for {{ name }}',
+        envelope_from=None,
+        address_from='smtpc@example.com',
+        envelope_to=None,
+        address_to=['smtpc@example.net'],
+        address_cc=None,
+        address_bcc=None,
+        reply_to=None,
+        body_type=None,
+        body='Hello {{ name }}, you are {{ smtpc_to[0] }}',
+        body_html='<p>Static footer, zażółć gęślą jaźń</p>',
+        headers=['X-Campaign=reports'],
+    )
+    params.update(kwargs)
+    return Builder(**params)
+
+
+def normalize(data):
+    # these headers are different for every message
+    return re.sub(rb'(Date|Message-ID): .*\r\n', b'', re.sub(rb'=====\d+==', b'=====BOUNDARY==', data))
+
+
+@pytest.mark.parametrize('params',
+    [
+        {},
+        {'body_html': None},
+        {'subject': 'Static subject', 'body': 'Static body'},
+        {'body': 'Subject: raw\n\nraw body {{ name }}\n', 'body_html': None, 'raw_body': True},
+    ],
+    ids=[
+        'alternative',
+        'plain',
+        'static',
+        'raw body',
+    ]
+)
+def test_builder_compile(params):
+    compiled = create_builder(**params).compile()
+    for name, addresses in [('John', {}), ('Jane', {'address_to': ['jane@example.net', 'jane2@example.net']})]:
+        rendered = compiled.render({'name': name}, **addresses)
+        expected = create_builder(**params, template_context={'name': name}, **addresses).execute()
+        expected = email.message_from_bytes(message_to_bytes(expected))
+
+        assert isinstance(rendered, MultipartStream)
+        rendered = email.message_from_bytes(b''.join(rendered.chunks()))
+        assert sorted(rendered.keys()) == sorted(expected.keys())
+        for key in set(expected.keys()) - {'Date', 'Message-ID', 'Content-Type'}:
+            assert rendered[key] == expected[key]
+        assert rendered.get_content_type() == expected.get_content_type()
+        assert [part.get_payload(decode=True) for part in rendered.walk() if not part.is_multipart()] == \
+            [part.get_payload(decode=True) for part in expected.walk() if not part.is_multipart()]
+
+
+def test_builder_compile_same_as_execute():
+    compiled = create_builder().compile()
+    rendered = b''.join(compiled.render({'name': 'John'}).chunks())
+    expected = message_to_bytes(create_builder(template_context={'name': 'John'}).execute())
+    assert normalize(rendered) == normalize(expected)
+
+
+def test_builder_rendered_parts_not_cached():
+    mime.ENCODED_PARTS.clear()
+    compiled = create_builder().compile()
+    for name in ('John', 'Jane', 'Józef'):
+        b''.join(compiled.render({'name': name}).chunks())
+        create_builder(template_context={'name': name}).execute()
+
+    # only static HTML part is shared by all messages
+    assert len(mime.ENCODED_PARTS) == 1
+
+
+def test_builder_compile_unique_headers():
+    compiled = create_builder(body='static', subject='static').compile()
+    first, second = [email.message_from_bytes(b''.join(compiled.render().chunks())) for _ in range(2)]
+    assert first['Message-ID'] != second['Message-ID']
+    assert first['Date']
+
+
+def test_builder_compile_envelope():
+    compiled = create_builder(address_bcc=['bcc@example.net']).compile()
+    assert compiled.envelope() == ('smtpc@example.com', ['smtpc@example.net', 'bcc@example.net'])
+    assert compiled.envelope(address_to=['other@example.net']) == ('smtpc@example.com', ['other@example.net', 'bcc@example.net'])
+
+
+def test_builder_compile_attachments(tmp_path):
+    (tmp_path / 'report.csv').write_bytes(b'a,b\n1,2\n')
+    compiled = create_builder(attachments=[str(tmp_path / 'report.csv')]).compile()
+    rendered = compiled.render({'name': 'John'})
+    assert rendered.streamed
+
+    message = email.message_from_bytes(b''.join(rendered.chunks()))
+    assert message['Subject'] == 'Report for John'
+    assert message.get_payload(1).get_filename() == 'report.csv'
+    assert message.get_payload(1).get_payload(decode=True) == b'a,b\n1,2\n'
+
+
+def test_builder_compile_invalid_field():
+    compiled = create_builder().compile()
+    with pytest.raises(InvalidTemplateFieldNameError):
+        compiled.render({'invalid name': 'John'})
+
+
+def test_builder_render_many(monkeypatch):
+    calls = []
+    parse_field = Builder._template_parse_field.__func__
+    monkeypatch.setattr(Builder, '_template_parse_field', classmethod(lambda cls, *args: calls.append(args) or parse_field(cls, *args)))
+
+    builder = create_builder(
+        body='Hello {{ name }}, {{ greeting }}! {{ items | length }}',
+        template_fields=['greeting=good morning', 'name=default'],
+        template_fields_json=['items=[1, 2, 3]'],
+    )
+    messages = [email.message_from_bytes(message_to_bytes(item)) for item in builder.render_many([{'name': 'John'}, {}])]
+    assert [message['Subject'] for message in messages] == ['Report for John', 'Report for default']
+    assert messages[0].get_payload(0).get_payload() == 'Hello John, good morning! 3'
+    assert messages[1].get_payload(0).get_payload() == 'Hello default, good morning! 3'
+    assert len(calls) == 3
+
+
+def test_builder_render():
+    builder = create_builder(address_cc=['cc@example.net'])
+    message = email.message_from_bytes(message_to_bytes(builder.render({'name': 'Jane'}, address_to=['jane@example.net'])))
+    assert message['Subject'] == 'Report for Jane'
+    assert message['To'] == 'jane@example.net'
+    assert message['Cc'] == 'cc@example.net'
+    assert message.get_payload(0).get_payload() == 'Hello Jane, you are jane@example.net'
+
+    message = email.message_from_bytes(message_to_bytes(builder.render({'name': 'John'})))
+    assert message['To'] == 'smtpc@example.net'
+    assert message.get_payload(0).get_payload() == 'Hello John, you are smtpc@example.net'
+
+
+@pytest.mark.parametrize('params', [{}, {'body_html': None}], ids=['alternative', 'plain'])
+def test_builder_stream_templates(params):
+    body = '<tr>{% for i in range(count) %}<td>{{ i }} {{ name }}</td>{% endfor %}</tr>'
+    params = dict(params, body=body, template_context={'name': 'John', 'count': 1000})
+    expected = email.message_from_bytes(message_to_bytes(create_builder(**params).execute()))
+
+    for rendered in [create_builder(**params, stream_templates=True).execute(),
+            create_builder(**params, stream_templates=True).render({'name': 'John', 'count': 1000})]:
+        assert isinstance(rendered, MultipartStream)
+        assert rendered.streamed
+        rendered = email.message_from_bytes(b''.join(rendered.chunks()))
+        assert rendered['Subject'] == expected['Subject'] == 'Report for John'
+        assert rendered.get_content_type() == expected.get_content_type()
+        assert [part.get_payload(decode=True) for part in rendered.walk() if not part.is_multipart()] == \
+            [part.get_payload(decode=True) for part in expected.walk() if not part.is_multipart()]
+
+
+def test_builder_stream_templates_attachments(tmp_path):
+    (tmp_path / 'report.csv').write_bytes(b'a,b\n1,2\n')
+    builder = create_builder(attachments=[str(tmp_path / 'report.csv')], body_html=None, stream_templates=True,
+        template_context={'name': 'John'})
+    message = email.message_from_bytes(message_to_bytes(builder.execute()))
+    assert message.get_payload(0).get_payload(decode=True) == b'Hello John, you are smtpc@example.net'
+    assert message.get_payload(0)['Content-Transfer-Encoding'] == 'base64'
+    assert message.get_payload(1).get_payload(decode=True) == b'a,b\n1,2\n'
+
+
+def test_builder_execute_cached(tmp_path, monkeypatch):
+    cache = DiskLRUCache(tmp_path, 1024 * 1024)
+    first = create_builder(template_context={'name': 'John'}).execute_cached(cache)
+    assert len(list(tmp_path.iterdir())) == 1
+
+    monkeypatch.setattr(Builder, '_build', lambda *args: pytest.fail('message built again'))
+    second = create_builder(template_context={'name': 'John'}).execute_cached(cache)
+    first, second = [email.message_from_bytes(message_to_bytes(item)) for item in (first, second)]
+    assert first['Message-ID'] != second['Message-ID']
+    assert second['Date']
+    assert second['Subject'] == 'Report for John'
+    assert normalize(message_to_bytes(first)) == normalize(message_to_bytes(second))
+    monkeypatch.undo()
+    expected = create_builder(template_context={'name': 'John'}).execute()
+    assert normalize(message_to_bytes(second)) == normalize(message_to_bytes(expected))
+
+
+@pytest.mark.parametrize('params', [
+    {'template_context': {'name': 'Jane'}},
+    {'template_fields': ['name=Jane']},
+    {'address_to': ['jane@example.net']},
+    {'headers': ['X-Campaign=other']},
+    {'body_html': None},
+])
+def test_builder_execute_cached_key(params):
+    assert create_builder(**params).cache_key() != create_builder().cache_key()
+
+
+def test_builder_execute_cached_attachments(tmp_path):
+    (tmp_path / 'report.csv').write_bytes(b'a,b\n')
+    create_builder(attachments=[str(tmp_path / 'report.csv')]).execute_cached(DiskLRUCache(tmp_path / 'cache', 1024 * 1024))
+    assert not (tmp_path / 'cache').exists()
+
+
+def test_builder_execute_cached_invalid_entry(tmp_path):
+    cache = DiskLRUCache(tmp_path, 1024 * 1024)
+    builder = create_builder(template_context={'name': 'John'})
+    cache.set(builder.cache_key(), b'invalid')
+    message = email.message_from_bytes(message_to_bytes(builder.execute_cached(cache)))
+    assert message['Subject'] == 'Report for John'
+    assert cache.get(builder.cache_key()) != b'invalid'
@@ -0,0 +1,235 @@
+import base64
+import email
+import email.charset
+from email.mime.multipart import MIMEMultipart
+
+import pytest
+
+from smtpc import mime
+from smtpc.enums import TransferEncoding
+from smtpc.errors import AttachmentError
+
+POLISH = 'Raport dzienny: wszystkie zadania zostały zakończone poprawnie, błędów nie stwierdzono.\n' * 20
+CYRILLIC = 'Съешь же ещё этих мягких французских булок, да выпей чаю.\n' * 20
+
+
+@pytest.mark.parametrize('text, allow_8bit, expected',
+    [
+        ['plain ascii text\n', True, TransferEncoding.SEVEN_BIT],
+        ['plain ascii text\n', False, TransferEncoding.SEVEN_BIT],
+        [POLISH, True, TransferEncoding.EIGHT_BIT],
+        [POLISH, False, TransferEncoding.QUOTED_PRINTABLE],
+        [CYRILLIC, False, TransferEncoding.BASE64],
+        ['x' * 1000 + '\n', True, TransferEncoding.QUOTED_PRINTABLE],
+        ['ż' * 1000 + '\n', True, TransferEncoding.BASE64],
+    ],
+    ids=[
+        'ascii',
+        'ascii without 8bit',
+        'polish',
+        'polish without 8bit',
+        'cyrillic without 8bit',
+        'too long ascii line',
+        'too long non-ascii line',
+    ]
+)
+def test_choose_encoding(text, allow_8bit, expected):
+    assert mime.choose_encoding(text.encode('utf-8'), allow_8bit) == expected
+
+
+@pytest.mark.parametrize('text', [POLISH, CYRILLIC, 'x' * 2000])
+def test_encoded_sizes_estimation(text):
+    data = text.encode('utf-8')
+    sizes = mime.encoded_sizes(data, allow_8bit=False)
+    for encoding, size in sizes.items():
+        charset = email.charset.Charset('utf-8')
+        charset.body_encoding = {
+            TransferEncoding.QUOTED_PRINTABLE: email.charset.QP,
+            TransferEncoding.BASE64: email.charset.BASE64,
+        }[encoding]
+        actual = len(charset.body_encode(text))
+        assert abs(size - actual) <= actual * 0.05, encoding
+
+
+@pytest.mark.parametrize('allow_8bit, expected_cte', [[True, '8bit'], [False, 'quoted-printable']])
+def test_text_part(allow_8bit, expected_cte):
+    part = mime.text_part(POLISH, 'plain', allow_8bit)
+    assert part['Content-Transfer-Encoding'] == expected_cte
+    assert part.get_content_charset() == 'utf-8'
+    assert part.get_payload(decode=True).decode('utf-8') == POLISH
+    assert mime.has_8bit(part) == allow_8bit
+
+
+def test_text_part_ascii():
+    part = mime.text_part('plain text', 'html')
+    assert part['Content-Transfer-Encoding'] == '7bit'
+    assert part.get_content_type() == 'text/html'
+    assert part.get_content_charset() == 'us-ascii'
+
+
+def test_downgrade_8bit():
+    message = MIMEMultipart('alternative')
+    message.attach(mime.text_part(POLISH, 'plain'))
+    message.attach(mime.text_part(CYRILLIC, 'html'))
+    message.attach(mime.text_part('ascii', 'plain'))
+
+    downgraded = mime.downgrade_8bit(message)
+    assert mime.has_8bit(message)
+    assert not mime.has_8bit(downgraded)
+    assert [part['Content-Transfer-Encoding'] for part in downgraded.get_payload()] == ['quoted-printable', 'base64', '7bit']
+    assert downgraded.get_payload(0).get_payload(decode=True).decode('utf-8') == POLISH
+    assert downgraded.get_payload(1).get_payload(decode=True).decode('utf-8') == CYRILLIC
+    assert downgraded.as_bytes().isascii()
+
+
+def build_with_attachments(tmp_path, files):
+    paths = []
+    for name, content in files.items():
+        path = tmp_path / name
+        path.write_bytes(content)
+        paths.append(str(path))
+
+    message = MIMEMultipart('mixed')
+    message['Subject'] = 'attachments'
+    message.attach(mime.text_part('see attachments', 'plain'))
+    return mime.attach_files(message, paths)
+
+
+def test_attach_files(tmp_path):
+    files = {
+        'report.csv': b'id,name\n1,' + 'żółw'.encode('utf-8') + b'\n' * 100000,
+        'empty.bin': b'',
+        'dump.sql.gz': bytes(range(256)) * 1000,
+    }
+    stream = build_with_attachments(tmp_path, files)
+
+    data = b''.join(stream.chunks())
+    assert len(data) == stream.size
+    assert all(len(line) <= 76 for line in data.split(b'\r\n\r\n', 1)[1].split(b'\r\n'))
+    assert b'\n' not in data.replace(b'\r\n', b'')
+
+    message = email.message_from_bytes(data)
+    assert message['Subject'] == 'attachments'
+    parts = message.get_payload()
+    assert parts[0].get_payload() == 'see attachments'
+    assert [part.get_filename() for part in parts[1:]] == list(files)
+    assert [part.get_content_type() for part in parts[1:]] == ['text/csv', 'application/octet-stream', 'application/octet-stream']
+    assert [part.get_payload(decode=True) for part in parts[1:]] == list(files.values())
+
+
+def test_attach_files_streamed(tmp_path):
+    stream = build_with_attachments(tmp_path, {'big.bin': b'x' * 10 * 1024 * 1024})
+    assert max(len(chunk) for chunk in stream.chunks()) < 100 * 1024
+
+
+def test_attach_files_missing(tmp_path):
+    with pytest.raises(AttachmentError):
+        mime.attach_files(MIMEMultipart('mixed'), [str(tmp_path / 'missing.txt')])
+
+
+def test_attach_files_downgrade_8bit(tmp_path):
+    message = MIMEMultipart('mixed')
+    message.attach(mime.text_part(POLISH, 'plain'))
+    (tmp_path / 'file.txt').write_bytes(b'content')
+    stream = mime.attach_files(message, [str(tmp_path / 'file.txt')])
+    assert mime.has_8bit(stream)
+
+    downgraded = mime.downgrade_8bit(stream)
+    assert not mime.has_8bit(downgraded)
+    assert b''.join(downgraded.chunks()).isascii()
+    assert email.message_from_bytes(b''.join(downgraded.chunks())).get_payload(1).get_payload(decode=True) == b'content'
+
+
+def test_freeze(tmp_path):
+    message = MIMEMultipart('mixed')
+    message.attach(mime.text_part(POLISH, 'plain'))
+    (tmp_path / 'file.txt').write_bytes(b'content')
+    stream = mime.attach_files(message, [str(tmp_path / 'file.txt')])
+
+    frozen = mime.freeze(stream)
+    assert isinstance(frozen.message, bytes)
+    assert b''.join(frozen.chunks()) == b''.join(stream.chunks())
+    # downgraded once, for all transactions
+    assert mime.downgrade_8bit(frozen) is mime.downgrade_8bit(frozen)
+    assert isinstance(mime.downgrade_8bit(frozen).message, bytes)
+    assert b''.join(mime.downgrade_8bit(frozen).chunks()).isascii()
+
+    assert mime.freeze(MIMEMultipart('alternative'))._downgraded is None
+
+
+def test_text_part_cached():
+    mime.ENCODED_PARTS.clear()
+    first = mime.text_part(POLISH * 10, 'html')
+    second = mime.text_part(POLISH * 10, 'html')
+    assert len(mime.ENCODED_PARTS) == 1
+    assert first is not second
+    assert first.as_bytes() == second.as_bytes()
+
+    # modifying one message does not affect others
+    first['X-Test'] = 'test'
+    assert 'X-Test' not in mime.text_part(POLISH * 10, 'html')
+    assert mime.text_part(POLISH * 10, 'plain')['Content-Type'] == 'text/plain; charset="utf-8"'
+
+
+def test_attachments_encoded_once(tmp_path, monkeypatch):
+    mime.ENCODED_PARTS.clear()
+    calls = []
+    monkeypatch.setattr(mime, '_encode_base64', lambda data: calls.append(data) or base64.encodebytes(data)[:-1].replace(b'\n', b'\r\n'))
+
+    (tmp_path / 'copy').mkdir()
+    content = bytes(range(256)) * 100
+    (tmp_path / 'report.pdf').write_bytes(content)
+    (tmp_path / 'copy' / 'report.pdf').write_bytes(content)
+
+    for path in [tmp_path / 'report.pdf', tmp_path / 'report.pdf', tmp_path / 'copy' / 'report.pdf']:
+        stream = mime.attach_files(MIMEMultipart('mixed'), [str(path)])
+        message = email.message_from_bytes(b''.join(stream.chunks()))
+        assert message.get_payload(0).get_payload(decode=True) == content
+    assert len(calls) == 1
+
+    (tmp_path / 'report.pdf').write_bytes(b'changed')
+    stream = mime.attach_files(MIMEMultipart('mixed'), [str(tmp_path / 'report.pdf')])
+    assert email.message_from_bytes(b''.join(stream.chunks())).get_payload(0).get_payload(decode=True) == b'changed'
+    assert len(calls) == 2
+
+
+def test_attachments_big_file_not_cached(tmp_path, monkeypatch):
+    mime.ENCODED_PARTS.clear()
+    monkeypatch.setattr(mime, 'MAX_CACHED_FILE_SIZE', 1024)
+    (tmp_path / 'big.bin').write_bytes(b'x' * 2048)
+
+    stream = mime.attach_files(MIMEMultipart('mixed'), [str(tmp_path / 'big.bin')])
+    message = email.message_from_bytes(b''.join(stream.chunks()))
+    assert message.get_payload(0).get_payload(decode=True) == b'x' * 2048
+    assert len(mime.ENCODED_PARTS) == 0
+
+
+@pytest.mark.parametrize('sizes', [[], [0], [10], [57 * 4], [1, 56, 200, 3, 1000]])
+def test_encode_base64_chunks(monkeypatch, sizes):
+    monkeypatch.setattr(mime, '_BASE64_CHUNK_SIZE', 57 * 2)
+    chunks = [bytes(i % 256 for i in range(size)) for size in sizes]
+    assert b''.join(mime._encode_base64_chunks(chunks)) == mime._encode_base64(b''.join(chunks))
+
+
+def test_generated_content(monkeypatch):
+    monkeypatch.setattr(mime, '_BASE64_CHUNK_SIZE', 57 * 2)
+    calls = []
+
+    def generate():
+        calls.append(1)
+        yield from ['<p>zażółć</p>\n'] * 100
+
+    message = MIMEMultipart('mixed')
+    message.attach(mime.generated_text_part('html'))
+    stream = mime.MultipartStream(message, {message.get_payload(0).get_payload(): mime.GeneratedContent(generate)})
+    assert stream.streamed
+    assert stream.size is None
+
+    for _ in range(2):
+        received = email.message_from_bytes(b''.join(stream.chunks()))
+        part = received.get_payload(0)
+        assert part.get_content_type() == 'text/html'
+        assert part['Content-Transfer-Encoding'] == 'base64'
+        assert part.get_payload(decode=True).decode(part.get_content_charset()) == '<p>zażółć</p>\n' * 100
+        assert all(len(line) <= 76 for line in part.get_payload().splitlines())
+    assert len(calls) == 2
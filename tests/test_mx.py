@@ -0,0 +1,84 @@
+from unittest import mock
+
+import pytest
+
+from smtpc import mx
+from smtpc.errors import MXLookupError
+
+
+class CountingResolver(mx.AbstractMXResolver):
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lookups = []
+
+    def lookup(self, domain):
+        self.lookups.append(domain)
+        return [f'mx.{domain}'], self.ttl
+
+
+def test_group_by_domain():
+    addresses = ['a@smtpc.net', 'John <b@Example.com>', 'c@smtpc.net', 'd@example.com']
+    assert mx.group_by_domain(addresses) == {
+        'smtpc.net': ['a@smtpc.net', 'c@smtpc.net'],
+        'example.com': ['John <b@Example.com>', 'd@example.com'],
+    }
+
+
+def test_static_resolver():
+    resolver = mx.StaticMXResolver({'SMTPC.net': ['mx1.smtpc.net', 'mx2.smtpc.net']})
+    assert resolver.lookup('smtpc.net') == (['mx1.smtpc.net', 'mx2.smtpc.net'], 300.0)
+    assert resolver.lookup('example.com') == (['example.com'], 300.0)
+
+    resolver = mx.StaticMXResolver({}, default=['127.0.0.1'])
+    assert resolver.lookup('example.com') == (['127.0.0.1'], 300.0)
+
+
+def test_mx_cache_respects_ttl():
+    resolver = CountingResolver(ttl=120)
+    cache = mx.MXCache(resolver)
+
+    with mock.patch('time.monotonic', return_value=1000.0):
+        assert cache.resolve('smtpc.net') == ['mx.smtpc.net']
+        assert cache.resolve('SMTPC.net') == ['mx.smtpc.net']
+    assert resolver.lookups == ['smtpc.net']
+
+    with mock.patch('time.monotonic', return_value=1121.0):
+        cache.resolve('smtpc.net')
+    assert resolver.lookups == ['smtpc.net', 'smtpc.net']
+
+
+@pytest.mark.parametrize('ttl, second_lookup_at, expected_lookups',
+    [
+        [1, 1030.0, 1],
+        [100000, 1601.0, 2],
+    ],
+    ids=[
+        'ttl below min_ttl',
+        'ttl above max_ttl',
+    ]
+)
+def test_mx_cache_clamps_ttl(ttl, second_lookup_at, expected_lookups):
+    resolver = CountingResolver(ttl=ttl)
+    cache = mx.MXCache(resolver, min_ttl=60, max_ttl=600)
+
+    with mock.patch('time.monotonic', return_value=1000.0):
+        cache.resolve('smtpc.net')
+    with mock.patch('time.monotonic', return_value=second_lookup_at):
+        cache.resolve('smtpc.net')
+    assert len(resolver.lookups) == expected_lookups
+
+
+def test_mx_cache_doesnt_cache_errors():
+    resolver = mock.Mock(spec=mx.AbstractMXResolver)
+    resolver.lookup.side_effect = [MXLookupError('temporary failure'), (['mx.smtpc.net'], 300)]
+    cache = mx.MXCache(resolver)
+
+    with pytest.raises(MXLookupError):
+        cache.resolve('smtpc.net')
+    assert cache.resolve('smtpc.net') == ['mx.smtpc.net']
+
+
+def test_dns_resolver_without_dnspython():
+    with mock.patch.object(mx, 'dns', None):
+        with pytest.raises(MXLookupError, match='dnspython'):
+            mx.DnsMXResolver()
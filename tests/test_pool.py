@@ -0,0 +1,98 @@
+import smtplib
+import time
+from unittest import mock
+
+import pytest
+
+from smtpc.errors import PoolTimeoutError
+from smtpc.pool import ConnectionPool
+
+KEY = ('smtpc.net', 25, False, False, None, None, None)
+OTHER_KEY = ('smtpc.net', 587, False, True, 'login', None, None)
+
+
+def smtp_factory():
+    smtp = mock.create_autospec(smtplib.SMTP, instance=True)
+    smtp.noop.return_value = (250, b'OK')
+    return smtp
+
+
+def test_pool_reuses_connection():
+    pool = ConnectionPool()
+    conn = pool.checkout(KEY, smtp_factory)
+    smtp = conn.smtp
+    pool.checkin(conn)
+
+    conn = pool.checkout(KEY, smtp_factory)
+    assert conn.smtp is smtp
+    smtp.noop.assert_called_once()
+    pool.checkin(conn)
+
+    pool.close()
+    smtp.quit.assert_called_once()
+
+
+def test_pool_separates_keys():
+    pool = ConnectionPool()
+    conn1 = pool.checkout(KEY, smtp_factory)
+    conn2 = pool.checkout(OTHER_KEY, smtp_factory)
+    assert conn1.smtp is not conn2.smtp
+
+
+def test_pool_recycles_after_max_messages():
+    pool = ConnectionPool(max_messages=2)
+    conn = pool.checkout(KEY, smtp_factory)
+    smtp = conn.smtp
+    conn.mark_used()
+    assert not pool.is_exhausted(conn)
+    conn.mark_used()
+    assert pool.is_exhausted(conn)
+    pool.checkin(conn)
+    smtp.quit.assert_called_once()
+
+    conn = pool.checkout(KEY, smtp_factory)
+    assert conn.smtp is not smtp
+
+
+def test_pool_evicts_idle_connections():
+    pool = ConnectionPool(idle_timeout=10)
+    conn = pool.checkout(KEY, smtp_factory)
+    smtp = conn.smtp
+    pool.checkin(conn)
+
+    with mock.patch('time.monotonic', return_value=time.monotonic() + 11):
+        conn = pool.checkout(KEY, smtp_factory)
+    assert conn.smtp is not smtp
+    smtp.quit.assert_called_once()
+    smtp.noop.assert_not_called()
+
+
+def test_pool_drops_dead_connection():
+    pool = ConnectionPool()
+    conn = pool.checkout(KEY, smtp_factory)
+    smtp = conn.smtp
+    smtp.noop.side_effect = smtplib.SMTPServerDisconnected()
+    smtp.quit.side_effect = smtplib.SMTPServerDisconnected()
+    pool.checkin(conn)
+
+    conn = pool.checkout(KEY, smtp_factory)
+    assert conn.smtp is not smtp
+    smtp.close.assert_called_once()
+
+
+def test_pool_max_size():
+    pool = ConnectionPool(max_size=1)
+    conn = pool.checkout(KEY, smtp_factory)
+    with pytest.raises(PoolTimeoutError):
+        pool.checkout(KEY, smtp_factory, timeout=0.01)
+
+    pool.checkin(conn)
+    assert pool.checkout(KEY, smtp_factory, timeout=0.01) is conn
+
+
+def test_pool_factory_error_frees_slot():
+    pool = ConnectionPool(max_size=1)
+    with pytest.raises(ConnectionError):
+        pool.checkout(KEY, mock.Mock(side_effect=ConnectionError))
+
+    assert pool.checkout(KEY, smtp_factory, timeout=0.01)
@@ -0,0 +1,86 @@
+import datetime
+import json
+import threading
+
+import pytest
+
+from smtpc import ratelimit
+from smtpc.errors import RateLimitError
+from smtpc.ratelimit import RateLimiter
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock(datetime.datetime(2021, 6, 1, 12).timestamp())
+    monkeypatch.setattr(ratelimit.time, 'time', clock.time)
+    monkeypatch.setattr(ratelimit.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_rate_limiter_smooths_sends(tmp_path, clock):
+    limiter = RateLimiter(tmp_path / 'ratelimit' / 'profile.json', rate=2)
+
+    waited = [limiter.acquire() for _ in range(4)]
+    assert waited == [0, 0.5, 0.5, 0.5]
+    assert (tmp_path / 'ratelimit' / 'profile.json').stat().st_mode & 0o777 == 0o600
+
+
+def test_rate_limiter_burst(tmp_path, clock):
+    limiter = RateLimiter(tmp_path / 'profile.json', rate=1, burst=3)
+
+    assert [limiter.acquire() for _ in range(4)] == [0, 0, 0, 1]
+
+    # bucket is refilled, but never above burst size
+    clock.now += 60
+    assert [limiter.acquire() for _ in range(4)] == [0, 0, 0, 1]
+
+
+def test_rate_limiter_shared_state(tmp_path, clock):
+    first = RateLimiter(tmp_path / 'profile.json', rate=1)
+    second = RateLimiter(tmp_path / 'profile.json', rate=1)
+
+    assert first.acquire() == 0
+    assert second.acquire() == 1
+    assert json.loads((tmp_path / 'profile.json').read_text())['sent'] == 2
+
+
+def test_rate_limiter_daily_quota(tmp_path, clock):
+    limiter = RateLimiter(tmp_path / 'profile.json', daily_quota=2)
+    limiter.acquire()
+    limiter.acquire()
+    with pytest.raises(RateLimitError):
+        limiter.acquire()
+
+    clock.now += 24 * 3600
+    assert limiter.acquire() == 0
+
+
+def test_rate_limiter_invalid_state(tmp_path, clock):
+    (tmp_path / 'profile.json').write_text('{invalid')
+    limiter = RateLimiter(tmp_path / 'profile.json', rate=1)
+    assert limiter.acquire() == 0
+
+
+def test_rate_limiter_threads(tmp_path):
+    limiter = RateLimiter(tmp_path / 'profile.json', daily_quota=1000)
+
+    threads = [threading.Thread(target=lambda: [limiter.acquire() for _ in range(25)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert json.loads((tmp_path / 'profile.json').read_text())['sent'] == 100
@@ -0,0 +1,351 @@
+import email
+import smtplib
+
+import pytest
+
+from smtpc import config
+from smtpc import message
+from smtpc import mx
+from smtpc.enums import DeliveryMode
+from smtpc.errors import ConnectionFailedError, RateLimitError
+from smtpc.message import Builder, Sender
+from smtpc.predefined_profiles import PredefinedProfile
+from smtpc.stream import FileMessageStream
+from .smtpserver import FakeSMTPServer, sender_params, tls_server_context
+
+
+def create_sender(server, **kwargs):
+    return Sender(**sender_params(server, **kwargs))
+
+
+def test_sender_pipelining(smtp_server):
+    sender = create_sender(smtp_server, address_to=['receiver1@smtpc.net', 'reject@smtpc.net', 'receiver2@smtpc.net'])
+    receivers = sender.execute()
+
+    assert receivers == ['receiver1@smtpc.net', 'receiver2@smtpc.net']
+    assert len(smtp_server.messages) == 1
+    assert smtp_server.messages[0].rcpt_to == ['receiver1@smtpc.net', 'receiver2@smtpc.net']
+    assert smtp_server.messages[0].data == b'Subject: test\r\n\r\nsome body\r\n.starts with dot\r\n'
+
+    envelope_reads = smtp_server.reads_containing(b'mail FROM')
+    assert len(envelope_reads) == 1
+    assert envelope_reads[0].count(b'rcpt TO') == 3
+
+
+def test_sender_pipelining_all_recipients_refused(smtp_server):
+    sender = create_sender(smtp_server)
+    smtp = sender.connect()
+    with pytest.raises(smtplib.SMTPRecipientsRefused) as exc:
+        sender.send(smtp, 'Subject: test\n\nbody', 'sender@smtpc.net', ['reject1@smtpc.net', 'reject2@smtpc.net'])
+    assert set(exc.value.recipients) == {'reject1@smtpc.net', 'reject2@smtpc.net'}
+    assert smtp_server.commands[-1] == 'rset'
+    smtp.quit()
+
+
+def test_sender_pipelining_sender_refused(smtp_server):
+    sender = create_sender(smtp_server)
+    smtp = sender.connect()
+    with pytest.raises(smtplib.SMTPSenderRefused):
+        sender.send(smtp, 'Subject: test\n\nbody', 'reject@smtpc.net', ['receiver@smtpc.net'])
+    assert not smtp_server.messages
+    smtp.quit()
+
+
+def test_sender_without_pipelining():
+    server = FakeSMTPServer(extensions=()).start()
+    try:
+        sender = create_sender(server, address_to=['receiver1@smtpc.net', 'receiver2@smtpc.net'])
+        assert sender.execute() == ['receiver1@smtpc.net', 'receiver2@smtpc.net']
+        assert len(server.reads_containing(b'rcpt TO')) == 2
+    finally:
+        server.stop()
+
+
+def test_sender_execute_many_concurrency(smtp_server):
+    sender = create_sender(smtp_server)
+    messages = [(f'Subject: test {i}\n\nbody', 'sender@smtpc.net', [f'receiver{i}@smtpc.net']) for i in range(10)]
+    messages[3] = ('Subject: test 3\n\nbody', 'sender@smtpc.net', ['reject@smtpc.net'])
+
+    results = list(sender.execute_many(messages, concurrency=3))
+
+    assert [result.recipients for result in results] == [item[2] for item in messages]
+    assert [result.ok for result in results] == [i != 3 for i in range(10)]
+    assert isinstance(results[3].error, smtplib.SMTPRecipientsRefused)
+    assert len(smtp_server.messages) == 9
+    assert smtp_server.sessions <= 3
+
+
+def test_sender_execute_many_reconnect(smtp_server):
+    smtp_server.drop_on_data = 1
+    sender = create_sender(smtp_server)
+    messages = [(f'Subject: test {i}\n\nbody', 'sender@smtpc.net', [f'receiver{i}@smtpc.net']) for i in range(3)]
+
+    results = list(sender.execute_many(messages, reconnect_attempts=1))
+
+    assert all(result.ok for result in results)
+    assert [message.rcpt_to for message in smtp_server.messages] == [item[2] for item in messages]
+    assert smtp_server.sessions == 2
+
+
+def test_sender_execute_many_reconnect_exhausted(smtp_server):
+    smtp_server.drop_on_data = 2
+    sender = create_sender(smtp_server)
+    messages = [('Subject: test\n\nbody', 'sender@smtpc.net', ['receiver@smtpc.net'])]
+
+    with pytest.raises(smtplib.SMTPServerDisconnected):
+        list(sender.execute_many(messages, reconnect_attempts=1))
+    assert smtp_server.sessions == 2
+    assert not smtp_server.messages
+
+
+def test_sender_execute_many_service_closing(smtp_server):
+    sender = create_sender(smtp_server)
+    messages = [
+        ('Subject: test 0\n\nbody', 'sender@smtpc.net', ['shutdown@smtpc.net']),
+        ('Subject: test 1\n\nbody', 'sender@smtpc.net', ['receiver1@smtpc.net']),
+    ]
+
+    results = list(sender.execute_many(messages))
+
+    assert isinstance(results[0].error, smtplib.SMTPRecipientsRefused)
+    assert results[1].ok
+    assert [message.rcpt_to for message in smtp_server.messages] == [['receiver1@smtpc.net']]
+    assert smtp_server.sessions == 2
+
+
+def test_sender_execute_many_concurrency_connection_error():
+    sender = create_sender(None)
+    messages = [('Subject: test\n\nbody', 'sender@smtpc.net', [f'receiver{i}@smtpc.net']) for i in range(5)]
+
+    with pytest.raises(ConnectionFailedError):
+        list(sender.execute_many(messages, concurrency=2))
+
+
+def test_sender_mx_delivery(smtp_server):
+    resolver = mx.MXCache(mx.StaticMXResolver({
+        'a.smtpc.net': ['127.0.0.1'],
+        # first MX is down, next one should be used
+        'b.smtpc.net': ['127.0.0.2', 'localhost'],
+    }))
+    sender = create_sender(smtp_server, delivery=DeliveryMode.MX, mx_resolver=resolver,
+        address_to=['receiver1@a.smtpc.net', 'receiver1@b.smtpc.net', 'receiver2@a.smtpc.net'])
+
+    assert sender.execute() == ['receiver1@a.smtpc.net', 'receiver2@a.smtpc.net', 'receiver1@b.smtpc.net']
+    assert [message.rcpt_to for message in smtp_server.messages] == [
+        ['receiver1@a.smtpc.net', 'receiver2@a.smtpc.net'],
+        ['receiver1@b.smtpc.net'],
+    ]
+
+
+def test_sender_mx_delivery_domain_failed(smtp_server):
+    resolver = mx.MXCache(mx.StaticMXResolver({'a.smtpc.net': ['127.0.0.1'], 'b.smtpc.net': ['127.0.0.2']}))
+    sender = create_sender(smtp_server, delivery=DeliveryMode.MX, mx_resolver=resolver)
+    messages = [
+        ('Subject: test\n\nbody', 'sender@smtpc.net', ['receiver@a.smtpc.net', 'receiver@b.smtpc.net']),
+        ('Subject: test\n\nbody', 'sender@smtpc.net', ['receiver@b.smtpc.net']),
+        ('Subject: test\n\nbody', 'sender@smtpc.net', ['receiver@a.smtpc.net']),
+    ]
+
+    first, second, third = sender.execute_many(messages)
+
+    assert first.ok and first.recipients == ['receiver@a.smtpc.net']
+    assert not second.ok and isinstance(second.error, ConnectionFailedError)
+    assert third.ok
+    assert smtp_server.sessions == 1
+
+
+def test_sender_mx_delivery_tls_failed(tmp_path):
+    pytest.importorskip('cryptography')
+    server = FakeSMTPServer(extensions=('PIPELINING', 'STARTTLS'), tls_context=tls_server_context(tmp_path)).start()
+    # the first MX host refuses STARTTLS, the next one should be used
+    broken = FakeSMTPServer(extensions=('PIPELINING', 'STARTTLS'), address=('127.0.0.2', server.port)).start()
+    try:
+        resolver = mx.MXCache(mx.StaticMXResolver({'a.smtpc.net': ['127.0.0.2', '127.0.0.1']}))
+        sender = create_sender(server, tls=True, delivery=DeliveryMode.MX, mx_resolver=resolver,
+            address_to=['receiver@a.smtpc.net'])
+
+        assert sender.execute() == ['receiver@a.smtpc.net']
+        assert 'STARTTLS' in broken.commands and not broken.messages
+        assert [message.rcpt_to for message in server.messages] == [['receiver@a.smtpc.net']]
+    finally:
+        broken.stop()
+        server.stop()
+
+
+def test_sender_rate_limit_daily_quota(smtp_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'RATE_LIMIT_DIR', tmp_path)
+    sender = create_sender(smtp_server, predefined_profile=PredefinedProfile('limited', rate_limit_daily=2))
+
+    messages = [('Subject: test\n\nbody', 'sender@smtpc.net', ['receiver@smtpc.net'])] * 3
+    results = sender.execute_many(messages)
+    assert next(results).ok
+    assert next(results).ok
+    with pytest.raises(RateLimitError):
+        next(results)
+    assert len(smtp_server.messages) == 2
+    assert (tmp_path / 'limited.json').exists()
+
+
+@pytest.mark.parametrize('extensions', [('PIPELINING', 'SIZE'), ()], ids=['pipelining', 'no pipelining'])
+def test_sender_message_stream(tmp_path, extensions):
+    path = tmp_path / 'message.eml'
+    path.write_bytes(b'Subject: test\n\n.starts with dot\n' + b'x' * 100000 + b'\n')
+
+    server = FakeSMTPServer(extensions=extensions).start()
+    try:
+        sender = create_sender(server, message_body=FileMessageStream(str(path), chunk_size=4096),
+            address_to=['receiver1@smtpc.net', 'reject@smtpc.net'])
+        assert sender.execute() == ['receiver1@smtpc.net']
+        assert server.messages[0].data == path.read_bytes().replace(b'\n', b'\r\n')
+        # SIZE is declared for the message with CRLF line endings, as it's received
+        assert server.messages[0].mail_options == ([f'size={len(server.messages[0].data)}'] if extensions else [])
+    finally:
+        server.stop()
+
+
+@pytest.mark.parametrize('extensions', [('PIPELINING', 'CHUNKING'), ('CHUNKING', )], ids=['pipelining', 'no pipelining'])
+def test_sender_bdat(extensions):
+    server = FakeSMTPServer(extensions=extensions).start()
+    try:
+        sender = create_sender(server, message_body='Subject: test\n\n.starts with dot\n' + 'x' * 150000 + '\n')
+        assert sender.execute() == ['receiver@smtpc.net']
+        assert server.messages[0].data == b'Subject: test\r\n\r\n.starts with dot\r\n' + b'x' * 150000 + b'\r\n'
+        assert server.bdat_sizes == [65536, 65536, 18965]
+        assert 'DATA' not in [command.upper() for command in server.commands]
+    finally:
+        server.stop()
+
+
+def test_sender_bdat_pending_replies(monkeypatch):
+    monkeypatch.setattr(message, 'BDAT_MAX_PENDING', 2)
+    events = []
+    smtp_send, smtp_getreply = smtplib.SMTP.send, smtplib.SMTP.getreply
+    monkeypatch.setattr(smtplib.SMTP, 'send', lambda self, data: events.append('send') or smtp_send(self, data))
+    monkeypatch.setattr(smtplib.SMTP, 'getreply', lambda self: events.append('reply') or smtp_getreply(self))
+
+    server = FakeSMTPServer(extensions=('PIPELINING', 'CHUNKING')).start()
+    try:
+        sender = create_sender(server, message_body='Subject: test\n\n' + 'x' * 300000 + '\n')
+        assert sender.execute() == ['receiver@smtpc.net']
+        assert len(server.bdat_sizes) == 5
+    finally:
+        server.stop()
+
+    bdat_events = ''.join(event[0] for event in events).split('srr', 1)[1]  # after pipelined MAIL and RCPT
+    assert bdat_events.startswith('ssrrssrrsr')
+
+
+def test_sender_bdat_message_stream(tmp_path):
+    path = tmp_path / 'message.eml'
+    path.write_bytes(b'Subject: test\n\n.starts with dot\n' + b'x' * 10000)
+
+    server = FakeSMTPServer(extensions=('PIPELINING', 'CHUNKING')).start()
+    try:
+        sender = create_sender(server, message_body=FileMessageStream(str(path), chunk_size=4096))
+        assert sender.execute() == ['receiver@smtpc.net']
+        assert server.messages[0].data == path.read_bytes().replace(b'\n', b'\r\n')
+        assert len(server.bdat_sizes) == 3
+    finally:
+        server.stop()
+
+
+def test_sender_bdat_empty_message():
+    server = FakeSMTPServer(extensions=('CHUNKING', )).start()
+    try:
+        sender = create_sender(server, message_body='')
+        assert sender.execute() == ['receiver@smtpc.net']
+        assert server.bdat_sizes == [0]
+    finally:
+        server.stop()
+
+
+def polish_message():
+    return Builder(subject='Raport', envelope_from=None, address_from='sender@smtpc.net', envelope_to=None,
+        address_to=['receiver@smtpc.net'], address_cc=None, address_bcc=None, reply_to=None, body_type=None,
+        body='Wszystkie zadania zostały zakończone poprawnie.\n').execute()
+
+
+def test_sender_8bitmime(smtp_server):
+    sender = create_sender(smtp_server, message_body=polish_message())
+    assert sender.execute() == ['receiver@smtpc.net']
+
+    received = smtp_server.messages[0]
+    assert received.mail_options == ['BODY=8BITMIME']
+    assert b'Content-Transfer-Encoding: 8bit' in received.data
+    assert 'zakończone'.encode('utf-8') in received.data
+
+
+def test_sender_8bit_downgrade():
+    server = FakeSMTPServer(extensions=('PIPELINING', )).start()
+    try:
+        message_body = polish_message()
+        sender = create_sender(server, message_body=message_body)
+        assert sender.execute() == ['receiver@smtpc.net']
+
+        received = server.messages[0]
+        assert received.mail_options == []
+        assert received.data.isascii()
+        assert b'Content-Transfer-Encoding: quoted-printable' in received.data
+        assert email.message_from_bytes(received.data).get_payload(decode=True).decode('utf-8') == \
+            'Wszystkie zadania zostały zakończone poprawnie.\r\n'
+        # message itself is not modified, it can be sent to other servers too
+        assert message_body['Content-Transfer-Encoding'] == '8bit'
+    finally:
+        server.stop()
+
+
+@pytest.mark.parametrize('message_body', [
+    'Subject: raport\n\nWszystkie zadania zostały zakończone.\n',
+    'Subject: raport\nContent-Type: text/plain; charset="utf-8"\nContent-Transfer-Encoding: 8bit\n\n'
+    'Wszystkie zadania zostały zakończone.\n',
+], ids=['raw', '8bit'])
+def test_sender_non_ascii_raw_body_without_8bitmime(message_body):
+    server = FakeSMTPServer(extensions=()).start()
+    try:
+        sender = create_sender(server, message_body=message_body)
+        assert sender.execute() == ['receiver@smtpc.net']
+
+        received = email.message_from_bytes(server.messages[0].data)
+        assert received['Subject'] == 'raport'
+        assert received.get_payload(decode=True).decode('utf-8').strip() == 'Wszystkie zadania zostały zakończone.'
+        if 'Content-Transfer-Encoding' in message_body:
+            assert server.messages[0].data.isascii()
+    finally:
+        server.stop()
+
+
+def test_sender_smtputf8():
+    server = FakeSMTPServer(extensions=('PIPELINING', '8BITMIME', 'SMTPUTF8')).start()
+    try:
+        sender = create_sender(server, address_to=['odbiorca@żółw.pl'])
+        assert sender.execute() == ['odbiorca@żółw.pl']
+        assert server.messages[0].mail_options == ['SMTPUTF8']
+        assert server.messages[0].rcpt_to == ['odbiorca@żółw.pl']
+    finally:
+        server.stop()
+
+
+@pytest.mark.parametrize('extensions', [('PIPELINING', '8BITMIME', 'SIZE'), ('CHUNKING', )], ids=['data', 'bdat'])
+def test_sender_attachments(tmp_path, extensions):
+    path = tmp_path / 'backup.tar.gz'
+    path.write_bytes(bytes(range(256)) * 2000)
+    message_body = Builder(subject='Backup', envelope_from=None, address_from='sender@smtpc.net', envelope_to=None,
+        address_to=['receiver@smtpc.net'], address_cc=None, address_bcc=None, reply_to=None, body_type=None,
+        body='Backup zakończony.\n', attachments=[str(path)]).execute()
+
+    server = FakeSMTPServer(extensions=extensions).start()
+    try:
+        sender = create_sender(server, message_body=message_body)
+        assert sender.execute() == ['receiver@smtpc.net']
+
+        received = email.message_from_bytes(server.messages[0].data)
+        assert received['Subject'] == 'Backup'
+        assert received.get_payload(0).get_payload(decode=True).decode('utf-8').strip() == 'Backup zakończony.'
+        assert received.get_payload(1).get_filename() == 'backup.tar.gz'
+        assert received.get_payload(1).get_payload(decode=True) == path.read_bytes()
+        if 'SIZE' in extensions:
+            assert server.messages[0].mail_options == ['BODY=8BITMIME', f'size={len(server.messages[0].data)}']
+        else:
+            assert server.messages[0].data.isascii()
+    finally:
+        server.stop()
@@ -0,0 +1,195 @@
+import json
+import os
+import socket
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from smtpc import config
+from smtpc.errors import SMTPcError
+from smtpc.pool import ConnectionPool
+from smtpc.predefined_messages import PredefinedMessages, PredefinedMessage
+from smtpc.predefined_profiles import PredefinedProfiles, PredefinedProfile
+from smtpc.service import SendServer, SendService, handle_stream, send_request
+
+
+@pytest.fixture
+def smtpc_config(tmp_path, monkeypatch):
+    monkeypatch.setenv(config.ENV_SMTPC_CONFIG_DIR, str(tmp_path))
+    config._generate_paths()
+    config.ensure_config_files()
+    yield tmp_path
+    monkeypatch.delenv(config.ENV_SMTPC_CONFIG_DIR)
+    config._generate_paths()
+
+
+@pytest.fixture
+def send_service(smtpc_config, smtp_server):
+    PredefinedProfiles().add(PredefinedProfile('fake', host=smtp_server.host, port=smtp_server.port))
+    PredefinedMessages().add(PredefinedMessage('hello', address_from='sender@smtpc.net', subject='Hello {{ name }}',
+        body='Hi {{ name }}!', profile='fake'))
+
+    pool = ConnectionPool(max_size=2)
+    service = SendService(pool=pool)
+    yield service
+    pool.close()
+
+
+@pytest.fixture
+def send_server(smtpc_config, send_service):
+    server = SendServer(smtpc_config / 'smtpc.sock', send_service)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05, ), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_service_send(send_server, smtp_server, smtpc_config):
+    for name in ('John', 'Jane'):
+        response = send_request(smtpc_config / 'smtpc.sock',
+            {'message': 'hello', 'address_to': [f'{name.lower()}@smtpc.net'], 'context': {'name': name}})
+        assert response == {'ok': True, 'recipients': [f'{name.lower()}@smtpc.net'], 'rejects': {}}
+
+    assert len(smtp_server.messages) == 2
+    assert b'Subject: Hello Jane' in smtp_server.messages[1].data
+    assert b'Hi Jane!' in smtp_server.messages[1].data
+    assert smtp_server.sessions == 1
+
+
+def test_service_socket_in_use(send_server, send_service, smtpc_config):
+    with pytest.raises(SMTPcError, match='Another smtpc daemon is already listening'):
+        SendServer(smtpc_config / 'smtpc.sock', send_service)
+
+    response = send_request(smtpc_config / 'smtpc.sock', {'message': 'hello', 'address_to': ['john@smtpc.net']})
+    assert response['ok'] is True
+
+
+def test_service_stale_socket(send_service, smtpc_config):
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(smtpc_config / 'smtpc.sock'))
+    stale.close()
+
+    server = SendServer(smtpc_config / 'smtpc.sock', send_service)
+    server.server_close()
+
+
+@pytest.mark.parametrize('request_data, expected_error',
+    [
+        [{'message': 'unknown'}, 'Unknown message: unknown'],
+        [{'profile': 'fake', 'address_from': 'sender@smtpc.net'}, 'Any sender and receiver required'],
+        [{'message': 'hello', 'address_to': ['reject@smtpc.net']}, 'reject@smtpc.net'],
+        [{'message': 'hello', 'host': 'smtp.smtpc.net'}, 'Unknown fields in request: host'],
+    ],
+    ids=[
+        'unknown message',
+        'no receiver',
+        'all recipients refused',
+        'unknown field',
+    ]
+)
+def test_service_send_invalid(send_server, smtpc_config, request_data, expected_error):
+    response = send_request(smtpc_config / 'smtpc.sock', request_data)
+    assert response['ok'] is False
+    assert expected_error in response['error']
+
+
+def test_service_reloads_config(send_service, smtp_server):
+    send_service.send({'message': 'hello', 'address_to': ['receiver@smtpc.net']})
+
+    messages = PredefinedMessages.read()
+    messages.add(PredefinedMessage('bye', address_from='sender@smtpc.net', subject='Bye', profile='fake'))
+    # make sure modification is visible even on filesystems with coarse mtime
+    os.utime(config.PREDEFINED_MESSAGES_FILE, ns=(0, 0))
+
+    recipients, _ = send_service.send({'message': 'bye', 'address_to': ['receiver@smtpc.net']})
+    assert recipients == ['receiver@smtpc.net']
+    assert b'Subject: Bye' in smtp_server.messages[-1].data
+
+
+def test_service_decrypts_password_once(smtpc_config):
+    PredefinedProfiles().add(PredefinedProfile('secret', host='127.0.0.1', login='login', password='enc:encrypted'))
+    service = SendService(pool=ConnectionPool(), password_key='key')
+    service.reload()
+    profile = PredefinedProfiles.read()['secret']
+
+    with mock.patch('smtpc.encryption.decrypt', return_value='password') as decrypt:
+        assert service._get_password(profile) == 'raw:password'
+        assert service._get_password(profile) == 'raw:password'
+    decrypt.assert_called_once()
+
+
+def test_service_asks_for_password_key_lazily(smtpc_config):
+    profiles = PredefinedProfiles()
+    profiles.add(PredefinedProfile('plain', host='127.0.0.1', login='login', password='password'))
+    profiles.add(PredefinedProfile('secret', host='127.0.0.1', login='login', password='enc:encrypted'))
+    get_password_key = mock.Mock(return_value='key')
+    service = SendService(pool=ConnectionPool(), password_key=get_password_key)
+    service.reload()
+    profiles = PredefinedProfiles.read()
+
+    assert service._get_password(profiles['plain']) is None
+    get_password_key.assert_not_called()
+
+    with mock.patch('smtpc.encryption.decrypt', return_value='password') as decrypt:
+        assert service._get_password(profiles['secret']) == 'raw:password'
+        assert service._get_password(profiles['secret']) == 'raw:password'
+    get_password_key.assert_called_once_with()
+    assert decrypt.call_args.args[2] == 'key'
+
+
+@pytest.mark.parametrize('concurrency', [1, 3])
+def test_service_handle_stream(send_service, smtp_server, concurrency):
+    lines = [
+        json.dumps({'id': 'first', 'address_to': ['john@smtpc.net'], 'context': {'name': 'John'}}) + '\n',
+        '\n',
+        'not json\n',
+        json.dumps({'message': 'unknown'}) + '\n',
+        json.dumps({'address_to': ['jane@smtpc.net'], 'context': {'name': 'Jane'}}) + '\n',
+    ]
+    responses = []
+    failed = handle_stream(send_service, iter(lines), responses.append, concurrency=concurrency,
+        defaults={'message': 'hello'})
+
+    assert failed == 2
+    assert sorted(responses, key=lambda response: response['line']) == [
+        {'ok': True, 'recipients': ['john@smtpc.net'], 'rejects': {}, 'id': 'first', 'line': 1},
+        {'ok': False, 'error': 'Invalid request: Expecting value: line 1 column 1 (char 0)', 'line': 3},
+        {'ok': False, 'error': 'Unknown message: unknown', 'line': 4},
+        {'ok': True, 'recipients': ['jane@smtpc.net'], 'rejects': {}, 'line': 5},
+    ]
+    assert sorted(message.rcpt_to[0] for message in smtp_server.messages) == ['jane@smtpc.net', 'john@smtpc.net']
+
+
+def test_service_handle_stream_backpressure(send_service):
+    sending = threading.Semaphore(0)
+    release = threading.Event()
+
+    def handle_line(line, defaults=None):
+        sending.release()
+        release.wait(5)
+        return {'ok': True}
+
+    send_service.handle_line = handle_line
+    read = []
+
+    def lines():
+        for idx in range(5):
+            read.append(idx)
+            yield '{}\n'
+
+    thread = threading.Thread(target=handle_stream, args=(send_service, lines(), lambda response: None), kwargs={'concurrency': 2})
+    thread.start()
+    assert sending.acquire(timeout=5) and sending.acquire(timeout=5)
+    # third line is read, but waits for free slot
+    for _ in range(50):
+        if len(read) == 3:
+            break
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert read == [0, 1, 2]
+    release.set()
+    thread.join(5)
+    assert read == [0, 1, 2, 3, 4]
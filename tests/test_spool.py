@@ -0,0 +1,93 @@
+import pytest
+
+from smtpc.errors import SpoolError
+from smtpc.spool import Spool, SpoolEntry, retry_delay
+
+
+def create_entry(**kwargs):
+    params = dict(envelope_from='sender@smtpc.net', envelope_to=['receiver@smtpc.net'],
+        connection={'host': '127.0.0.1'}, message='Subject: test\n\nżółw\n')
+    params.update(kwargs)
+    return SpoolEntry(None, **params)
+
+
+@pytest.mark.parametrize('attempts, expected',
+    [
+        [0, 60],
+        [1, 60],
+        [2, 120],
+        [3, 240],
+        [10, 3600],
+    ]
+)
+def test_retry_delay(attempts, expected):
+    assert retry_delay(attempts, 60, 3600) == expected
+
+
+def test_spool_add_and_claim(tmp_path):
+    spool = Spool(tmp_path / 'spool')
+    first = spool.add(create_entry())
+    second = spool.add(create_entry(envelope_to=['receiver2@smtpc.net']))
+    assert len(spool) == 2
+    assert not list(spool.tmp.iterdir())
+
+    claimed = list(spool.claim())
+    assert [entry.id for entry in claimed] == [first.id, second.id]
+    assert claimed[0].message == 'Subject: test\n\nżółw\n'
+    assert claimed[0].connection == {'host': '127.0.0.1'}
+    assert claimed[1].envelope_to == ['receiver2@smtpc.net']
+    assert len(spool) == 0
+    assert len(list(spool.cur.iterdir())) == 2
+
+    spool.done(claimed[0])
+    assert [path.name for path in spool.cur.iterdir()] == [second.id]
+
+
+def test_spool_retry(tmp_path):
+    spool = Spool(tmp_path)
+    spool.add(create_entry(envelope_to=['receiver1@smtpc.net', 'receiver2@smtpc.net']))
+    entry, = spool.claim()
+
+    spool.retry(entry, ['receiver2@smtpc.net'], 'try again later', 60)
+    assert not list(spool.cur.iterdir())
+    assert len(spool) == 1
+    assert not list(spool.claim())
+
+    entry, = spool.claim(now=entry.next_attempt_at + 1)
+    assert entry.attempts == 1
+    assert entry.envelope_to == ['receiver2@smtpc.net']
+    assert entry.last_error == 'try again later'
+
+
+def test_spool_fail(tmp_path):
+    spool = Spool(tmp_path)
+    spool.add(create_entry())
+    entry, = spool.claim()
+
+    spool.fail(entry, entry.envelope_to, 'rejected')
+    assert len(spool) == 0
+    assert not list(spool.cur.iterdir())
+    failed = SpoolEntry.load(next(spool.failed.iterdir()))
+    assert failed.last_error == 'rejected'
+
+
+def test_spool_invalid_entry(tmp_path):
+    spool = Spool(tmp_path)
+    spool.ensure()
+    (spool.new / 'broken').write_text('not a json\n')
+    assert not list(spool.claim())
+    assert [path.name for path in spool.failed.iterdir()] == ['broken']
+
+
+def test_spool_lock_and_recover(tmp_path):
+    spool = Spool(tmp_path)
+    spool.add(create_entry())
+    list(spool.claim())
+
+    with spool.lock():
+        with pytest.raises(SpoolError):
+            with Spool(tmp_path).lock():
+                pass
+        spool.recover()
+
+    assert len(spool) == 1
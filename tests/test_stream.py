@@ -0,0 +1,75 @@
+import io
+import re
+import sys
+
+import pytest
+
+from smtpc.errors import SMTPcError
+from smtpc.message import message_to_bytes
+from smtpc.stream import FileMessageStream, encode_data
+
+
+def smtplib_data(message):
+    """What smtplib.SMTP.data sends for the message."""
+    data = re.sub(br'(?m)^\.', b'..', message_to_bytes(message))
+    if data[-2:] != b'\r\n':
+        data += b'\r\n'
+    return data + b'.\r\n'
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('message',
+    [
+        'Subject: test\n\nbody\n',
+        'Subject: test\r\n\r\n.leading dot\r\n..two dots\n.\nend',
+        'lone\rcarriage\rreturns\r',
+        '.',
+        '',
+        'a\r\n.\r\n.b\r\r\n\n.c',
+    ]
+)
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 1024])
+def test_encode_data(message, chunk_size):
+    chunks = split(message.encode('ascii'), chunk_size)
+    assert b''.join(encode_data(chunks)) == smtplib_data(message)
+
+
+def test_encode_data_keeps_chunks_small():
+    chunks = (b'x' * 1023 + b'\n' for _ in range(1000))
+    assert max(len(chunk) for chunk in encode_data(chunks)) <= 1025
+
+
+def test_message_stream_file(tmp_path):
+    path = tmp_path / 'message.eml'
+    path.write_bytes(b'Subject: test\n\n' + b'body\n' * 100)
+
+    stream = FileMessageStream(str(path), chunk_size=16)
+    # line endings are converted to CRLF when sent
+    assert stream.size == 617
+    assert max(len(chunk) for chunk in stream.chunks()) == 16
+    # file is read again for every transaction
+    assert b''.join(stream.chunks()) == b''.join(stream.chunks()) == path.read_bytes()
+
+
+@pytest.mark.parametrize('message', [b'Subject: test\n\n.leading dot\nno newline at the end', b'', b'a\r\rb\r'])
+def test_message_stream_file_size(tmp_path, message):
+    path = tmp_path / 'message.eml'
+    path.write_bytes(message)
+
+    stream = FileMessageStream(str(path), chunk_size=3)
+    # size declared with SIZE= doesn't include dot stuffing and the terminating dot (RFC 1870)
+    sent = b''.join(encode_data(stream.chunks()))
+    assert stream.size == len(sent) - sent.count(b'\n..') - len(b'.\r\n')
+
+
+def test_message_stream_stdin_read_once(monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(b'Subject: test\n\nbody\n')))
+
+    stream = FileMessageStream('-')
+    assert stream.size is None
+    assert b''.join(stream.chunks()) == b'Subject: test\n\nbody\n'
+    with pytest.raises(SMTPcError):
+        list(stream.chunks())
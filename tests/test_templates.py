@@ -1,9 +1,18 @@
+from unittest import mock
+
 import pytest
 
+from smtpc import config
 from smtpc import message
+from smtpc import templating
 from smtpc.errors import InvalidTemplateFieldNameError, InvalidJsonTemplateError
 from smtpc.message import SimpleTemplate
 
+try:
+    import jinja2
+except ImportError:
+    jinja2 = None
+
 
 @pytest.mark.parametrize('name', [
     'a',
@@ -90,3 +99,135 @@ def test_simple_template_valid(tpl, fields, expected):
     t = SimpleTemplate(tpl)
     v = t.render(**fields)
     assert v == expected
+
+
+@pytest.fixture
+def clean_templates_cache():
+    templating.compile_template.cache_clear()
+    templating.template_variables.cache_clear()
+    templating._environments.clear()
+    yield
+    templating.compile_template.cache_clear()
+    templating.template_variables.cache_clear()
+    templating._environments.clear()
+
+
+@pytest.mark.skipif(templating.jinja2 is None, reason='requires Jinja2')
+def test_compile_template(clean_templates_cache, templates_cache_dir):
+    tpl = templating.compile_template('Hello {{ name }}{% if admin %}, admin{% endif %}')
+    assert tpl.render(name='John', admin=True) == 'Hello John, admin'
+    assert templating.compile_template('Hello {{ name }}{% if admin %}, admin{% endif %}') is tpl
+    assert len(list(templates_cache_dir.iterdir())) == 1
+
+
+@pytest.mark.skipif(templating.jinja2 is None, reason='requires Jinja2')
+def test_compile_template_bytecode_cache(clean_templates_cache, templates_cache_dir, monkeypatch):
+    templating.compile_template('Hello {{ name }}')
+
+    # next process: template is loaded from bytecode cache, without compiling it
+    templating.compile_template.cache_clear()
+    templating._environments.clear()
+    monkeypatch.setattr(jinja2.Environment, 'compile', mock.Mock(side_effect=AssertionError('compiled again')))
+    assert templating.compile_template('Hello {{ name }}').render(name='Jane') == 'Hello Jane'
+
+
+@pytest.mark.skipif(templating.jinja2 is None, reason='requires Jinja2')
+def test_template_variables_cache(clean_templates_cache, templates_cache_dir, monkeypatch):
+    source = 'Hello {{ name }}{% for item in items %}{{ item }}{% endfor %}'
+    assert templating.template_variables(source) == {'name', 'items'}
+
+    # next process: variables are read from cache, without parsing template
+    templating.compile_template.cache_clear()
+    templating.template_variables.cache_clear()
+    templating._environments.clear()
+    monkeypatch.setattr(jinja2.Environment, 'parse', mock.Mock(side_effect=AssertionError('parsed again')))
+    assert templating.template_variables(source) == {'name', 'items'}
+
+
+@pytest.mark.skipif(templating.jinja2 is None, reason='requires Jinja2')
+def test_compile_template_cache_dir_not_writable(clean_templates_cache, tmp_path, monkeypatch):
+    (tmp_path / 'file').write_text('')
+    monkeypatch.setattr(config, 'TEMPLATES_CACHE_DIR', tmp_path / 'file' / 'templates')
+    assert templating.compile_template('Hello {{ name }}').render(name='John') == 'Hello John'
+    assert templating.get_environment().bytecode_cache is None
+
+
+def test_compile_template_without_jinja(clean_templates_cache, monkeypatch):
+    monkeypatch.setattr(templating, 'jinja2', None)
+    tpl = templating.compile_template('Hello {{ name }}')
+    assert isinstance(tpl, SimpleTemplate)
+    assert tpl.render(name='John') == 'Hello John'
+
+
+@pytest.mark.parametrize('tpl, fields, expected', [
+    ['{{ path }}', {'path': r'C:\new\table'}, r'C:\new\table'],
+    ['{{ value }}', {'value': r'\1 \g<0>'}, r'\1 \g<0>'],
+    ['{{ a }} {{ b }}', {'a': '{{ b }}', 'b': 'B'}, '{{ b }} B'],
+    ['{{a}}{{a}}{{ a }}', {'a': 1}, '111'],
+    ['{{ a }} {{ missing }} {{ \nb\n }}', {'a': None, 'b': [1]}, 'None {{ missing }} [1]'],
+])
+def test_simple_template_values(tpl, fields, expected):
+    assert SimpleTemplate(tpl).render(**fields) == expected
+
+
+def test_simple_template_many_fields():
+    fields = {f'field_{idx}': idx for idx in range(1000)}
+    tpl = ''.join(f'<td>{{{{ field_{idx} }}}}</td>' for idx in range(1000)) * 10
+    assert SimpleTemplate(tpl).render(**fields) == ''.join(f'<td>{idx}</td>' for idx in range(1000)) * 10
+
+
+@pytest.mark.parametrize('text, expected', [
+    ['', False],
+    ['plain {text}', False],
+    ['Hello {{ name }}', True],
+    ['{% if a %}a{% endif %}', True],
+    ['{# comment #}', True],
+])
+def test_is_template(text, expected):
+    assert templating.is_template(text) is expected
+
+
+@pytest.mark.skipif(templating.jinja2 is None, reason='requires Jinja2')
+@pytest.mark.parametrize('text', ['', 'plain', 'plain\n', 'two\n\n', 'crlf\r\nline\r\n', 'cr\rline'])
+def test_static_text_same_as_rendered(text):
+    assert templating.static_text(text) == jinja2.Template(text).render()
+
+
+def test_static_text_without_jinja(monkeypatch):
+    monkeypatch.setattr(templating, 'jinja2', None)
+    assert templating.static_text('plain\r\n') == 'plain\r\n'
+
+
+@pytest.mark.skipif(templating.jinja2 is None, reason='requires Jinja2')
+def test_template_variables(clean_templates_cache):
+    variables = templating.template_variables('{% for item in items %}{{ item }} {{ smtpc_to[0] }}{% endfor %}{% set x = 1 %}{{ x }}')
+    assert variables == {'items', 'smtpc_to'}
+
+
+def test_template_variables_without_jinja(clean_templates_cache, monkeypatch):
+    monkeypatch.setattr(templating, 'jinja2', None)
+    assert templating.template_variables('{{ name }} {{ smtpc_to }} {{name}}') == {'name', 'smtpc_to'}
+
+
+def test_builder_template_static_text(monkeypatch):
+    monkeypatch.setattr(message, 'compile_template', mock.Mock(side_effect=AssertionError('rendered')))
+    builder = message.Builder(subject='Static {subject}', envelope_from=None, address_from=None, envelope_to=None,
+        address_to=['smtpc@example.net'], address_cc=None, address_bcc=None, reply_to=None, body_type=None,
+        body='Static body\n', template_fields=['name=John'])
+    assert builder.template(builder.subject) == 'Static {subject}'
+    assert builder.template(builder.body) == templating.static_text('Static body\n')
+    assert builder.execute()['Subject'] == 'Static {subject}'
+
+
+def test_builder_template_lazy_default_fields(monkeypatch):
+    calls = []
+    fields = {name: (lambda name, value: lambda builder: calls.append(name) or value(builder))(name, value)
+        for name, value in message.Builder.TEMPLATE_DEFAULT_FIELDS.items()}
+    monkeypatch.setattr(message.Builder, 'TEMPLATE_DEFAULT_FIELDS', fields)
+
+    builder = message.Builder(subject=None, envelope_from=None, address_from='smtpc@example.com', envelope_to=None,
+        address_to=['smtpc@example.net'], address_cc=None, address_bcc=None, reply_to=None, body_type=None,
+        template_fields=['name=John'])
+    assert builder.template('{{ name }} to {{ smtpc_to[0] }}') == 'John to smtpc@example.net'
+    assert calls == ['smtpc_to']
+    assert builder.template_default_fields['smtpc_from'] == 'smtpc@example.com'
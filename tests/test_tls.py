@@ -0,0 +1,57 @@
+import socket
+import ssl
+import threading
+
+import pytest
+
+from smtpc import tls
+from .smtpserver import tls_server_context
+
+pytest.importorskip('cryptography')
+
+
+@pytest.fixture
+def tls_server(tmp_path):
+    context = tls_server_context(tmp_path)
+    listener = socket.create_server(('127.0.0.1', 0))
+
+    def _serve():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            try:
+                with context.wrap_socket(conn, server_side=True) as ssl_conn:
+                    ssl_conn.sendall(b'220 hello\r\n')
+                    ssl_conn.recv(1024)
+            except (OSError, ssl.SSLError):
+                pass
+
+    thread = threading.Thread(target=_serve, daemon=True)
+    thread.start()
+    yield listener.getsockname()
+    listener.close()
+
+
+def _connect(context, address):
+    with context.wrap_socket(socket.create_connection(address), server_hostname='localhost') as ssl_sock:
+        ssl_sock.recv(1024)
+        reused = ssl_sock.session_reused
+        ssl_sock.sendall(b'QUIT\r\n')
+    return reused
+
+
+def test_session_resumption(tls_server):
+    context = tls._create_context()
+    assert _connect(context, tls_server) is False
+    assert _connect(context, tls_server) is True
+
+    context.forget_session('localhost')
+    assert _connect(context, tls_server) is False
+
+
+def test_get_context_is_shared():
+    assert tls.get_context('profile1') is tls.get_context('profile1')
+    assert tls.get_context('profile1') is not tls.get_context('profile2')
+    assert tls.get_context('profile1').verify_mode == ssl.CERT_NONE